@@ -1,9 +1,30 @@
 # src/app.py
 
-from ui.main_window import main
+import time
+
+# Taken before anything else is imported, so --profile-startup covers imports
+_STARTED_NS = time.perf_counter_ns()
+
+import sys
+
+
+def main(argv=None):
+    """With arguments, run the headless command line; without, open the GUI."""
+    if getattr(sys, 'frozen', False):
+        # A frozen build is started again for the engine process (see engine.process)
+        import multiprocessing
+        multiprocessing.freeze_support()
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv:
+        from engine.cli import main as cli_main
+        return cli_main(argv, _STARTED_NS)
+    # Qt is only imported when the window is actually wanted
+    from ui.main_window import main as gui_main
+    return gui_main()
 
 def run():
     main()
 
 if __name__ == "__main__":
-    run()
+    sys.exit(main())
@@ -0,0 +1,2 @@
+# src/engine/__init__.py
+# Playback engine: timing, and everything the macro runner needs without Qt
@@ -0,0 +1,209 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from engine.fileio import atomic_write
+from engine.paths import AUTOSAVE_PATH
+
+# An edit is (kind, track, row, old, new), small enough to journal one per change.
+# ROWS: rows `old` at `row` of `track` were replaced by rows `new`
+ROWS = "rows"
+# TRACK: `track` was inserted (old is None, new its rows) or removed (old its rows, new None)
+TRACK = "track"
+# VARS: the variables text changed from old to new; track and row are None
+VARS = "vars"
+
+# Seconds without edits before they are written
+AUTOSAVE_DELAY = 1.0
+# Edits that can be undone
+UNDO_LIMIT = 1000
+# The journal is folded into the snapshot once it has more edits than the
+# macro has rows, and never for fewer than this many
+COMPACT_MIN = 256
+JOURNAL_SUFFIX = '.journal'
+
+JSON_COMPACT = (',', ':')
+
+
+def apply_edit(state, edit, undo=False):
+    """Apply edit, or undo it, to a state {"tracks": [[row, ...], ...], "vars": text}."""
+    kind, track, row, old, new = edit
+    if undo:
+        old, new = new, old
+    if kind == ROWS:
+        state["tracks"][track][row:row + len(old)] = new
+    elif kind == TRACK:
+        if new is None:
+            del state["tracks"][track]
+        else:
+            state["tracks"].insert(track, list(new))
+    else:
+        state["vars"] = new
+
+
+def rows_to_actions(rows):
+    """Saved-format action dicts from (type, value, hold, wait) rows."""
+    return [{"type": type_, "value": value, "hold": hold, "wait": wait} for type_, value, hold, wait in rows]
+
+
+def recover(path=AUTOSAVE_PATH):
+    """The autosaved state {"name", "saved", "vars", "tracks"}, or None.
+
+    "saved" is False when it has edits that never made it into the library.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    try:
+        with open(path + JOURNAL_SUFFIX, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        lines = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # Torn by a crash mid-write
+            continue
+        if record.get("base") != state.get("id"):
+            # Made before the snapshot, which already has it
+            continue
+        if "edit" in record:
+            apply_edit(state, record["edit"])
+            state["saved"] = False
+        else:
+            state["name"] = record["saved"]
+            state["saved"] = True
+    return state
+
+
+class Autosaver(threading.Thread):
+    """Writes the macro being edited to disk in the background.
+
+    The GUI thread only queues edits (see ActionTableModel.edited); it never
+    waits on disk. Once no edit has arrived for `delay` seconds the writer
+    appends the queued ones to a journal next to the snapshot, one line each,
+    and fsyncs once. When the journal holds more edits than the macro has
+    rows it is folded into a new snapshot, written to a temp file and
+    renamed over the old one. A save therefore costs about as much as the
+    edits it writes, and a crash loses at most the last few seconds.
+    """
+
+    def __init__(self, path=AUTOSAVE_PATH, delay=AUTOSAVE_DELAY):
+        super().__init__(daemon=True)
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.delay = delay
+        self._pending = deque()
+        self._changed_at = 0.0
+        self._wake = threading.Event()
+        self._closing = threading.Event()
+        # The writer's own copy of the edited macro, kept current by applying edits
+        self.state = None
+        self._journal = None
+        self._journal_edits = 0
+        # Last write error, e.g. a full disk; the next write tries again, with a full snapshot
+        self.error = None
+
+    # Called from the GUI thread; each is one deque append
+
+    def record(self, edit):
+        self._pending.append(("edit", edit))
+        self._changed_at = time.monotonic()
+        self._wake.set()
+
+    def reset(self, name, tracks, variables, saved=True):
+        """Start over from a whole macro, e.g. after loading one. tracks are lists of row tuples."""
+        state = {"name": name, "saved": saved, "vars": variables, "tracks": [list(t) for t in tracks]}
+        self._pending.append(("reset", state))
+        self._changed_at = time.monotonic()
+        self._wake.set()
+
+    def mark_saved(self, name):
+        self._pending.append(("saved", name))
+        self._wake.set()
+
+    def close(self):
+        """Write whatever is still queued and stop."""
+        self._closing.set()
+        self._wake.set()
+        if self.is_alive():
+            self.join()
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    # Writer thread
+
+    def run(self):
+        while True:
+            self._wake.wait()
+            # Debounce: wait for a quiet spell, unless closing
+            while not self._closing.is_set():
+                quiet = self._changed_at + self.delay - time.monotonic()
+                if quiet <= 0:
+                    break
+                self._closing.wait(quiet)
+            self._wake.clear()
+            try:
+                self._write()
+            except OSError as e:
+                self.error = e
+            else:
+                self.error = None
+            if self._closing.is_set() and not self._pending:
+                break
+
+    def _write(self):
+        state = self.state
+        lines = []
+        # After a failed write the journal may be missing edits
+        snapshot = self.error is not None
+        while self._pending:
+            kind, payload = self._pending.popleft()
+            if kind == "reset":
+                state = self.state = payload
+                lines = []
+                snapshot = True
+                continue
+            if state is None:
+                continue
+            if kind == "saved":
+                state["name"] = payload
+                state["saved"] = True
+                lines.append({"saved": payload})
+            else:
+                apply_edit(state, payload)
+                state["saved"] = False
+                lines.append({"edit": payload})
+        if state is None:
+            return
+        rows = sum(len(track) for track in state["tracks"])
+        if snapshot or self._journal_edits + len(lines) > max(COMPACT_MIN, rows):
+            self._snapshot()
+        elif lines:
+            self._append(lines)
+
+    def _snapshot(self):
+        # Journal lines name the snapshot they follow, so lines left over from
+        # an older one (if we crash before truncating) are never replayed
+        self.state["id"] = time.time_ns()
+        atomic_write(self.path, json.dumps(self.state, separators=JSON_COMPACT))
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, 'w', encoding='utf-8')
+        self._journal_edits = 0
+
+    def _append(self, lines):
+        if self._journal is None:
+            self._journal = open(self.journal_path, 'a', encoding='utf-8')
+        base = self.state["id"]
+        self._journal.write("".join(json.dumps(dict(line, base=base), separators=JSON_COMPACT) + "\n"
+                                    for line in lines))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._journal_edits += len(lines)
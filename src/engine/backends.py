@@ -0,0 +1,176 @@
+from array import array
+
+from engine.program import OP_KEY_DOWN, OP_KEY_UP, OP_MOUSE_DOWN, OP_MOUSE_UP
+from engine.timing import now_ns
+
+
+class InputBackend:
+    """Where the runner sends input.
+
+    resolve_key/resolve_button turn table values into whatever the backend
+    wants to be handed at dispatch time; they run once, at compile time.
+
+    Inputs due at the same instant (chords, a release straight followed by
+    a press) are handed over together. Backends that can inject several
+    inputs in one call set supports_batch and override send_batch(); for the
+    others the runner calls the handlers back to back.
+    """
+    name = "base"
+    supports_batch = False
+    # What calibration taps and clicks; harmless in most games and in our own window
+    calibration_key = "shift"
+    calibration_button = "middle"
+
+    def resolve_key(self, name):
+        return name
+
+    def resolve_button(self, name):
+        return name
+
+    def key_down(self, code):
+        raise NotImplementedError
+
+    def key_up(self, code):
+        raise NotImplementedError
+
+    def mouse_down(self, button):
+        raise NotImplementedError
+
+    def mouse_up(self, button):
+        raise NotImplementedError
+
+    def send_batch(self, ops, codes):
+        """Send inputs meant for the same instant: ops[i] with codes[i], in order.
+
+        The lists are reused by the caller, so don't keep them.
+        """
+        handlers = self.handlers()
+        for op, code in zip(ops, codes):
+            handlers[op](code)
+
+    def warm_up(self):
+        """Import and initialise whatever the backend needs, so the first input isn't slowed by it."""
+
+    def handlers(self):
+        """Dispatch callables indexed by opcode."""
+        return (None, self.key_down, self.key_up, self.mouse_down, self.mouse_up)
+
+
+class SystemBackend(InputBackend):
+    """Real input through the keyboard and pyautogui libraries.
+
+    Both are slow to import (pyautogui pulls in its screenshot and GUI
+    helpers), so nothing is imported until the backend is first used;
+    warm_up() does it ahead of time.
+    """
+    name = "system"
+
+    def __init__(self):
+        self._keyboard = None
+        self._pyautogui = None
+        # How long the first use spent importing, for startup profiling
+        self.import_ns = None
+
+    def warm_up(self):
+        if self._keyboard is not None:
+            return
+        started = now_ns()
+        import keyboard
+        import pyautogui
+        # pyautogui sleeps PAUSE (0.1s) after every call, which silently
+        # stretches holds and gaps. The runner does its own timing.
+        pyautogui.PAUSE = 0
+        self._pyautogui = pyautogui
+        self._keyboard = keyboard
+        self.import_ns = now_ns() - started
+
+    def resolve_key(self, name):
+        self.warm_up()
+        # keyboard parses names on every press; scan codes skip that
+        return self._keyboard.key_to_scan_codes(name)[0]
+
+    def key_down(self, code):
+        self._keyboard.press(code)
+
+    def key_up(self, code):
+        self._keyboard.release(code)
+
+    def mouse_down(self, button):
+        self._pyautogui.mouseDown(button=button)
+
+    def mouse_up(self, button):
+        self._pyautogui.mouseUp(button=button)
+
+    def handlers(self):
+        self.warm_up()
+        keyboard = self._keyboard
+        return (None, keyboard.press, keyboard.release, self.mouse_down, self.mouse_up)
+
+
+class NullBackend(InputBackend):
+    """Accepts and drops everything. Measures pure engine overhead."""
+    name = "null"
+
+    def key_down(self, code):
+        pass
+
+    key_up = mouse_down = mouse_up = key_down
+
+
+class RecordingBackend(InputBackend):
+    """Logs every event with a now_ns timestamp instead of sending it.
+
+    Works headless, so the engine can be tested and benchmarked without a display.
+    A batch is logged the way bulk injection delivers it: every event in it
+    with the same timestamp.
+    """
+    name = "recording"
+    supports_batch = True
+
+    def __init__(self):
+        self.times = array('q')
+        self.ops = array('b')
+        self.codes = []
+
+    def _record(self, op, code):
+        self.times.append(now_ns())
+        self.ops.append(op)
+        self.codes.append(code)
+
+    def key_down(self, code):
+        self._record(OP_KEY_DOWN, code)
+
+    def key_up(self, code):
+        self._record(OP_KEY_UP, code)
+
+    def mouse_down(self, button):
+        self._record(OP_MOUSE_DOWN, button)
+
+    def mouse_up(self, button):
+        self._record(OP_MOUSE_UP, button)
+
+    def send_batch(self, ops, codes):
+        at = now_ns()
+        self.times.extend([at] * len(ops))
+        self.ops.extend(ops)
+        self.codes.extend(codes)
+
+    def clear(self):
+        del self.times[:]
+        del self.ops[:]
+        del self.codes[:]
+
+    def events(self):
+        """(timestamp_ns, opcode, code) tuples in dispatch order."""
+        return list(zip(self.times, self.ops, self.codes))
+
+    def __len__(self):
+        return len(self.times)
+
+
+# Backends by name, for the command line
+BACKENDS = {
+    SystemBackend.name: SystemBackend,
+    NullBackend.name: NullBackend,
+    RecordingBackend.name: RecordingBackend,
+}
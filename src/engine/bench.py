@@ -0,0 +1,325 @@
+"""Headless benchmarks for the playback hot loop.
+
+Run from src/:  python -m engine.bench [--sizes 10 100 1000] [--step-us 50]
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from engine.backends import NullBackend, RecordingBackend
+from engine.library import MacroLibrary
+from engine.playlist import compile_macro
+from engine.process import EngineProcess
+from engine.program import compile_sequence
+from engine.runner import MacroRunner
+from engine.timing import now_ns
+from engine.trace import Tracer
+
+DEFAULT_SIZES = (10, 100, 1000, 10000, 100000)
+# Minimum number of instructions a throughput run dispatches, spread over loops
+MIN_DISPATCHES = 200_000
+
+
+def make_sequence(actions, hold=0.0, wait=0.0):
+    """Alternating key/mouse taps, `actions` rows long, like get_sequence builds them."""
+    keys = "asdfjkl"
+    sequence = []
+    for i in range(actions):
+        if i % 5 == 4:
+            sequence.append({"type": "mouse", "value": "left", "hold": hold})
+        else:
+            sequence.append({"type": "key", "value": keys[i % len(keys)], "hold": hold})
+        if wait > 0:
+            sequence.append({"type": "wait", "value": wait})
+    return sequence
+
+
+def dispatch_count(program):
+    return sum(1 for op in program.ops if op > 0)
+
+
+def run_program(program, loops, backend, tracer=None):
+    runner = MacroRunner(program, loops, threading.Event(), backend, tracer=tracer)
+    started = now_ns()
+    runner.run()
+    return runner, now_ns() - started
+
+
+def bench_throughput(actions):
+    """Back-to-back dispatch with zero durations: pure engine overhead."""
+    backend = NullBackend()
+    program = compile_sequence(make_sequence(actions), backend)
+    loops = max(1, MIN_DISPATCHES // dispatch_count(program))
+    runner, elapsed = run_program(program, loops, backend)
+    dispatches = dispatch_count(program) * loops
+    return {
+        "actions": actions,
+        "loops_per_s": loops / (elapsed / 1e9),
+        "ns_per_dispatch": elapsed / dispatches,
+    }
+
+
+def bench_tracks(tracks, actions=1000):
+    """Zero-duration tracks played together: scheduler overhead as tracks are added."""
+    backend = NullBackend()
+    programs = [compile_sequence(make_sequence(actions), backend) for _ in range(tracks)]
+    dispatches_per_loop = sum(dispatch_count(p) for p in programs)
+    loops = max(1, MIN_DISPATCHES // dispatches_per_loop)
+    runner, elapsed = run_program(programs, loops, backend)
+    return {
+        "tracks": tracks,
+        "ns_per_dispatch": elapsed / (dispatches_per_loop * loops),
+    }
+
+
+def bench_trace(actions=1000):
+    """Dispatch overhead with tracing off and on."""
+    backend = NullBackend()
+    program = compile_sequence(make_sequence(actions), backend)
+    loops = max(1, MIN_DISPATCHES // dispatch_count(program))
+    dispatches = dispatch_count(program) * loops
+    _, plain = run_program(program, loops, backend)
+    _, traced = run_program(program, loops, backend, Tracer())
+    return {
+        "actions": actions,
+        "off_ns": plain / dispatches,
+        "on_ns": traced / dispatches,
+    }
+
+
+def bench_screen(size, factor):
+    """One until poll's comparison against a synthetic region, matching and not."""
+    import numpy as np
+    from engine.screen import Reference, downsample
+
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    reference = Reference("bench", (0, 0, size, size), downsample(frame, factor), factor)
+    other = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    polls = 2000
+    started = now_ns()
+    for _ in range(polls):
+        reference.matches(frame)
+        reference.matches(other)
+    return {
+        "region_px": size,
+        "factor": factor,
+        "us_per_poll": (now_ns() - started) / (2 * polls) / 1e3,
+        "correct": "yes" if reference.matches(frame) and not reference.matches(other) else "no",
+    }
+
+
+def bench_binary(rows):
+    """Opening a long zero-hold recording saved as JSON vs binary, and playing each."""
+    rng = random.Random(0)
+    keys = "abcdefghijklmnopqrstuvwxyz"
+    # Random keys, so the optimizer has no runs of identical rows to fold
+    actions = [{"type": "key", "value": rng.choice(keys), "hold": 0.0, "wait": 0.0} for _ in range(rows)]
+    backend = NullBackend()
+    result = {"rows": rows}
+    with tempfile.TemporaryDirectory() as root:
+        library = MacroLibrary(root)
+        for kind, binary in (("json", False), ("bin", True)):
+            library.save(kind, actions, binary=binary)
+            path = library.binary_path(kind) if binary else library.path(kind)
+            tracemalloc.start()
+            started = now_ns()
+            programs = compile_macro(library, kind, backend)
+            elapsed = now_ns() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            _, played = run_program(programs, 1, backend)
+            result[f"{kind}_mb"] = os.path.getsize(path) / 1e6
+            result[f"{kind}_open_ms"] = elapsed / 1e6
+            result[f"{kind}_peak_mb"] = peak / 1e6
+            result[f"{kind}_ns_disp"] = played / dispatch_count(programs[0])
+            del programs
+    return result
+
+
+class SinkBackend(RecordingBackend):
+    """A recording backend whose every call costs call_ns, like a real injection API.
+
+    With bulk it takes a whole batch in one call, otherwise the runner falls
+    back to one call per input.
+    """
+    name = "sink"
+
+    def __init__(self, call_ns, bulk):
+        super().__init__()
+        self.call_ns = call_ns
+        self.supports_batch = bulk
+
+    def _record(self, op, code):
+        _spin(self.call_ns)
+        super()._record(op, code)
+
+    def send_batch(self, ops, codes):
+        _spin(self.call_ns)
+        super().send_batch(ops, codes)
+
+
+def _spin(ns):
+    end = now_ns() + ns
+    while now_ns() < end:
+        pass
+
+
+def chord_tracks(chord, hold, backend, actions=200):
+    """chord tracks, each tapping its own key on the same beat."""
+    keys = "asdfjklqwertyuiop"
+    sequence = lambda key: [{"type": "key", "value": key, "hold": hold, "wait": hold}] * actions
+    return [compile_sequence(sequence(keys[i % len(keys)]), backend) for i in range(chord)]
+
+
+def bench_batch(chord, bulk, call_us=20):
+    """Chords on a fake sink: spread of each chord on arrival, and events/sec at zero durations."""
+    call_ns = int(call_us * 1000)
+    backend = SinkBackend(call_ns, bulk)
+    run_program(chord_tracks(chord, 0.002, backend), 1, backend)
+    # Every track presses and releases together, so the log is in chunks of chord events
+    skews = sorted(max(backend.times[i:i + chord]) - min(backend.times[i:i + chord])
+                   for i in range(0, len(backend), chord))
+
+    backend = SinkBackend(call_ns, bulk)
+    programs = chord_tracks(chord, 0.0, backend)
+    _, elapsed = run_program(programs, 20, backend)
+    return {
+        "chord": chord,
+        "sink": "bulk" if bulk else "per call",
+        "skew_p50_us": skews[len(skews) // 2] / 1e3,
+        "skew_max_us": skews[-1] / 1e3,
+        "events_per_s": len(backend) / (elapsed / 1e9),
+    }
+
+
+def _gui_load(stop):
+    """Stands in for a busy GUI thread: bursts of short-lived objects with cycles, at 60 fps."""
+    while not stop.is_set():
+        burst_end = now_ns() + 8_000_000
+        while now_ns() < burst_end:
+            nodes = [{"row": i} for i in range(200)]
+            for a, b in zip(nodes, nodes[1:] + nodes[:1]):
+                a["next"] = b
+        stop.wait(0.008)
+
+
+def bench_process(out_of_process, load, actions=1000, step_us=500):
+    """Lateness of paced playback in this process or a separate one, with and without GUI-like load."""
+    step = step_us / 1e6
+    backend = RecordingBackend()
+    program = compile_sequence(make_sequence(actions, hold=step, wait=step), backend)
+    if out_of_process:
+        # Leave the engine process time to start before the first input
+        runner = EngineProcess(program, 1, backend.name, start_at_ns=now_ns() + 1_000_000_000)
+    else:
+        runner = MacroRunner(program, 1, threading.Event(), backend)
+    stop = threading.Event()
+    loader = threading.Thread(target=_gui_load, args=(stop,), daemon=True)
+    if load:
+        loader.start()
+    runner.start()
+    while runner.is_alive():
+        time.sleep(0.05)
+    stop.set()
+    _, samples = runner.telemetry.recent_lateness(0)
+    late = sorted(late for _, late in samples)
+    return {
+        "engine": "process" if out_of_process else "thread",
+        "gui_load": "yes" if load else "no",
+        "p50_us": late[len(late) // 2] / 1e3,
+        "p99_us": late[int(len(late) * 0.99)] / 1e3,
+        "max_us": late[-1] / 1e3,
+    }
+
+
+def bench_timing(actions, step_us):
+    """Paced playback on the recording backend, compared against the planned timeline."""
+    step = step_us / 1e6
+    backend = RecordingBackend()
+    program = compile_sequence(make_sequence(actions, hold=step, wait=step), backend)
+    runner, _ = run_program(program, 1, backend)
+
+    errors = []
+    deadline = runner.start_ns
+    recorded = iter(backend.times)
+    for pc in range(len(program)):
+        if program.ops[pc] > 0:
+            errors.append(next(recorded) - deadline)
+            last_planned = deadline
+        deadline += program.durs[pc]
+    drift = backend.times[-1] - last_planned
+    errors.sort()
+    return {
+        "actions": actions,
+        "mean_err_us": sum(errors) / len(errors) / 1e3,
+        "p99_err_us": errors[int(len(errors) * 0.99)] / 1e3,
+        "max_err_us": errors[-1] / 1e3,
+        "end_drift_us": drift / 1e3,
+    }
+
+
+def bench_stop(wait_s, stop_after_s=0.05):
+    """Stop mid-hold and mid-wait of a slow macro and time until everything is released."""
+    backend = RecordingBackend()
+    sequence = [
+        {"type": "key", "value": "w", "hold": wait_s},
+        {"type": "mouse", "value": "left", "hold": 0.0},
+        {"type": "wait", "value": wait_s},
+    ]
+    program = compile_sequence(sequence, backend)
+    runner = MacroRunner(program, float('inf'), threading.Event(), backend)
+    runner.start()
+    time.sleep(stop_after_s)
+    runner.stop()
+    runner.join()
+    return {
+        "wait_s": wait_s,
+        "stop_latency_ms": runner.stop_latency_ns / 1e6,
+        "still_held": len(runner.held),
+    }
+
+
+def print_table(title, rows):
+    print(title)
+    columns = list(rows[0])
+    print("  ".join(f"{c:>14}" for c in columns))
+    for row in rows:
+        print("  ".join(f"{row[c]:>14.2f}" if isinstance(row[c], float) else f"{row[c]:>14}" for c in columns))
+    print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="sequence lengths (actions) to benchmark")
+    parser.add_argument("--step-us", type=float, default=50.0,
+                        help="hold and wait per action for the timing run, in microseconds")
+    args = parser.parse_args(argv)
+
+    print_table("throughput (null backend)", [bench_throughput(n) for n in args.sizes])
+    print_table("multi-track overhead (null backend, 1000 actions per track)",
+                [bench_tracks(k) for k in (1, 2, 4, 16, 64)])
+    print_table("tracing overhead per dispatch (null backend)", [bench_trace()])
+    try:
+        print_table("screen condition compare (synthetic frames, capture not included)",
+                    [bench_screen(size, factor) for size in (64, 256, 1024) for factor in (1, 4)])
+    except ImportError:
+        print("screen condition compare skipped: numpy is not installed\n")
+    print_table("saved recording: open (load + compile) and play, json vs binary (null backend)",
+                [bench_binary(n) for n in (10_000, 100_000)])
+    print_table("simultaneous inputs (fake sink, 20us per call)",
+                [bench_batch(chord, bulk) for chord in (2, 4, 8) for bulk in (False, True)])
+    print_table(f"timing error (recording backend, {args.step_us:g}us steps)",
+                [bench_timing(n, args.step_us) for n in args.sizes])
+    print_table("jitter with a busy gui thread (recording backend, 500us steps)",
+                [bench_process(out, load) for out in (False, True) for load in (False, True)])
+    print_table("stop latency (recording backend)", [bench_stop(w) for w in (0.01, 1.0, 60.0)])
+
+
+if __name__ == "__main__":
+    main()
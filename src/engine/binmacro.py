@@ -0,0 +1,267 @@
+"""Binary macro files (.fzm): fixed-size records, a string table and a seekable index.
+
+Layout, little-endian, every section starting on an 8-byte boundary:
+
+    header    magic, version, flags, track/string/variable counts and the
+              offsets of the sections below
+    strings   u32 length + UTF-8 bytes each; index 0 is always ""
+    vars      (u32 name string, f64 value) each
+    index     one TRACK entry per track
+    per track records (one RECORD per table row), then optionally the
+              compiled program: ops i8, args i32, durs i64, rows i32 columns
+              and its codes as (u8 kind, u32 string) pairs
+
+Row n of a track is at records_offset + n * RECORD.size, so any row can be
+read without touching the others. The compiled program is what
+compile_sequence() builds, with key and button names in place of backend
+codes; MacroFile.programs() maps its columns straight out of the file, so
+playback of a multi-hour recording creates no Python object per action.
+Tracks with call rows have no compiled program, since the called macros
+may change independently, and are compiled from their records instead.
+"""
+import mmap
+import struct
+import sys
+
+from engine.optimizer import SequenceError, optimize
+from engine.program import Program, compile_sequence
+from engine.store import TYPE_INDEX, TYPE_NAMES, is_variable
+
+MAGIC = b'FZMB'
+VERSION = 1
+SUFFIX = '.fzm'
+# The saved body was a plain list of actions rather than {"tracks": ...}
+FLAG_PLAIN = 1
+
+# magic, version, flags, tracks, strings, vars, reserved, strings/vars/index offsets
+HEADER = struct.Struct('<4sHHIIII QQQ')
+# type, value string, hold $variable string (0 for none), wait $variable
+# string, hold seconds, wait seconds
+RECORD = struct.Struct('<b3xIIIdd')
+# records offset and count, source rows, program length, offsets of the
+# ops/args/durs/rows columns, codes offset and count
+TRACK = struct.Struct('<10Q')
+VARIABLE = struct.Struct('<Id')
+CODE = struct.Struct('<B3xI')
+
+# What a compiled code stood for, so it can be resolved for any backend
+CODE_KEY = 0
+CODE_MOUSE = 1
+# Used as is, e.g. the reference name of an until instruction
+CODE_RAW = 2
+
+
+class _NamesBackend:
+    """Compiles to (kind, name) codes instead of backend codes, for storing."""
+    name = "names"
+
+    def resolve_key(self, name):
+        return (CODE_KEY, name)
+
+    def resolve_button(self, name):
+        return (CODE_MOUSE, name)
+
+
+def _pad(buffer):
+    buffer.extend(bytes(-len(buffer) % 8))
+
+
+def encode(tracks, variables=None, plain=False):
+    """The .fzm bytes for saved-format tracks (lists of type/value/hold/wait dicts)."""
+    variables = variables or {}
+    strings = [""]
+    string_index = {"": 0}
+
+    def intern(value):
+        index = string_index.get(value)
+        if index is None:
+            index = string_index[value] = len(strings)
+            strings.append(value)
+        return index
+
+    def split(seconds):
+        if is_variable(seconds):
+            return 0.0, intern(seconds)
+        return float(seconds), 0
+
+    body = bytearray()
+    entries = []
+    for actions in tracks:
+        records_offset = len(body)
+        for action in actions:
+            hold, hold_ref = split(action.get('hold', 0.1))
+            wait, wait_ref = split(action.get('wait', 0.1))
+            body += RECORD.pack(TYPE_INDEX[action['type']], intern(str(action.get('value', ''))),
+                                hold_ref, wait_ref, hold, wait)
+        program = _compile(actions, variables)
+        if program is None:
+            entries.append((records_offset, len(actions), 0, 0, 0, 0, 0, 0, 0, 0))
+            continue
+        offsets = []
+        for column in (program.ops, program.args, program.durs, program.rows):
+            _pad(body)
+            offsets.append(len(body))
+            body += column.tobytes()
+        _pad(body)
+        codes_offset = len(body)
+        for code in program.codes:
+            kind, value = code if isinstance(code, tuple) else (CODE_RAW, code)
+            body += CODE.pack(kind, intern(value))
+        entries.append((records_offset, len(actions), program.source_len, len(program), *offsets,
+                        codes_offset, len(program.codes)))
+    variable_names = [intern(name) for name in variables]
+
+    out = bytearray(HEADER.size)
+    strings_offset = len(out)
+    for value in strings:
+        data = value.encode('utf-8')
+        out += struct.pack('<I', len(data)) + data
+    _pad(out)
+    vars_offset = len(out)
+    for name, value in zip(variable_names, variables.values()):
+        out += VARIABLE.pack(name, float(value))
+    _pad(out)
+    index_offset = len(out)
+    base = index_offset + TRACK.size * len(tracks)
+    for entry in entries:
+        # Everything but the counts is relative to the body until now
+        records_offset, rows, source_len, length, ops, args, durs, row_col, codes, code_count = entry
+        if length:
+            ops, args, durs, row_col, codes = (o + base for o in (ops, args, durs, row_col, codes))
+        out += TRACK.pack(records_offset + base, rows, source_len, length, ops, args, durs, row_col,
+                          codes, code_count)
+    out += body
+    HEADER.pack_into(out, 0, MAGIC, VERSION, FLAG_PLAIN if plain else 0, len(tracks), len(strings),
+                     len(variables), 0, strings_offset, vars_offset, index_offset)
+    return bytes(out)
+
+
+def _compile(actions, variables):
+    """The track's Program with named codes, or None if it can't be stored compiled."""
+    if any(action.get('type') == 'call' for action in actions):
+        return None
+    try:
+        sequence, _ = optimize(actions, variables)
+    except SequenceError:
+        # Still saved losslessly; playing it reports the error as usual
+        return None
+    return compile_sequence(sequence, _NamesBackend())
+
+
+class MacroFile:
+    """A memory-mapped .fzm file.
+
+    Only the header, string table, variables and index are read on open.
+    Programs and columns are views of the mapping, which stays open for as
+    long as any of them is in use.
+    """
+
+    def __init__(self, path):
+        if sys.byteorder != 'little':
+            # Columns are cast in place, so they must already be in host order
+            raise ValueError("Binary macros need a little-endian machine")
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        (magic, version, flags, track_count, string_count, var_count, _,
+         strings_offset, vars_offset, index_offset) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary macro")
+        if version != VERSION:
+            raise ValueError(f"{path} has unsupported version {version}")
+        self.plain = bool(flags & FLAG_PLAIN)
+        self.strings = []
+        offset = strings_offset
+        for _ in range(string_count):
+            (length,) = struct.unpack_from('<I', self._map, offset)
+            offset += 4
+            self.strings.append(bytes(self._view[offset:offset + length]).decode('utf-8'))
+            offset += length
+        self.variables = {}
+        for i in range(var_count):
+            name, value = VARIABLE.unpack_from(self._map, vars_offset + i * VARIABLE.size)
+            self.variables[self.strings[name]] = value
+        self.tracks = [TRACK.unpack_from(self._map, index_offset + i * TRACK.size) for i in range(track_count)]
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Unmap the file, unless programs or columns from it are still alive."""
+        self._view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # Still being played; the mapping goes when the last view does
+            pass
+
+    def rows(self, track):
+        return self.tracks[track][1]
+
+    def row(self, track, n):
+        """Row n of track as a saved-format action dict, read on its own."""
+        offset = self.tracks[track][0]
+        if not 0 <= n < self.rows(track):
+            raise IndexError(n)
+        return self._action(RECORD.unpack_from(self._map, offset + n * RECORD.size))
+
+    def _action(self, record):
+        type_, value, hold_ref, wait_ref, hold, wait = record
+        strings = self.strings
+        return {
+            "type": TYPE_NAMES[type_],
+            "value": strings[value],
+            "hold": strings[hold_ref] if hold_ref else hold,
+            "wait": strings[wait_ref] if wait_ref else wait,
+        }
+
+    def columns(self, track):
+        """Strided views of one track's records: (types, values, holds, waits, hold_refs, wait_refs).
+
+        values and the refs index strings. Nothing is copied.
+        """
+        offset, count = self.tracks[track][:2]
+        records = self._view[offset:offset + count * RECORD.size]
+        # A record is 32 bytes: 32 int8s, 8 uint32s or 4 float64s
+        as_bytes = records.cast('b')
+        as_ints = records.cast('I')
+        as_doubles = records.cast('d')
+        return (as_bytes[0::32], as_ints[1::8], as_doubles[2::4], as_doubles[3::4],
+                as_ints[2::8], as_ints[3::8])
+
+    def actions(self, track):
+        """Every row of track as saved-format action dicts."""
+        offset, count = self.tracks[track][:2]
+        return [self._action(record)
+                for record in RECORD.iter_unpack(self._view[offset:offset + count * RECORD.size])]
+
+    def program(self, track, backend):
+        """The track's compiled Program for backend, mapped from the file, or None if it has none."""
+        (_, _, source_len, length, ops, args, durs, rows, codes_offset, code_count) = self.tracks[track]
+        if not length:
+            return None
+        view = self._view
+        codes = []
+        for i in range(code_count):
+            kind, value = CODE.unpack_from(self._map, codes_offset + i * CODE.size)
+            value = self.strings[value]
+            if kind == CODE_KEY:
+                value = backend.resolve_key(value)
+            elif kind == CODE_MOUSE:
+                value = backend.resolve_button(value)
+            codes.append(value)
+        return Program(view[ops:ops + length].cast('b'), view[args:args + 4 * length].cast('i'),
+                       view[durs:durs + 8 * length].cast('q'), view[rows:rows + 4 * length].cast('i'),
+                       tuple(codes), source_len)
+
+    def programs(self, backend):
+        """Programs for every track, or None if any track has to be compiled from its records."""
+        programs = [self.program(track, backend) for track in range(len(self))]
+        return None if None in programs else programs
@@ -0,0 +1,90 @@
+import json
+import os
+import time
+
+from engine.fileio import atomic_write
+from engine.paths import CALIBRATION_PATH
+from engine.program import OP_NAMES, OP_KEY_DOWN, OP_KEY_UP, OP_MOUSE_DOWN, OP_MOUSE_UP
+from engine.timing import now_ns
+
+CALIBRATION_SAMPLES = 25
+
+
+class LatencyProfile:
+    """Measured cost of each backend call, in ns, keyed by opcode name.
+
+    The runner treats an input as landing when its backend call returns, so it
+    issues each call this much ahead of its deadline. That keeps a 0.05s hold
+    at 0.05s between the press and the release landing.
+    """
+
+    def __init__(self, backend_name, latencies_ns, measured_at=None):
+        self.backend_name = backend_name
+        self.latencies_ns = dict(latencies_ns)
+        self.measured_at = measured_at if measured_at is not None else time.time()
+
+    def leads(self):
+        """Per-opcode lead times, indexed like Program.ops."""
+        return tuple(int(self.latencies_ns.get(name, 0)) for name in OP_NAMES)
+
+    def to_dict(self):
+        return {"latencies_ns": self.latencies_ns, "measured_at": self.measured_at}
+
+    def __str__(self):
+        parts = [f"{name} {ns / 1e6:.3f}ms" for name, ns in self.latencies_ns.items()]
+        return f"{self.backend_name}: " + ", ".join(parts)
+
+
+def _median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def calibrate(backend, samples=CALIBRATION_SAMPLES):
+    """Time every backend operation `samples` times and return a LatencyProfile.
+
+    This sends real input: taps of backend.calibration_key and clicks of
+    backend.calibration_button at the current mouse position.
+    """
+    handlers = backend.handlers()
+    pairs = (
+        (OP_KEY_DOWN, OP_KEY_UP, backend.resolve_key(backend.calibration_key)),
+        (OP_MOUSE_DOWN, OP_MOUSE_UP, backend.resolve_button(backend.calibration_button)),
+    )
+    latencies = {}
+    for down_op, up_op, code in pairs:
+        down, up = handlers[down_op], handlers[up_op]
+        down_times = []
+        up_times = []
+        for _ in range(samples):
+            t0 = now_ns()
+            down(code)
+            t1 = now_ns()
+            up(code)
+            t2 = now_ns()
+            down_times.append(t1 - t0)
+            up_times.append(t2 - t1)
+        latencies[OP_NAMES[down_op]] = _median(down_times)
+        latencies[OP_NAMES[up_op]] = _median(up_times)
+    return LatencyProfile(backend.name, latencies)
+
+
+def load_profile(backend_name, path=CALIBRATION_PATH):
+    """The stored profile for backend_name, or None if it was never calibrated."""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        data = json.load(f)
+    entry = data.get(backend_name)
+    if entry is None:
+        return None
+    return LatencyProfile(backend_name, entry["latencies_ns"], entry.get("measured_at"))
+
+
+def save_profile(profile, path=CALIBRATION_PATH):
+    data = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            data = json.load(f)
+    data[profile.backend_name] = profile.to_dict()
+    atomic_write(path, json.dumps(data, indent=2))
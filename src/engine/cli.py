@@ -0,0 +1,246 @@
+"""Play saved macros without the GUI.
+
+Run from src/:  python app.py play NAME [--loops N | --forever] [--delay S]
+                python app.py playlist NAME[:LOOPS] ... [--repeat] [--delay S]
+                python app.py list
+                python app.py convert NAME --binary | --json
+
+For long runs, --soak checkpoints progress to a log and --resume carries
+on from its last checkpoint after a crash.
+
+Nothing here imports Qt, and the input libraries are only imported when
+the backend is first used, so startup stays short.
+"""
+import argparse
+import sys
+import threading
+
+from engine.backends import BACKENDS
+from engine.calibration import load_profile
+from engine.library import MacroLibrary
+from engine.playlist import Playlist, compile_macro
+from engine.paths import SOAK_PATH
+from engine.runner import MacroRunner
+from engine.soak import Checkpointer, SoakLog, file_digest, last_checkpoint
+from engine.timing import now_ns
+from engine.trace import Tracer
+
+# How often the main thread wakes to check for Ctrl+C while a macro plays
+JOIN_INTERVAL = 0.1
+
+
+def ms(ns):
+    return f"{ns / 1e6:.3f} ms"
+
+
+def play(args, started_ns):
+    library = MacroLibrary()
+    if args.name not in library:
+        print(f"No saved macro named {args.name!r}", file=sys.stderr)
+        return 1
+    # Only checkpoints need it; playback itself never reads the file twice
+    digest = file_digest(library.body_path(args.name)) if args.soak or args.resume else None
+    checkpoint = None
+    if args.resume:
+        checkpoint = resume_from(args)
+        if checkpoint is None:
+            return 1
+        if checkpoint['macro'] != args.name or checkpoint.get('playlist'):
+            print(f"The last checkpoint is not for {args.name!r}", file=sys.stderr)
+            return 1
+        if checkpoint.get('digest') != digest:
+            print(f"Warning: {args.name!r} was changed since the checkpoint", file=sys.stderr)
+    backend = BACKENDS[args.backend]()
+    try:
+        programs = compile_macro(library, args.name, backend)
+    except ValueError as e:
+        print(f"Invalid macro: {e}", file=sys.stderr)
+        return 1
+    loop_count = float('inf') if args.forever else args.loops
+    if checkpoint is not None:
+        loop_count -= checkpoint['loop']
+        if loop_count <= 0:
+            print(f"{args.name!r} already finished its {args.loops} loops")
+            return 0
+    return run(args, backend, programs, loop_count, repr(args.name), started_ns,
+               checkpoint=checkpoint, macro=args.name, digest=digest)
+
+
+def resume_from(args):
+    """The checkpoint to resume from, or None after printing why there isn't one."""
+    args.soak = args.soak or SOAK_PATH
+    checkpoint = last_checkpoint(args.soak)
+    if checkpoint is None:
+        print(f"No checkpoint to resume from in {args.soak}", file=sys.stderr)
+        return None
+    print(f"Resuming after loop {checkpoint['loop']} ({checkpoint['runtime_ns'] / 1e9:.0f} s in)")
+    return checkpoint
+
+
+def run(args, backend, programs, loop_count, title, started_ns, playlist=None, checkpoint=None,
+        macro=None, digest=None):
+    """Play after args.delay, wait for the end or Ctrl+C, then print a summary."""
+    # Resolving keys imported the backend already; this covers mouse-only macros
+    backend.warm_up()
+    ready_ns = now_ns()
+
+    if args.delay > 0:
+        print(f"Starting {title} in {args.delay:g} seconds...")
+    try:
+        runner = MacroRunner(programs, loop_count, threading.Event(), backend,
+                             load_profile(backend.name),
+                             start_at_ns=ready_ns + int(args.delay * 1e9),
+                             tracer=Tracer() if args.trace else None,
+                             playlist=playlist)
+    except ValueError as e:
+        print(f"Invalid macro: {e}", file=sys.stderr)
+        return 1
+    if checkpoint is not None:
+        runner.telemetry.resume(checkpoint)
+    checkpointer = None
+    if args.soak:
+        checkpointer = Checkpointer(runner, SoakLog(args.soak), macro, digest)
+    runner.start()
+    if checkpointer is not None:
+        checkpointer.start()
+    try:
+        while runner.is_alive():
+            runner.join(JOIN_INTERVAL)
+    except KeyboardInterrupt:
+        runner.stop()
+        runner.join()
+    if checkpointer is not None:
+        checkpointer.finish()
+
+    if playlist is not None and playlist.error is not None:
+        print(f"Playlist stopped early: {playlist.error}", file=sys.stderr)
+    telemetry = runner.telemetry
+    print(f"{telemetry.loops} loops in {telemetry.runtime_ns / 1e9:.2f} s, "
+          f"lateness mean {ms(telemetry.lateness.mean_ns)}, max {ms(telemetry.lateness.max_ns)}")
+    if args.trace:
+        runner.tracer.save_chrome(args.trace)
+        print(runner.tracer.format_summary())
+        print(f"trace written to {args.trace}")
+    if args.profile_startup:
+        print(f"startup: ready {ms(ready_ns - started_ns)} after launch")
+        import_ns = getattr(backend, "import_ns", None)
+        if import_ns is not None:
+            print(f"startup: backend imports {ms(import_ns)}")
+        if telemetry.first_dispatch_ns is not None:
+            # Leave the delay out so the number is comparable between runs
+            first = telemetry.first_dispatch_ns - started_ns - int(args.delay * 1e9)
+            print(f"startup: first input {ms(first)} after launch, excluding the delay")
+            print(f"startup: first input {ms(telemetry.first_dispatch_ns - runner.start_at_ns)} after its target")
+    return 0
+
+
+def parse_entry(text):
+    """NAME or NAME:LOOPS (macro names can't contain ':')."""
+    name, _, loops = text.partition(":")
+    try:
+        return name, int(loops) if loops else 1
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{loops!r} is not a loop count") from None
+
+
+def play_playlist(args, started_ns):
+    library = MacroLibrary()
+    checkpoint = None
+    if args.resume:
+        checkpoint = resume_from(args)
+        if checkpoint is None:
+            return 1
+        if checkpoint.get('playlist') != [list(entry) for entry in args.entries]:
+            print("The last checkpoint is not for this playlist", file=sys.stderr)
+            return 1
+    backend = BACKENDS[args.backend]()
+    try:
+        playlist = Playlist(args.entries, library, backend, repeat=args.repeat)
+        if checkpoint is None:
+            programs, loops = playlist.first()
+        else:
+            programs, loops = playlist.first(checkpoint['entry'], checkpoint['entry_loop'])
+            if playlist.current != checkpoint['entry']:
+                # That entry had finished; the next one starts from its first loop
+                checkpoint = dict(checkpoint, entry_loop=0)
+    except ValueError as e:
+        print(f"Invalid playlist: {e}", file=sys.stderr)
+        return 1
+    title = f"playlist of {len(args.entries)} macros"
+    return run(args, backend, programs, loops, title, started_ns, playlist, checkpoint)
+
+
+def list_macros(args, started_ns):
+    library = MacroLibrary()
+    for entry in library.search(args.search):
+        tags = ", ".join(entry["tags"])
+        kind = "binary" if entry.get("binary") else "json"
+        print(f"{entry['name']:<30} {entry['duration']:>8.2f}s  {kind:<6}  {tags}")
+    return 0
+
+
+def convert(args, started_ns):
+    library = MacroLibrary()
+    if args.name not in library:
+        print(f"No saved macro named {args.name!r}", file=sys.stderr)
+        return 1
+    library.save(args.name, library.load(args.name), binary=args.binary)
+    print(f"{args.name!r} saved as {'binary' if args.binary else 'JSON'}")
+    return 0
+
+
+def add_play_options(parser):
+    parser.add_argument("--delay", type=float, default=3.0,
+                        help="seconds to wait before starting (default 3)")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="system",
+                        help="input backend (default system)")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="record every action and write a Chrome/Perfetto trace to PATH")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="print how long startup took up to the first input")
+    parser.add_argument("--soak", nargs="?", const=SOAK_PATH, metavar="PATH",
+                        help=f"checkpoint progress to a log for resuming (default {SOAK_PATH})")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue from the last checkpoint in the --soak log")
+
+
+def main(argv=None, started_ns=None):
+    """Command-line entry point. started_ns is when the process began, for --profile-startup."""
+    if started_ns is None:
+        started_ns = now_ns()
+    parser = argparse.ArgumentParser(prog="forza-automation", description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    play_parser = commands.add_parser("play", help="play a saved macro")
+    play_parser.add_argument("name", help="name of the saved macro")
+    loops = play_parser.add_mutually_exclusive_group()
+    loops.add_argument("--loops", type=int, default=1, help="number of loops (default 1)")
+    loops.add_argument("--forever", action="store_true", help="loop until Ctrl+C")
+    add_play_options(play_parser)
+    play_parser.set_defaults(func=play)
+
+    playlist_parser = commands.add_parser("playlist", help="play saved macros back to back")
+    playlist_parser.add_argument("entries", nargs="+", type=parse_entry, metavar="NAME[:LOOPS]",
+                                 help="macros in playing order, each with its loop count (default 1)")
+    playlist_parser.add_argument("--repeat", action="store_true", help="start over after the last entry until Ctrl+C")
+    add_play_options(playlist_parser)
+    playlist_parser.set_defaults(func=play_playlist)
+
+    list_parser = commands.add_parser("list", help="list saved macros")
+    list_parser.add_argument("search", nargs="?", default="", help="filter by name or tag")
+    list_parser.set_defaults(func=list_macros)
+
+    convert_parser = commands.add_parser("convert", help="switch a saved macro between JSON and binary")
+    convert_parser.add_argument("name", help="name of the saved macro")
+    formats = convert_parser.add_mutually_exclusive_group(required=True)
+    formats.add_argument("--binary", action="store_true",
+                         help="compact binary, played straight from a memory map; best for long recordings")
+    formats.add_argument("--json", dest="binary", action="store_false", help="plain JSON")
+    convert_parser.set_defaults(func=convert)
+
+    args = parser.parse_args(argv)
+    return args.func(args, started_ns)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import json
+import os
+from collections import deque
+
+from engine.fileio import atomic_write
+from engine.paths import HOTKEYS_PATH
+from engine.timing import now_ns
+
+START = "start"
+STOP = "stop"
+# Start when idle, stop otherwise
+TOGGLE = "toggle"
+# Pause when playing, resume when paused
+PAUSE = "pause"
+COMMANDS = (START, STOP, TOGGLE, PAUSE)
+# Not a command, only what PAUSE does while paused
+RESUME = "resume"
+
+# Target that starts the playlist instead of one macro (macro names can't contain ':')
+PLAYLIST = ":playlist"
+
+# Playback states
+IDLE = "idle"
+ARMING = "arming"
+PLAYING = "playing"
+PAUSED = "paused"
+
+# What a fresh install binds: start/stop the macro being edited
+DEFAULT_BINDINGS = [("ctrl+alt+m", TOGGLE, None)]
+
+# A repeat of the same command and target within this long of the last one
+# is dropped. Held hotkeys auto-repeat, so every repeat extends the window.
+DEBOUNCE_NS = 300_000_000
+
+
+def transition(state, command):
+    """What a command does in a playback state: START, STOP, PAUSE, RESUME or None.
+
+    None means the command has no effect there, so sending a command twice
+    is the same as sending it once.
+    """
+    if command == TOGGLE:
+        command = START if state == IDLE else STOP
+    if command == START:
+        return START if state == IDLE else None
+    if command == STOP:
+        return STOP if state != IDLE else None
+    if command == PAUSE:
+        if state == PLAYING:
+            return PAUSE
+        if state == PAUSED:
+            return RESUME
+    return None
+
+
+class CommandQueue:
+    """Start, stop and pause requests from hotkeys and buttons, in arrival order.
+
+    Any thread may push(); that is a single deque append, so a keyboard hook
+    callback returns at once. One consumer drains the queue and carries the
+    commands out one at a time, so two of them never race each other.
+
+    target says what to start: None for the macro being edited, PLAYLIST,
+    or the name of a saved macro.
+    """
+
+    def __init__(self, debounce_ns=DEBOUNCE_NS):
+        self.debounce_ns = debounce_ns
+        self._queue = deque()
+        # (command, target) -> when it last arrived, accepted or not
+        self._last_seen = {}
+
+    def push(self, command, target=None, resolved=None):
+        """Queue command. resolved is what it already turned out to mean, e.g. a
+        toggle that stopped playback on the hook thread; it is still debounced
+        as the command that was pressed.
+        """
+        self._queue.append((now_ns(), command, target, resolved))
+
+    def drain(self):
+        """[(command, target), ...] pushed since the last drain, without bounces."""
+        accepted = []
+        while self._queue:
+            at, command, target, resolved = self._queue.popleft()
+            key = (command, target)
+            last = self._last_seen.get(key)
+            self._last_seen[key] = at
+            if last is not None and at - last < self.debounce_ns:
+                continue
+            accepted.append((resolved or command, target))
+        return accepted
+
+    def __len__(self):
+        return len(self._queue)
+
+
+def load_bindings(path=HOTKEYS_PATH):
+    """[(hotkey, command, target), ...] saved by save_bindings(), or the defaults."""
+    if not os.path.exists(path):
+        return list(DEFAULT_BINDINGS)
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return [(entry["hotkey"], entry["command"], entry.get("target"))
+            for entry in data if entry.get("command") in COMMANDS]
+
+
+def save_bindings(bindings, path=HOTKEYS_PATH):
+    data = [{"hotkey": hotkey, "command": command, "target": target} for hotkey, command, target in bindings]
+    atomic_write(path, json.dumps(data, indent=2))
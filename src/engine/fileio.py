@@ -0,0 +1,32 @@
+import os
+import tempfile
+
+
+def atomic_write(path, data):
+    """Replace path with data (str or bytes) so readers only ever see the old or the new file.
+
+    The data goes to a temp file in the same directory, is fsynced, then
+    renamed over the target.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    mode = 'wb' if isinstance(data, (bytes, bytearray, memoryview)) else 'w'
+    fd, tmp = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, mode) as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+    if os.name == 'posix':
+        # Make the rename itself durable
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
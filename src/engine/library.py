@@ -0,0 +1,308 @@
+import json
+import os
+
+from engine.binmacro import SUFFIX as BINARY_SUFFIX, MacroFile, encode
+from engine.fileio import atomic_write
+from engine.paths import MACROS_DIR
+from engine.store import VARIABLE_PREFIX, is_variable
+
+INDEX_NAME = '.index.json'
+INDEX_VERSION = 4
+
+
+def macro_duration(actions, variables=None):
+    """Seconds one loop of saved-format actions takes, as get_sequence would play it.
+
+    Repeats are multiplied out; calls count as zero since the called macro
+    may change independently.
+    """
+    variables = variables or {}
+
+    def number(value):
+        if is_variable(value):
+            value = variables.get(value[len(VARIABLE_PREFIX):], 0)
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return 0.0
+
+    # One accumulator per open repeat block
+    stack = [[1, 0.0]]
+    for action in actions:
+        type_ = action.get('type')
+        if type_ == 'repeat':
+            stack.append([number(action.get('value', 0)), 0.0])
+        elif type_ == 'end':
+            if len(stack) > 1:
+                count, total = stack.pop()
+                stack[-1][1] += count * total
+        elif type_ in ('wait', 'until'):
+            # An until row counts as its timeout, the longest it can take
+            stack[-1][1] += number(action.get('wait', 0.1))
+        elif type_ in ('key', 'mouse'):
+            stack[-1][1] += number(action.get('hold', 0.1)) + max(number(action.get('wait', 0.1)), 0.0)
+    while len(stack) > 1:
+        count, total = stack.pop()
+        stack[-1][1] += count * total
+    return stack[0][1]
+
+
+def split_tracks(body):
+    """The per-track action lists of a saved macro body.
+
+    A body is either a plain list of actions (a one-track macro without
+    variables, the format every older save uses) or
+    {"tracks": [[actions], ...], "vars": {name: number, ...}}.
+    """
+    if isinstance(body, dict):
+        return body['tracks']
+    return [body]
+
+
+def body_variables(body):
+    """The macro's variables, referenced as $name in holds, waits and repeat counts."""
+    if isinstance(body, dict):
+        return dict(body.get('vars', {}))
+    return {}
+
+
+def join_tracks(tracks, variables=None):
+    """Inverse of split_tracks. Plain macros keep the plain list format."""
+    if len(tracks) == 1 and not variables:
+        return tracks[0]
+    body = {"tracks": tracks}
+    if variables:
+        body["vars"] = variables
+    return body
+
+
+class MacroLibrary:
+    """Saved macros in a directory, one body per macro, plus an index.
+
+    The index holds name, tags, action count, loop duration and modified
+    time for every macro, so listing and searching never open the bodies.
+    Bodies are only read by load(). Every write is atomic.
+
+    It also holds the mtime and size of each body file. Opening the library
+    compares them with the directory (see refresh()), so macros copied in,
+    edited or deleted behind its back are re-indexed without reading the rest.
+
+    A body is JSON by default or, for long recordings, a binary .fzm file
+    (see engine.binmacro) that can be played straight from a memory map.
+    Saving keeps whichever format the macro already has.
+    """
+
+    def __init__(self, root=MACROS_DIR):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.index_path = os.path.join(root, INDEX_NAME)
+        self.entries = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as f:
+                data = json.load(f)
+            if data.get('version') == INDEX_VERSION:
+                self.entries = data['macros']
+                self.refresh()
+            else:
+                self.rebuild()
+        else:
+            # First run, or macros saved before the index existed
+            self.rebuild()
+
+    def path(self, name):
+        return os.path.join(self.root, name + '.json')
+
+    def binary_path(self, name):
+        return os.path.join(self.root, name + BINARY_SUFFIX)
+
+    def is_binary(self, name):
+        return self.entries.get(name, {}).get('binary', False)
+
+    def body_path(self, name):
+        """The file name is saved in, in whichever format it has."""
+        return self.binary_path(name) if self.is_binary(name) else self.path(name)
+
+    def encode(self, body, binary=False):
+        """The bytes save() writes for body in the given format."""
+        if binary:
+            return encode(split_tracks(body), body_variables(body), plain=not isinstance(body, dict))
+        # Compact; indenting a long recording more than doubles what is written
+        return json.dumps(body, separators=(',', ':')).encode()
+
+    def _write_index(self):
+        atomic_write(self.index_path, json.dumps({"version": INDEX_VERSION, "macros": self.entries}))
+
+    def _entry(self, name, body, tags, binary, mtime_ns, size):
+        tracks = split_tracks(body)
+        variables = body_variables(body)
+        return {
+            "name": name,
+            "tags": sorted(set(tags)),
+            "tracks": len(tracks),
+            "actions": sum(len(actions) for actions in tracks),
+            # Tracks play in parallel, a loop lasts as long as the longest
+            "duration": max(macro_duration(actions, variables) for actions in tracks),
+            "modified": mtime_ns / 1e9,
+            "binary": binary,
+            # What the body file looked like when indexed, see refresh()
+            "mtime_ns": mtime_ns,
+            "size": size,
+        }
+
+    def _scan(self):
+        """name -> (binary, mtime_ns, size) of every body file, from one directory listing.
+
+        A crash part way through converting a macro can leave it in both
+        formats; the newer file is the one save() wrote.
+        """
+        found = {}
+        with os.scandir(self.root) as listing:
+            for item in listing:
+                name, suffix = os.path.splitext(item.name)
+                if suffix not in ('.json', BINARY_SUFFIX) or item.name.startswith('.') or not item.is_file():
+                    continue
+                stat = item.stat()
+                seen = found.get(name)
+                if seen is None or stat.st_mtime_ns > seen[1]:
+                    found[name] = (suffix == BINARY_SUFFIX, stat.st_mtime_ns, stat.st_size)
+        return found
+
+    def _index_file(self, name, found, tags):
+        """Read the body of name as _scan() found it and index it, or None if it can't be read."""
+        binary, mtime_ns, size = found
+        try:
+            body = self._read_binary(self.binary_path(name)) if binary else self._read_json(self.path(name))
+        except (OSError, ValueError):
+            return None
+        return self._entry(name, body, tags, binary, mtime_ns, size)
+
+    def rebuild(self):
+        """Re-create the index from the bodies on disk. The only operation that reads them all."""
+        old = self.entries
+        self.entries = {}
+        for name, found in sorted(self._scan().items()):
+            entry = self._index_file(name, found, old.get(name, {}).get('tags', []))
+            if entry is not None:
+                self.entries[name] = entry
+        self._write_index()
+
+    def refresh(self):
+        """Bring the index up to date with macros added, edited or deleted outside the library.
+
+        Only bodies whose mtime or size differ from the index are read. Tags
+        of an edited macro are kept. Returns whether anything changed.
+        """
+        found = self._scan()
+        changed = False
+        for name in [name for name in self.entries if name not in found]:
+            del self.entries[name]
+            changed = True
+        for name, stat in found.items():
+            entry = self.entries.get(name)
+            if entry is not None and (entry['binary'], entry['mtime_ns'], entry['size']) == stat:
+                continue
+            new = self._index_file(name, stat, entry['tags'] if entry is not None else [])
+            if new is None and entry is None:
+                continue
+            if new is None:
+                # Unreadable now, e.g. half copied in; left out like rebuild() does
+                del self.entries[name]
+            else:
+                self.entries[name] = new
+            changed = True
+        if changed:
+            self._write_index()
+        return changed
+
+    def names(self):
+        return sorted(self.entries, key=str.lower)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, name):
+        """Index entry for name, or None."""
+        return self.entries.get(name)
+
+    def search(self, text="", tag=None):
+        """Index entries whose name or tags contain text (case-insensitive), optionally with tag."""
+        text = text.strip().lower()
+        results = []
+        for name in self.names():
+            entry = self.entries[name]
+            if tag is not None and tag not in entry['tags']:
+                continue
+            if text and text not in name.lower() and not any(text in t.lower() for t in entry['tags']):
+                continue
+            results.append(entry)
+        return results
+
+    def load(self, name):
+        """The saved body of one macro; see split_tracks."""
+        if name not in self.entries:
+            raise KeyError(name)
+        if self.is_binary(name):
+            return self._read_binary(self.binary_path(name))
+        return self._read_json(self.path(name))
+
+    def _read_json(self, path):
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def _read_binary(self, path):
+        with MacroFile(path) as macro_file:
+            tracks = [macro_file.actions(track) for track in range(len(macro_file))]
+            if macro_file.plain:
+                return tracks[0]
+            body = {"tracks": tracks}
+            if macro_file.variables:
+                body["vars"] = macro_file.variables
+            return body
+
+    def mapped(self, name):
+        """The binary file of name, memory-mapped, or None if it is saved as JSON."""
+        if name not in self.entries:
+            raise KeyError(name)
+        if not self.is_binary(name):
+            return None
+        return MacroFile(self.binary_path(name))
+
+    def subroutine(self, name):
+        """(actions, variables) of a one-track macro, for calling it from another macro."""
+        body = self.load(name)
+        tracks = split_tracks(body)
+        if len(tracks) != 1:
+            raise ValueError("only one-track macros can be called")
+        return tracks[0], body_variables(body)
+
+    def save(self, name, body, tags=None, binary=None):
+        """Save body as name. binary picks the format; None keeps the one name has (JSON if new)."""
+        if tags is None:
+            tags = self.entries.get(name, {}).get('tags', [])
+        if binary is None:
+            binary = self.is_binary(name)
+        if binary:
+            path, stale = self.binary_path(name), self.path(name)
+        else:
+            path, stale = self.path(name), self.binary_path(name)
+        atomic_write(path, self.encode(body, binary))
+        stat = os.stat(path)
+        self.entries[name] = self._entry(name, body, tags, binary, stat.st_mtime_ns, stat.st_size)
+        self._write_index()
+        # Converted: drop the body in the other format
+        try:
+            os.remove(stale)
+        except FileNotFoundError:
+            pass
+
+    def delete(self, name):
+        self.entries.pop(name)
+        self._write_index()
+        for path in (self.path(name), self.binary_path(name)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,292 @@
+import math
+
+from engine.store import TYPE_NAMES, VARIABLE_PREFIX, is_variable
+
+# Longest run of rows that is looked for when folding repeats
+MAX_FOLD_BLOCK = 8
+
+
+class SequenceError(ValueError):
+    """A table row that can't be played. row is 0-based."""
+
+    def __init__(self, row, message):
+        super().__init__(f"Row {row + 1}: {message}")
+        self.row = row
+
+
+class OptimizeReport:
+    """What optimize() did to a table."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        # Actions get_sequence used to produce: every row, plus a wait after
+        # each key/mouse row with a wait
+        self.naive_actions = 0
+        # Actions in the optimized sequence, counting block markers and each
+        # repeat body once
+        self.actions = 0
+        self.dropped = 0
+        self.waits_merged = 0
+        self.repeats_folded = 0
+        self.rows_folded = 0
+        # Names of the macros called as subroutines, directly or not
+        self.subroutines = []
+
+    @property
+    def saved(self):
+        return self.naive_actions - self.actions
+
+    def __str__(self):
+        if not self.naive_actions:
+            return "empty"
+        percent = 100.0 * self.saved / self.naive_actions
+        return (f"{self.rows} rows -> {self.actions} actions (was {self.naive_actions}, {percent:.0f}% smaller; "
+                f"{self.repeats_folded} repeats folding {self.rows_folded} rows, "
+                f"{self.waits_merged} waits merged, {self.dropped} no-ops dropped)")
+
+
+def _lookup(row, name, variables):
+    key = name[len(VARIABLE_PREFIX):]
+    if key not in variables:
+        raise SequenceError(row, f"undefined variable {name}")
+    return variables[key]
+
+
+def _number(row, action, field, variables):
+    value = action.get(field, 0.1)
+    if is_variable(value):
+        value = _lookup(row, value, variables)
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise SequenceError(row, f"{field} {value!r} is not a number") from None
+    if math.isnan(seconds) or math.isinf(seconds) or seconds < 0:
+        raise SequenceError(row, f"{field} must be a non-negative number of seconds, not {value!r}")
+    return seconds
+
+
+def _count_value(row, value, variables):
+    if is_variable(value):
+        value = _lookup(row, value, variables)
+    try:
+        count = float(value)
+    except (TypeError, ValueError):
+        raise SequenceError(row, f"repeat count {value!r} is not a number") from None
+    if count < 0 or count != int(count):
+        raise SequenceError(row, f"repeat count must be a whole number, not {value!r}")
+    return int(count)
+
+
+def validate(actions, variables=None):
+    """Check saved-format rows up front and resolve $variables.
+
+    Returns (type, value, hold, wait, row) tuples. For repeat rows value is
+    the count, for call rows the macro name, for until rows the screen
+    reference name (and wait the timeout).
+    """
+    variables = variables or {}
+    rows = []
+    depth = 0
+    for row, action in enumerate(actions):
+        type_ = action.get('type')
+        if type_ not in TYPE_NAMES:
+            raise SequenceError(row, f"unknown action type {type_!r}")
+        value = action.get('value', '')
+        hold = wait = 0.0
+        if type_ in ('key', 'mouse'):
+            if not isinstance(value, str):
+                raise SequenceError(row, f"value {value!r} is not a key or button name")
+            hold = _number(row, action, 'hold', variables)
+            wait = _number(row, action, 'wait', variables)
+        elif type_ == 'wait':
+            value = ''
+            wait = _number(row, action, 'wait', variables)
+        elif type_ == 'repeat':
+            value = _count_value(row, value, variables)
+            depth += 1
+        elif type_ == 'end':
+            if not depth:
+                raise SequenceError(row, "end without a repeat")
+            depth -= 1
+        elif type_ == 'until':
+            if not value or not isinstance(value, str):
+                raise SequenceError(row, "until needs the name of a screen reference")
+            wait = _number(row, action, 'wait', variables)
+        elif not value:
+            raise SequenceError(row, "call needs the name of a saved macro")
+        rows.append((type_, value, hold, wait, row))
+    if depth:
+        raise SequenceError(len(actions) - 1, f"{depth} repeat block(s) never ended")
+    return rows
+
+
+def _fold(rows, report):
+    """Group consecutive repeats of the same 1..MAX_FOLD_BLOCK rows into (count, block) runs.
+
+    Returns a list of (count, rows) pairs; count 1 means no repeat.
+    """
+    runs = []
+    i = 0
+    n = len(rows)
+    # Compare rows on content only, not on their row number
+    content = [r[:4] for r in rows]
+    while i < n:
+        best_size, best_count = 1, 1
+        for size in range(1, min(MAX_FOLD_BLOCK, (n - i) // 2) + 1):
+            block = content[i:i + size]
+            count = 1
+            while content[i + count * size:i + (count + 1) * size] == block:
+                count += 1
+            if count > 1 and size * (count - 1) > best_size * (best_count - 1):
+                best_size, best_count = size, count
+        runs.append((best_count, rows[i:i + best_size]))
+        if best_count > 1:
+            report.repeats_folded += 1
+            report.rows_folded += best_size * best_count
+        i += best_size * best_count
+    return runs
+
+
+def _expand(rows, report):
+    """Plain rows to runner actions, dropping no-ops and merging adjacent waits."""
+    sequence = []
+    for type_, value, hold, wait, row in rows:
+        if type_ == 'until':
+            # The wait is its timeout, not a pause after it
+            sequence.append({"type": "until", "value": value, "timeout": wait, "row": row})
+            continue
+        if type_ == 'wait':
+            waits = [wait]
+        else:
+            if value:
+                sequence.append({"type": type_, "value": value, "hold": hold, "row": row})
+            else:
+                # A key/mouse row with nothing selected presses nothing
+                report.dropped += 1
+            waits = [wait] if wait > 0 else []
+        for wait in waits:
+            if wait <= 0:
+                report.dropped += 1
+            elif sequence and sequence[-1]['type'] == 'wait':
+                sequence[-1]['value'] += wait
+                report.waits_merged += 1
+            else:
+                sequence.append({"type": "wait", "value": wait, "row": row})
+    return sequence
+
+
+def _append(sequence, body, report):
+    # Waits can still merge across folded runs
+    if sequence and body and sequence[-1]['type'] == 'wait' and body[0]['type'] == 'wait':
+        sequence[-1]['value'] += body.pop(0)['value']
+        report.waits_merged += 1
+    sequence.extend(body)
+
+
+class _Optimizer:
+    def __init__(self, resolve_call, report):
+        self.resolve_call = resolve_call
+        self.report = report
+        # Optimized bodies of called macros by name, shared by every call site
+        self.subroutines = {}
+        self.calling = []
+
+    def block(self, rows, start):
+        """Optimize rows[start:] up to the matching end. Returns (sequence, index after the end)."""
+        report = self.report
+        sequence = []
+        plain = []
+        i = start
+        while i < len(rows):
+            type_, value, _, _, row = rows[i]
+            if type_ in ('key', 'mouse', 'wait', 'until'):
+                plain.append(rows[i])
+                i += 1
+                continue
+            self.flush(sequence, plain)
+            plain = []
+            if type_ == 'end':
+                return sequence, i + 1
+            if type_ == 'repeat':
+                body, i = self.block(rows, i + 1)
+                if value and body:
+                    sequence.append({"type": "repeat", "count": value, "body": body, "row": row})
+                else:
+                    report.dropped += 1
+            else:
+                sequence.append({"type": "call", "name": value, "body": self.subroutine(value, row), "row": row})
+                i += 1
+        self.flush(sequence, plain)
+        return sequence, i
+
+    def flush(self, sequence, plain):
+        for count, block in _fold(plain, self.report):
+            body = _expand(block, self.report)
+            if not body:
+                continue
+            if count == 1:
+                _append(sequence, body, self.report)
+            else:
+                sequence.append({"type": "repeat", "count": count, "body": body, "row": block[0][4]})
+
+    def subroutine(self, name, row):
+        if name in self.subroutines:
+            return self.subroutines[name]
+        if name in self.calling:
+            raise SequenceError(row, "call cycle: " + " -> ".join(self.calling + [name]))
+        if self.resolve_call is None:
+            raise SequenceError(row, f"can't call {name!r} here")
+        try:
+            actions, variables = self.resolve_call(name)
+        except (KeyError, FileNotFoundError):
+            raise SequenceError(row, f"no saved macro named {name!r}") from None
+        except ValueError as e:
+            raise SequenceError(row, f"can't call {name!r}: {e}") from None
+        self.calling.append(name)
+        try:
+            rows = validate(actions, variables)
+        except SequenceError as e:
+            raise SequenceError(row, f"in {name!r}, {e}") from None
+        # Rows inside a subroutine report lateness against the calling row
+        rows = [r[:4] + (row,) for r in rows]
+        body, _ = self.block(rows, 0)
+        self.calling.pop()
+        self.subroutines[name] = body
+        self.report.subroutines.append(name)
+        return body
+
+
+def optimize(actions, variables=None, resolve_call=None):
+    """Turn saved-format table rows into a compact runner sequence.
+
+    Validates every duration up front (raising SequenceError naming the
+    row) and resolves $variables. Drops rows and waits that do nothing,
+    merges adjacent waits and folds runs of identical rows or row blocks,
+    such as those left by Duplicate Action, into repeat blocks.
+
+    repeat/end rows become nested repeat blocks and call rows call another
+    macro: resolve_call(name) returns that macro's (actions, variables).
+    Both stay structured in the sequence and compile to loops and calls,
+    so nothing is unrolled; every call site shares one body.
+
+    Returns (sequence, OptimizeReport).
+    """
+    rows = validate(actions, variables)
+    report = OptimizeReport(len(rows))
+    report.naive_actions = sum(1 + (r[0] in ('key', 'mouse') and r[3] > 0) for r in rows)
+    sequence, _ = _Optimizer(resolve_call, report).block(rows, 0)
+    report.actions = _count(sequence, set())
+    return sequence, report
+
+
+def _count(sequence, seen):
+    total = 0
+    for action in sequence:
+        total += 1
+        if action['type'] == 'repeat':
+            total += _count(action['body'], seen)
+        elif action['type'] == 'call' and id(action['body']) not in seen:
+            # A subroutine's body exists once however often it is called
+            seen.add(id(action['body']))
+            total += _count(action['body'], seen)
+    return total
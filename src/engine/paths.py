@@ -0,0 +1,14 @@
+import os
+
+# Everything the app writes lives next to the checkout
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(__file__), '../..'))
+MACROS_DIR = os.path.join(DATA_DIR, 'macros')
+CALIBRATION_PATH = os.path.join(DATA_DIR, 'calibration.json')
+# Screen snapshots that until rows wait for
+REFERENCES_DIR = os.path.join(DATA_DIR, 'references')
+# Checkpoints of long runs, for resuming after a crash
+SOAK_PATH = os.path.join(DATA_DIR, 'soak.jsonl')
+# Global hotkeys and the command each one sends
+HOTKEYS_PATH = os.path.join(DATA_DIR, 'hotkeys.json')
+# The macro being edited, saved in the background; a journal of edits sits next to it
+AUTOSAVE_PATH = os.path.join(DATA_DIR, 'autosave.json')
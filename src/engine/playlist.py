@@ -0,0 +1,142 @@
+import threading
+
+from engine.library import body_variables, split_tracks
+from engine.optimizer import SequenceError, optimize
+from engine.program import compile_sequence, until_references
+
+
+def compile_macro(library, name, backend):
+    """Load, optimize and compile every track of a saved macro. Returns a list of Programs.
+
+    Binary macros carry their compiled programs, which are played straight
+    from the memory-mapped file instead.
+    """
+    macro_file = library.mapped(name)
+    if macro_file is not None:
+        programs = macro_file.programs(backend)
+        macro_file.close()
+        if programs is not None:
+            return programs
+    body = library.load(name)
+    variables = body_variables(body)
+    programs = []
+    for track, actions in enumerate(split_tracks(body)):
+        try:
+            sequence, _ = optimize(actions, variables, library.subroutine)
+        except SequenceError as e:
+            raise ValueError(f"{name!r} track {track + 1}, {e}") from e
+        programs.append(compile_sequence(sequence, backend))
+    return programs
+
+
+class Playlist:
+    """Saved macros played back to back, each for its own number of loops.
+
+    The runner asks for the next entry when the current one finishes and
+    starts it on the same timeline, so there is no gap between entries.
+    To make that hand-off free, each entry is loaded and compiled on a
+    background thread while the one before it plays.
+
+    entries is a list of (macro name, loops). With repeat the list starts
+    over after the last entry, until stopped. screen answers until rows; if
+    an entry has any and none was given, one is created when it is loaded.
+    """
+
+    def __init__(self, entries, library, backend, repeat=False, screen=None):
+        if not entries:
+            raise ValueError("The playlist is empty")
+        for name, loops in entries:
+            if name not in library:
+                raise ValueError(f"No saved macro named {name!r}")
+            if loops < 1:
+                raise ValueError(f"{name!r} must play at least one loop")
+        self.entries = list(entries)
+        self.library = library
+        self.backend = backend
+        self.repeat = repeat
+        self.screen = screen
+        # Index of the entry playing now
+        self.current = -1
+        # Set when a background load failed; the runner then stops after the current entry
+        self.error = None
+        self._next = None
+        self._ready = threading.Event()
+        self._loader = None
+
+    def _compile(self, index):
+        name, loops = self.entries[index]
+        programs = compile_macro(self.library, name, self.backend)
+        references = until_references(programs)
+        if references:
+            # Loaded here, on the loader thread, so the hand-off to this entry
+            # does no imports or file reads
+            if self.screen is None:
+                try:
+                    from engine.screen import ScreenMatcher
+                except ImportError as e:
+                    raise ValueError(f"{name!r} has until rows, which need numpy ({e})") from e
+                self.screen = ScreenMatcher()
+            self.screen.prepare(references)
+        return programs, loops
+
+    def _preload(self, index):
+        try:
+            self._next = (index, self._compile(index))
+        except Exception as e:
+            self.error = e
+            self._next = None
+        self._ready.set()
+
+    def _start_preload(self):
+        index = self.current + 1
+        if index >= len(self.entries):
+            if not self.repeat:
+                self._next = None
+                self._ready.set()
+                return
+            index = 0
+        self._ready.clear()
+        self._loader = threading.Thread(target=self._preload, args=(index,), daemon=True)
+        self._loader.start()
+
+    def first(self, index=0, loops_done=0, preload=True):
+        """(programs, loops) of the first entry, compiled now so errors show up before playback.
+
+        index and loops_done start part way through, when resuming a run.
+        Without preload nothing more is compiled, for a playlist that only
+        checks the entries and hands them to a playback process (see follow()).
+        """
+        if loops_done >= self.entries[index][1]:
+            index, loops_done = index + 1, 0
+            if index == len(self.entries):
+                if not self.repeat:
+                    raise ValueError("The playlist already finished")
+                index = 0
+        self.current = index
+        programs, loops = self._compile(index)
+        if preload:
+            self._start_preload()
+        return programs, loops - loops_done
+
+    def follow(self, index):
+        """Carry on after entry index, whose programs the caller already has."""
+        self.current = index
+        self._start_preload()
+
+    def next_entry(self, stop_event=None):
+        """(programs, loops) of the next entry, or None at the end, on error or when stopped.
+
+        Normally already compiled; otherwise this waits for the loader.
+        """
+        while not self._ready.wait(0.01):
+            if stop_event is not None and stop_event.is_set():
+                return None
+        if self._next is None:
+            return None
+        self.current, entry = self._next
+        self._start_preload()
+        return entry
+
+    @property
+    def current_name(self):
+        return self.entries[self.current][0] if self.current >= 0 else None
@@ -0,0 +1,480 @@
+"""Playback in a child process of its own, controlled through shared memory.
+
+In the GUI the runner thread shares the interpreter with Qt: repaints,
+event processing and garbage collection all hold the GIL, and whatever
+holds it when a deadline comes up makes that input late. EngineProcess
+plays the same programs in a separate process instead, where the runner
+has the interpreter to itself and the garbage collector is off.
+
+The two sides talk through a ControlBlock, a small shared-memory segment
+of int64 slots. Each slot has one writer: the GUI writes the stop and
+pause requests, the child writes its telemetry and a copy of the recent
+lateness ring, like Telemetry does between threads. Nothing is locked
+between the processes and neither side waits on the other.
+
+After writing a request the GUI also sends a byte down a pipe, so the
+child's control thread sleeps until there is something to do instead of
+polling (every wake-up takes the GIL from the runner for a moment). That
+thread also wakes when the GUI process goes away, and stops the runner.
+A stop therefore releases every held input even when the GUI is stuck, as
+long as the stop request itself can be written, e.g. from the keyboard
+hook thread.
+
+Both processes read the same now_ns clock (system-wide on Windows and
+Linux), so deadlines such as start_at_ns can be passed across as they are.
+"""
+import atexit
+import gc
+import multiprocessing
+import threading
+import weakref
+from array import array
+from multiprocessing import shared_memory
+
+from engine.telemetry import RING_SIZE
+from engine.timing import Lateness, now_ns
+
+# Slots written by the GUI
+STOP = 0            # now_ns of the stop request, 0 until then
+PAUSE = 1           # 1 while paused
+# Slots written by the child
+STATE = 2
+START_NS = 3        # 0 until the first loop starts
+LOOPS = 4
+ENTRY_POSITION = 5  # playlist entry playing now and its loops done, see pack_position()
+RUNTIME_NS = 6
+LAST_LOOP_NS = 7
+PAUSED_NS = 8
+DISPATCHES = 9
+LATE_TOTAL_NS = 10
+LATE_MAX_NS = 11
+RESYNCS = 12
+UNTIL_TIMEOUTS = 13
+ENTRIES = 14        # playlist entries started after the first
+STOP_LATENCY_NS = 15    # -1 until stopped
+FIRST_DISPATCH_NS = 16  # -1 before the first dispatch
+RING_HEAD = 17
+SLOT_COUNT = 24
+
+# STATE values
+STARTING = 0
+RUNNING = 1
+DONE = 2
+
+# How often the child publishes telemetry (seconds); the GUI samples every 0.1 s
+PUBLISH_INTERVAL = 0.05
+
+BLOCK_SIZE = 8 * SLOT_COUNT + 8 * RING_SIZE + 4 * RING_SIZE
+
+# Engine processes that may still be holding input when the GUI exits
+_live_engines = weakref.WeakSet()
+
+
+def pack_position(entry, entry_loops):
+    """Telemetry.entry_position as one slot value, so it is written and read in one go."""
+    return entry << 32 | entry_loops
+
+
+def unpack_position(value):
+    return value >> 32, value & 0xFFFFFFFF
+
+
+class ControlBlock:
+    """The shared-memory segment: slots, then the lateness ring (values, then rows).
+
+    The creating side owns the segment and removes it in detach().
+    """
+
+    def __init__(self, name=None):
+        create = name is None
+        self._shm = shared_memory.SharedMemory(name=name, create=create, size=BLOCK_SIZE if create else 0)
+        self.name = self._shm.name
+        self.owner = create
+        buf = self._shm.buf
+        ring_start = 8 * SLOT_COUNT
+        rows_start = ring_start + 8 * RING_SIZE
+        self.slots = buf[:ring_start].cast('q')
+        self.ring_late = buf[ring_start:rows_start].cast('q')
+        self.ring_rows = buf[rows_start:BLOCK_SIZE].cast('i')
+        if create:
+            self.slots[STOP_LATENCY_NS] = -1
+            self.slots[FIRST_DISPATCH_NS] = -1
+        # Readers take this so detach() never pulls a view from under them
+        self.lock = threading.Lock()
+
+    def get(self, slot):
+        with self.lock:
+            return self.slots[slot]
+
+    def publish(self, telemetry):
+        """Copy a Telemetry into the block. Called by the child only."""
+        slots = self.slots
+        # The ring first, so a reader never sees a head ahead of its contents
+        self.ring_late[:] = telemetry.ring_late
+        self.ring_rows[:] = telemetry.ring_rows
+        slots[START_NS] = telemetry.start_ns or 0
+        slots[LOOPS] = telemetry.loops
+        slots[ENTRY_POSITION] = pack_position(*telemetry.entry_position)
+        slots[RUNTIME_NS] = telemetry.runtime_ns
+        slots[LAST_LOOP_NS] = telemetry.last_loop_ns
+        slots[PAUSED_NS] = telemetry.paused_ns
+        slots[DISPATCHES] = telemetry.lateness.count
+        slots[LATE_TOTAL_NS] = telemetry.lateness.total_ns
+        slots[LATE_MAX_NS] = telemetry.lateness.max_ns
+        slots[RESYNCS] = telemetry.resyncs
+        slots[UNTIL_TIMEOUTS] = telemetry.until_timeouts
+        slots[ENTRIES] = telemetry.entries
+        if telemetry.stop_latency_ns is not None:
+            slots[STOP_LATENCY_NS] = telemetry.stop_latency_ns
+        if telemetry.first_dispatch_ns is not None:
+            slots[FIRST_DISPATCH_NS] = telemetry.first_dispatch_ns
+        slots[RING_HEAD] = telemetry.ring_head
+
+    def detach(self):
+        """Keep a private copy of the contents and let go of the segment."""
+        with self.lock:
+            if isinstance(self.slots, array):
+                return
+            views = (self.slots, self.ring_late, self.ring_rows)
+            self.slots, self.ring_late, self.ring_rows = (array(view.format, view.tobytes()) for view in views)
+            for view in views:
+                view.release()
+            self._shm.close()
+            if self.owner:
+                self._shm.unlink()
+
+
+def _slot(index):
+    return property(lambda self: self._block.get(index))
+
+
+def _optional_slot(index):
+    """A slot that holds -1 for None."""
+    def get(self):
+        value = self._block.get(index)
+        return None if value < 0 else value
+    return property(get)
+
+
+class SharedTelemetry:
+    """Read-only Telemetry look-alike for the GUI side, backed by a ControlBlock.
+
+    Only the run-wide counters and the lateness ring cross over, not the
+    per-action statistics.
+    """
+
+    def __init__(self, block):
+        self._block = block
+
+    loops = _slot(LOOPS)
+    runtime_ns = _slot(RUNTIME_NS)
+    last_loop_ns = _slot(LAST_LOOP_NS)
+    paused_ns = _slot(PAUSED_NS)
+    resyncs = _slot(RESYNCS)
+    until_timeouts = _slot(UNTIL_TIMEOUTS)
+    entries = _slot(ENTRIES)
+    ring_head = _slot(RING_HEAD)
+    stop_latency_ns = _optional_slot(STOP_LATENCY_NS)
+    first_dispatch_ns = _optional_slot(FIRST_DISPATCH_NS)
+
+    @property
+    def start_ns(self):
+        return self._block.get(START_NS)
+
+    @property
+    def entry_position(self):
+        return unpack_position(self._block.get(ENTRY_POSITION))
+
+    @property
+    def entry_loops(self):
+        return self.entry_position[1]
+
+    @property
+    def running(self):
+        return self._block.get(STATE) == RUNNING
+
+    @property
+    def lateness(self):
+        """A snapshot of the overall lateness statistics."""
+        lateness = Lateness()
+        with self._block.lock:
+            slots = self._block.slots
+            lateness.count = slots[DISPATCHES]
+            lateness.total_ns = slots[LATE_TOTAL_NS]
+            lateness.max_ns = slots[LATE_MAX_NS]
+        return lateness
+
+    @property
+    def last_row(self):
+        with self._block.lock:
+            head = self._block.slots[RING_HEAD]
+            if not head:
+                return None
+            return self._block.ring_rows[(head - 1) & (RING_SIZE - 1)]
+
+    @property
+    def average_loop_ns(self):
+        loops = self.loops
+        return self.runtime_ns / loops if loops else 0.0
+
+    def recent_lateness(self, since):
+        """Like Telemetry.recent_lateness."""
+        block = self._block
+        with block.lock:
+            head = block.slots[RING_HEAD]
+            start = max(since, head - RING_SIZE)
+            samples = []
+            for i in range(start, head):
+                slot = i & (RING_SIZE - 1)
+                samples.append((block.ring_rows[slot], block.ring_late[slot]))
+        return head, samples
+
+
+class PlaylistView:
+    """What the GUI shows of a playlist playing in the engine process."""
+
+    def __init__(self, playlist, block):
+        self.entries = list(playlist.entries)
+        self.repeat = playlist.repeat
+        self._block = block
+        # Set once the engine process reports a failed load
+        self.error = None
+
+    @property
+    def current(self):
+        return unpack_position(self._block.get(ENTRY_POSITION))[0]
+
+    @property
+    def current_name(self):
+        return self.entries[self.current][0]
+
+
+class EngineProcess:
+    """Plays programs like MacroRunner, in a child process started for this one run.
+
+    Takes the same arguments, except that the backend is given by name (it
+    is created in the child) and trace only says whether to trace; the
+    Tracer comes back when the run ends. A playlist is re-created in the
+    child from its entries and carries on after its current entry, which
+    program must be.
+
+    Has the parts of MacroRunner's interface the GUI and Checkpointer use:
+    start(), stop(), pause(), resume(), is_alive(), join(), start_ns,
+    pausing, telemetry, playlist, tracer and tracks.
+    """
+
+    def __init__(self, program, loop_count, backend_name, profile=None, start_at_ns=None, trace=False,
+                 playlist=None):
+        self.tracks = list(program) if isinstance(program, (list, tuple)) else [program]
+        self.loop_count = loop_count
+        self.backend_name = backend_name
+        self.profile = profile
+        self.start_at_ns = start_at_ns
+        self.trace = trace
+        self._block = ControlBlock()
+        self.telemetry = SharedTelemetry(self._block)
+        self._source = playlist
+        self.playlist = PlaylistView(playlist, self._block) if playlist is not None else None
+        if playlist is not None:
+            self._block.slots[ENTRY_POSITION] = pack_position(playlist.current, 0)
+        self.tracer = None
+        # Why the engine process failed, if it did
+        self.error = None
+        self._process = None
+        self._conn = None
+        self._doorbell = None
+        self._doorbell_lock = threading.Lock()
+        self._done = False
+        self._finish_lock = threading.Lock()
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe(duplex=False)
+        doorbell, self._doorbell = context.Pipe(duplex=False)
+        playlist = None
+        if self._source is not None:
+            source = self._source
+            playlist = (source.entries, source.repeat, source.current, source.library.root)
+        job = {
+            "programs": self.tracks,
+            "loop_count": self.loop_count,
+            "backend": self.backend_name,
+            "profile": self.profile,
+            "start_at_ns": self.start_at_ns,
+            "trace": self.trace,
+            "playlist": playlist,
+        }
+        self._process = context.Process(target=_engine_main, args=(self._block.name, job, child_conn, doorbell),
+                                        name="engine", daemon=True)
+        self._process.start()
+        child_conn.close()
+        doorbell.close()
+        _live_engines.add(self)
+
+    @property
+    def start_ns(self):
+        return self._block.get(START_NS) or None
+
+    @property
+    def pausing(self):
+        return bool(self._block.get(PAUSE))
+
+    def stop(self):
+        """Ask the engine to stop. Safe from any thread; returns at once."""
+        self._request(STOP, now_ns())
+
+    def pause(self):
+        self._request(PAUSE, 1)
+
+    def resume(self):
+        self._request(PAUSE, 0)
+
+    def _request(self, slot, value):
+        with self._doorbell_lock:
+            if self._done or (slot == STOP and self._block.slots[STOP]):
+                return
+            self._block.slots[slot] = value
+            if self._doorbell is not None:
+                try:
+                    self._doorbell.send_bytes(b'!')
+                except OSError:
+                    # The engine is exiting already
+                    pass
+
+    def is_alive(self):
+        if self._process is None:
+            return False
+        self._collect()
+        if self._process.is_alive():
+            return True
+        self._finish()
+        return False
+
+    def join(self, timeout=None):
+        if self._process is None:
+            return
+        self._process.join(timeout)
+        if not self._process.is_alive():
+            self._finish()
+
+    def _collect(self):
+        """Take the result the child sends before exiting, so it never blocks on a full pipe."""
+        with self._finish_lock:
+            if self._conn is None or not self._conn.poll():
+                return
+            try:
+                result = self._conn.recv()
+            except EOFError:
+                result = {}
+            self._conn.close()
+            self._conn = None
+        self.tracer = result.get("tracer")
+        self.error = result.get("error")
+        if self.playlist is not None:
+            self.playlist.error = result.get("playlist_error")
+
+    def _finish(self):
+        self._collect()
+        with self._finish_lock, self._doorbell_lock:
+            if self._done:
+                return
+            self._done = True
+            if self._doorbell is not None:
+                self._doorbell.close()
+                self._doorbell = None
+        if self.error is None and self._process.exitcode:
+            self.error = f"the engine process exited with code {self._process.exitcode}"
+        self._block.detach()
+
+
+@atexit.register
+def _stop_on_exit():
+    # Daemon processes are killed on exit, which would leave their input held
+    for engine in list(_live_engines):
+        engine.stop()
+        engine.join(timeout=1.0)
+
+
+def _control(runner, block, doorbell):
+    """Engine process thread: carry out requests from the GUI and publish telemetry."""
+    from multiprocessing.connection import wait
+
+    slots = block.slots
+    parent = multiprocessing.parent_process()
+    paused = 0
+    while True:
+        ready = wait([doorbell, parent.sentinel], PUBLISH_INTERVAL)
+        if doorbell in ready:
+            try:
+                while doorbell.poll():
+                    doorbell.recv_bytes()
+            except EOFError:
+                # The GUI closed its end; its sentinel says whether it is gone
+                ready.append(parent.sentinel)
+        if parent.sentinel in ready or not parent.is_alive():
+            runner.stop()
+            return
+        stop_at = slots[STOP]
+        if stop_at:
+            # Stop latency counts from when the GUI asked
+            runner.stop_requested_ns = stop_at
+            runner.stop()
+            return
+        if slots[PAUSE] != paused:
+            paused = slots[PAUSE]
+            if paused:
+                runner.pause()
+            else:
+                runner.resume()
+        block.publish(runner.telemetry)
+
+
+def _engine_main(block_name, job, conn, doorbell):
+    """Entry point of the engine process: build the runner, play, report back."""
+    from engine.backends import BACKENDS
+    from engine.library import MacroLibrary
+    from engine.playlist import Playlist
+    from engine.runner import MacroRunner
+    from engine.trace import Tracer
+
+    block = ControlBlock(block_name)
+    slots = block.slots
+    result = {}
+    try:
+        backend = BACKENDS[job["backend"]]()
+        backend.warm_up()
+        playlist = None
+        if job["playlist"] is not None:
+            entries, repeat, current, root = job["playlist"]
+            playlist = Playlist(entries, MacroLibrary(root), backend, repeat)
+            playlist.follow(current)
+        runner = MacroRunner(job["programs"], job["loop_count"], threading.Event(), backend, job["profile"],
+                             start_at_ns=job["start_at_ns"], tracer=Tracer() if job["trace"] else None,
+                             playlist=playlist)
+    except Exception as e:
+        slots[STATE] = DONE
+        conn.send({"error": str(e)})
+        conn.close()
+        block.detach()
+        return
+
+    # Everything long-lived exists by now. Playback allocates nothing that
+    # can form a cycle, so there's nothing for the collector to find, and
+    # the process ends with the run.
+    gc.collect()
+    gc.freeze()
+    gc.disable()
+
+    slots[STATE] = RUNNING
+    threading.Thread(target=_control, args=(runner, block, doorbell), daemon=True).start()
+    # Played on this thread; a stop or the end of the run returns here
+    runner.run()
+    block.publish(runner.telemetry)
+    slots[STATE] = DONE
+
+    result["tracer"] = runner.tracer
+    if playlist is not None and playlist.error is not None:
+        result["playlist_error"] = str(playlist.error)
+    conn.send(result)
+    conn.close()
+    block.detach()
@@ -0,0 +1,260 @@
+import threading
+from array import array
+from collections import OrderedDict
+
+from engine.timing import seconds_to_ns
+
+# Opcodes. Positive opcodes dispatch input; zero and below only move the
+# track along its timeline. A wait is folded into the duration of the
+# instruction before it when that instruction runs exactly as often as the
+# wait does, otherwise it gets an OP_WAIT of its own.
+OP_WAIT = 0
+OP_KEY_DOWN = 1
+OP_KEY_UP = 2
+OP_MOUSE_DOWN = 3
+OP_MOUSE_UP = 4
+# Start of a counted block: args holds the count
+OP_REPEAT = -1
+# End of a counted block: args holds the pc of the first instruction of the body
+OP_END_REPEAT = -2
+# Call a subroutine: args holds the pc it starts at
+OP_CALL = -3
+# End of a subroutine, or of the whole program when nothing called it
+OP_RETURN = -4
+# Wait until codes[args] (a screen reference name) is on screen, for at most
+# durs nanoseconds. The runner polls it between other tracks' dispatches.
+OP_UNTIL = -5
+
+# Names of the dispatch opcodes (and OP_WAIT), indexed by opcode
+OP_NAMES = ("wait", "key_down", "key_up", "mouse_down", "mouse_up")
+
+# How many compiled programs to keep around for restarts
+CACHE_SIZE = 16
+
+
+class Program:
+    """A compiled action sequence.
+
+    Instruction i dispatches ops[i] with codes[args[i]] and then advances the
+    timeline by durs[i] nanoseconds. rows[i] is the table row (or sequence
+    index) it came from. Control opcodes use args as described above.
+    """
+    __slots__ = ('ops', 'args', 'durs', 'rows', 'codes', 'source_len')
+
+    def __init__(self, ops, args, durs, rows, codes, source_len):
+        self.ops = ops
+        self.args = args
+        self.durs = durs
+        self.rows = rows
+        self.codes = codes
+        self.source_len = source_len
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __reduce__(self):
+        # Columns mapped from a binary macro are memoryviews, which can't be
+        # pickled; a program sent to another process takes copies instead
+        columns = []
+        for column in (self.ops, self.args, self.durs, self.rows):
+            if isinstance(column, memoryview):
+                column = array(column.format, column.tobytes())
+            columns.append(column)
+        return (Program, (*columns, self.codes, self.source_len))
+
+    @property
+    def duration_ns(self):
+        """Length of one pass through the program, repeats and calls included.
+
+        Until instructions count as their timeout.
+        """
+        return self._duration(0, {})
+
+    def _duration(self, pc, memo):
+        if pc in memo:
+            return memo[pc]
+        ops, args, durs = self.ops, self.args, self.durs
+        start = pc
+        # One accumulator per open repeat block
+        stack = [[1, 0]]
+        while pc < len(ops):
+            op = ops[pc]
+            if op == OP_RETURN:
+                break
+            if op == OP_REPEAT:
+                stack.append([args[pc], 0])
+            elif op == OP_END_REPEAT:
+                count, total = stack.pop()
+                stack[-1][1] += count * total
+            elif op == OP_CALL:
+                stack[-1][1] += self._duration(args[pc], memo)
+            else:
+                stack[-1][1] += durs[pc]
+            pc += 1
+        memo[start] = stack[0][1]
+        return memo[start]
+
+    def __repr__(self):
+        return f"Program({len(self)} instructions, {self.duration_ns / 1e9:.3f}s per loop)"
+
+
+class _Builder:
+    def __init__(self, backend):
+        self.backend = backend
+        self.ops = array('b')
+        self.args = array('i')
+        self.durs = array('q')
+        self.rows = array('i')
+        self.codes = []
+        self.code_index = {}
+        self.max_row = -1
+        # (pc of an OP_CALL, subroutine name) still to be patched
+        self.calls = []
+
+    def code_for(self, kind, value):
+        entry = (kind, value)
+        if entry not in self.code_index:
+            self.code_index[entry] = len(self.codes)
+            backend = self.backend
+            if kind == 'key':
+                code = backend.resolve_key(value)
+            elif kind == 'mouse':
+                code = backend.resolve_button(value)
+            else:
+                code = value
+            self.codes.append(code)
+        return self.code_index[entry]
+
+    def emit(self, op, arg, dur, row):
+        self.ops.append(op)
+        self.args.append(arg)
+        self.durs.append(dur)
+        self.rows.append(row)
+        if row > self.max_row:
+            self.max_row = row
+
+    def block(self, actions):
+        # Waits may only fold into an instruction emitted by this block
+        block_start = len(self.ops)
+        for entry in actions:
+            kind, row = entry[0], entry[1]
+            if kind == 'wait':
+                amount = entry[2]
+                if len(self.ops) > block_start and self.ops[-1] >= 0:
+                    self.durs[-1] += amount
+                else:
+                    self.emit(OP_WAIT, -1, amount, row)
+            elif kind == 'repeat':
+                count, body = entry[2], entry[3]
+                if count <= 0 or not body:
+                    continue
+                self.emit(OP_REPEAT, count, 0, row)
+                body_start = len(self.ops)
+                self.block(body)
+                self.emit(OP_END_REPEAT, body_start, 0, row)
+            elif kind == 'call':
+                # Target pc is patched in once the subroutine has been laid out
+                self.calls.append((len(self.ops), entry[2]))
+                self.emit(OP_CALL, -1, 0, row)
+            elif kind == 'until':
+                self.emit(OP_UNTIL, self.code_for(kind, entry[2]), entry[3], row)
+            else:
+                value, amount = entry[2], entry[3]
+                if not value:
+                    continue
+                down, up = (OP_KEY_DOWN, OP_KEY_UP) if kind == 'key' else (OP_MOUSE_DOWN, OP_MOUSE_UP)
+                code = self.code_for(kind, value)
+                self.emit(down, code, amount, row)
+                self.emit(up, code, 0, row)
+
+    def build(self, main, subroutines):
+        self.block(main)
+        self.emit(OP_RETURN, -1, 0, self.max_row if self.max_row >= 0 else 0)
+        # Each subroutine is laid out once after the main code, however often it is called
+        starts = {}
+        for name, body in subroutines:
+            starts[name] = len(self.ops)
+            self.block(body)
+            self.emit(OP_RETURN, -1, 0, self.rows[-1] if self.rows else 0)
+        for pc, name in self.calls:
+            self.args[pc] = starts[name]
+        return self.program()
+
+    def program(self):
+        return Program(self.ops, self.args, self.durs, self.rows, tuple(self.codes), self.max_row + 1)
+
+
+def _freeze(sequence, subroutines):
+    """Hashable form of a sequence, which is also what the builder walks.
+
+    Called bodies are frozen once into subroutines (name -> frozen body)
+    and referenced by name, so shared bodies are never duplicated.
+    """
+    frozen = []
+    for index, action in enumerate(sequence):
+        type_ = action['type']
+        row = action.get('row', index)
+        if type_ == 'wait':
+            frozen.append(('wait', row, seconds_to_ns(action['value'])))
+        elif type_ in ('key', 'mouse'):
+            frozen.append((type_, row, action.get('value', ''), seconds_to_ns(action.get('hold', 0.1))))
+        elif type_ == 'repeat':
+            frozen.append(('repeat', row, int(action['count']), _freeze(action['body'], subroutines)))
+        elif type_ == 'until':
+            frozen.append(('until', row, action['value'], seconds_to_ns(action.get('timeout', 0))))
+        elif type_ == 'call':
+            name = action['name']
+            if name not in subroutines:
+                # Reserve the name first so a body calling itself can't recurse forever
+                subroutines[name] = None
+                subroutines[name] = _freeze(action['body'], subroutines)
+            frozen.append(('call', row, name))
+        else:
+            raise ValueError(f"Unknown action type {type_!r}")
+    return tuple(frozen)
+
+
+def until_references(programs):
+    """Names of the screen references the until instructions of programs wait for."""
+    return {
+        program.codes[program.args[pc]]
+        # The `in` test runs in C, so long programs without until rows are skipped quickly
+        for program in programs if OP_UNTIL in program.ops
+        for pc in range(len(program)) if program.ops[pc] == OP_UNTIL
+    }
+
+
+_cache = OrderedDict()
+# Playlists compile the next entry on a background thread
+_cache_lock = threading.Lock()
+
+
+def compile_sequence(sequence, backend):
+    """Compile a list of action dicts into a Program for backend.
+
+    Accepts what get_sequence builds: key/mouse actions with a hold, waits,
+    repeat blocks ({"type": "repeat", "count": n, "body": [...]}) and calls
+    ({"type": "call", "name": ..., "body": [...]}) and screen conditions
+    ({"type": "until", "value": reference, "timeout": s}). Repeats compile to
+    counted loops and calls to one shared subroutine per name, so neither
+    is unrolled. An action's "row", if present, is what lateness is
+    reported against.
+
+    Results are cached by content, so restarting the same table reuses them.
+    """
+    subroutines = {}
+    frozen = _freeze(sequence, subroutines)
+    subroutines = tuple(subroutines.items())
+    key = (backend.name, frozen, subroutines)
+
+    with _cache_lock:
+        program = _cache.get(key)
+        if program is not None:
+            _cache.move_to_end(key)
+            return program
+    program = _Builder(backend).build(frozen, subroutines)
+    with _cache_lock:
+        _cache[key] = program
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return program
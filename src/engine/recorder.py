@@ -0,0 +1,225 @@
+import heapq
+import threading
+from array import array
+from operator import itemgetter
+
+from engine.program import OP_KEY_DOWN, OP_KEY_UP, OP_MOUSE_DOWN, OP_MOUSE_UP
+from engine.timing import now_ns
+
+# Hook callbacks write into a ring this big; must be a power of two
+RING_SIZE = 1 << 16
+# How often the drain thread empties the ring into the recording
+DRAIN_INTERVAL = 0.02
+# Gaps shorter than this are recorded as no wait at all
+MIN_GAP_NS = 1_000_000
+
+
+class _Ring:
+    """Events from one listener thread, in a preallocated ring.
+
+    It has a single writer, so claiming a slot is a plain increment. The
+    keyboard and the mouse hooks run on threads of their own and get a ring
+    each.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._mask = capacity - 1
+        self._times = array('q', bytes(8 * capacity))
+        self._ops = array('b', bytes(capacity))
+        self._names = [None] * capacity
+        self._head = 0
+        self._tail = 0
+        # Drained events, in order
+        self.times = array('q')
+        self.ops = array('b')
+        self.names = []
+        self.dropped = 0
+
+    def write(self, time_ns, op, name):
+        slot = self._head & self._mask
+        self._times[slot] = time_ns
+        self._ops[slot] = op
+        self._names[slot] = name
+        self._head += 1
+
+    def drain(self):
+        head = self._head
+        tail = self._tail
+        if head - tail > self.capacity:
+            # Overwritten before we got to them
+            self.dropped += head - tail - self.capacity
+            tail = head - self.capacity
+        mask = self._mask
+        for i in range(tail, head):
+            slot = i & mask
+            self.times.append(self._times[slot])
+            self.ops.append(self._ops[slot])
+            self.names.append(self._names[slot])
+        self._tail = head
+
+
+class Recorder:
+    """Records keyboard (and, if the mouse package is installed, mouse button) input.
+
+    Hook callbacks only stamp the time and store the event in a preallocated
+    ring, one per listener thread; a drain thread moves events out of the
+    rings while recording, so a burst never waits on anything and nothing
+    is dropped unless a ring fills up within one drain interval. stop()
+    merges the two sources by time.
+    """
+
+    def __init__(self, capacity=RING_SIZE):
+        self.capacity = capacity
+        self._keys = _Ring(capacity)
+        self._buttons = _Ring(capacity)
+        # Every recorded event, in time order; filled in by stop()
+        self.times = array('q')
+        self.ops = array('b')
+        self.names = []
+        self._hooks = []
+        self._stop = threading.Event()
+        self._drainer = None
+
+    @property
+    def dropped(self):
+        return self._keys.dropped + self._buttons.dropped
+
+    # -- hook callbacks: run on the keyboard/mouse listener threads
+
+    def _on_key(self, event):
+        if event.name is None:
+            # Keys the keyboard package has no name for can't be played back
+            return
+        self._keys.write(now_ns(), OP_KEY_DOWN if event.event_type == 'down' else OP_KEY_UP, event.name)
+
+    def _on_mouse(self, event):
+        event_type = getattr(event, 'event_type', None)
+        if event_type is None or not hasattr(event, 'button'):
+            # Moves and wheel events
+            return
+        t = now_ns()
+        if event_type == 'double':
+            # The second click of a double click comes as one event; record it as a click
+            self._buttons.write(t, OP_MOUSE_DOWN, event.button)
+            self._buttons.write(t, OP_MOUSE_UP, event.button)
+        else:
+            self._buttons.write(t, OP_MOUSE_UP if event_type == 'up' else OP_MOUSE_DOWN, event.button)
+
+    # --
+
+    def _drain(self):
+        self._keys.drain()
+        self._buttons.drain()
+
+    def _merge(self):
+        """Interleave the drained key and button events by timestamp."""
+        sources = [zip(ring.times, ring.ops, ring.names) for ring in (self._keys, self._buttons)]
+        times, ops, names = array('q'), array('b'), []
+        for t, op, name in heapq.merge(*sources, key=itemgetter(0)):
+            times.append(t)
+            ops.append(op)
+            names.append(name)
+        self.times, self.ops, self.names = times, ops, names
+
+    def _drain_loop(self):
+        while not self._stop.wait(DRAIN_INTERVAL):
+            self._drain()
+
+    def start(self):
+        import keyboard
+        self._stop.clear()
+        self._drainer = threading.Thread(target=self._drain_loop, daemon=True)
+        self._drainer.start()
+        self._hooks.append((keyboard.unhook, keyboard.hook(self._on_key)))
+        try:
+            import mouse
+        except ImportError:
+            # Keyboard only; the mouse package is the optional record-mouse extra
+            pass
+        else:
+            mouse.hook(self._on_mouse)
+            self._hooks.append((mouse.unhook, self._on_mouse))
+        self.start_ns = now_ns()
+
+    def stop(self):
+        """Stop recording. Returns the stop time, for to_actions(end_ns=...)."""
+        for unhook, handle in self._hooks:
+            unhook(handle)
+        self._hooks = []
+        self._stop.set()
+        if self._drainer is not None:
+            self._drainer.join()
+        self._drain()
+        self._merge()
+        return now_ns()
+
+    def to_actions(self, end_ns=None, drop_trailing_click=False):
+        """Post-process the recording into saved-format actions."""
+        times, ops, names = self.times, self.ops, self.names
+        if drop_trailing_click:
+            # The click on "Stop Recording" itself
+            times, ops, names = _without_trailing_click(times, ops, names)
+        return events_to_actions(times, ops, names, end_ns)
+
+
+def _without_trailing_click(times, ops, names):
+    n = len(ops)
+    if n >= 2 and ops[n - 2] == OP_MOUSE_DOWN and ops[n - 1] == OP_MOUSE_UP and names[n - 1] == names[n - 2]:
+        return times[:n - 2], ops[:n - 2], names[:n - 2]
+    return times, ops, names
+
+
+def events_to_actions(times, ops, names, end_ns=None):
+    """Pair presses with releases into key/mouse rows with their hold, and gaps into waits.
+
+    Auto-repeat presses of a key that is already down are coalesced into the
+    original press. Rows play back one after another, so where presses
+    overlapped the wait after a row is shortened (never below zero) to keep
+    later rows as close to their recorded times as possible.
+    """
+    actions = []
+    press_times = []
+    # (op, name) of a press still down -> its row
+    open_rows = {}
+
+    for t, op, name in zip(times, ops, names):
+        if op == OP_KEY_DOWN or op == OP_MOUSE_DOWN:
+            if (op, name) in open_rows:
+                continue
+            open_rows[(op, name)] = len(actions)
+            press_times.append(t)
+            type_ = 'key' if op == OP_KEY_DOWN else 'mouse'
+            actions.append({"type": type_, "value": name, "hold": 0.0, "wait": 0.0})
+        else:
+            row = open_rows.pop((op - 1, name), None)
+            if row is None:
+                # Released something pressed before recording started
+                continue
+            actions[row]['hold'] = _seconds(t - press_times[row])
+
+    if end_ns is not None:
+        # Still held when recording stopped
+        for row in open_rows.values():
+            actions[row]['hold'] = _seconds(end_ns - press_times[row])
+
+    if not actions:
+        return actions
+    # When serial playback of the rows so far would start the current row,
+    # worked out from the rounded values so rounding never accumulates
+    start = press_times[0]
+    for row in range(len(actions) - 1):
+        end = start + _ns(actions[row]['hold'])
+        gap = press_times[row + 1] - end
+        actions[row]['wait'] = _seconds(gap) if gap >= MIN_GAP_NS else 0.0
+        start = end + _ns(actions[row]['wait'])
+    return actions
+
+
+def _seconds(ns):
+    # Millisecond resolution is plenty for the table and keeps it readable
+    return round(ns / 1e9, 3)
+
+
+def _ns(seconds):
+    return int(round(seconds * 1e9))
@@ -0,0 +1,466 @@
+import atexit
+import threading
+import weakref
+from heapq import heapify, heappop, heapreplace
+
+from engine.program import OP_CALL, OP_END_REPEAT, OP_KEY_DOWN, OP_NAMES, OP_REPEAT, OP_UNTIL, OP_WAIT, until_references
+from engine.telemetry import Telemetry
+from engine.timing import MAX_LATENESS_NS, POLL_INTERVAL_NS, now_ns, sleep_until
+
+# Runners that may still be holding input when the interpreter exits
+_live_runners = weakref.WeakSet()
+
+
+class MacroRunner(threading.Thread):
+    """Plays one or more compiled tracks in parallel on this single thread.
+
+    program is a Program or a list of them, one per track. All tracks share
+    one timeline: every instruction of every track is scheduled through one
+    heap ordered by deadline, so overlapping presses and releases go out in
+    deadline order. A loop ends when the longest track ends. Inputs that
+    fall due at the same instant, on any tracks, go to the backend as one
+    batch (see InputBackend.send_batch), issued ahead of that deadline by
+    the largest calibrated lead among them.
+
+    With a Tracer every press, release and wait is also logged with its
+    planned and actual time; without one the hot loop only pays a None check.
+
+    Until instructions (screen conditions) are polled through the same heap:
+    a track waiting on the screen is rescheduled every POLL_INTERVAL_NS and
+    the other tracks keep playing in between. Once the condition is met, or
+    times out, the rest of that track is timed from that moment. screen is
+    what answers the polls; by default the real screen is captured.
+
+    With start_at_ns the thread can be started early: it waits (interruptibly)
+    and the first input goes out at start_at_ns instead of as soon as possible.
+
+    With a Playlist, program and loop_count are its first entry. Each
+    following entry is fetched when the one before finishes and starts at
+    that entry's end deadline, so entries follow each other with no gap.
+
+    pause() wakes the runner through the stop event like stop() does, so the
+    hot loop pays nothing for it. The runner then releases what it holds and
+    waits; resume() presses those inputs again and shifts the timeline by the
+    time spent paused, so playback carries on where it left off.
+    """
+
+    def __init__(self, program, loop_count, stop_event, backend, profile=None, telemetry=None,
+                 start_at_ns=None, tracer=None, screen=None, playlist=None):
+        super().__init__(daemon=True)
+        self.loop_count = loop_count
+        self.stop_event = stop_event
+        self.backend = backend
+        # Measured backend latency; each call is issued this far ahead of its deadline
+        self.leads = profile.leads() if profile is not None else (0,) * len(OP_NAMES)
+        self.screen = screen
+        self.playlist = playlist
+        source_len = self._set_tracks(list(program) if isinstance(program, (list, tuple)) else [program])
+        # Loop counts, loop times and the lateness of every dispatch against its
+        # planned deadline, overall and per source action
+        self.telemetry = telemetry if telemetry is not None else Telemetry(source_len)
+        if playlist is not None:
+            self.telemetry.entry_position = (playlist.current, 0)
+        self.start_at_ns = start_at_ns
+        self.tracer = tracer
+        self.start_ns = None
+        # (release opcode, code) for every input currently pressed
+        self.held = set()
+        self._release_lock = threading.Lock()
+        self.stop_requested_ns = None
+        # Time from stop() to every held input being released
+        self.stop_latency_ns = None
+        # Set by pause(), cleared by the runner once it has resumed
+        self.pausing = False
+        self._resume = threading.Event()
+        self._pause_lock = threading.Lock()
+
+    def _set_tracks(self, tracks, prepare=True):
+        """Switch to a new set of tracks. Returns how many source actions they have.
+
+        Playlist entries come with their screen references already loaded,
+        so they are switched to with prepare=False.
+        """
+        self.tracks = tracks
+        # Telemetry numbers the source actions of all tracks consecutively
+        self.row_bases = []
+        source_len = 0
+        for track in tracks:
+            self.row_bases.append(source_len)
+            source_len += track.source_len
+        references = until_references(tracks) if prepare else None
+        if references:
+            if self.screen is None:
+                from engine.screen import ScreenMatcher
+                self.screen = ScreenMatcher()
+            # Fails here, before playback, when a reference is missing
+            self.screen.prepare(references)
+        return source_len
+
+    @property
+    def program(self):
+        return self.tracks[0]
+
+    def stop(self):
+        with self._pause_lock:
+            if self.stop_requested_ns is None:
+                self.stop_requested_ns = now_ns()
+            self.stop_event.set()
+            # Also ends a pause
+            self._resume.set()
+
+    def pause(self):
+        with self._pause_lock:
+            if self.stop_requested_ns is None:
+                self._resume.clear()
+                self.pausing = True
+                self.stop_event.set()
+
+    def resume(self):
+        self._resume.set()
+
+    def _wait_paused(self):
+        """Sit out a pause. Returns how long it lasted, or None if stopped meanwhile."""
+        paused_at = now_ns()
+        with self._release_lock:
+            was_held = list(self.held)
+        self.release_all()
+        while True:
+            self._resume.wait()
+            with self._pause_lock:
+                if self.stop_requested_ns is not None:
+                    return None
+                # Paused again between resume() and here: keep waiting
+                if self._resume.is_set():
+                    self.pausing = False
+                    self.stop_event.clear()
+                    break
+        handlers = self.backend.handlers()
+        for op, code in was_held:
+            # Press again what was held when the pause began
+            handlers[op - 1](code)
+            self.held.add((op, code))
+        paused_ns = now_ns() - paused_at
+        self.telemetry.paused_ns += paused_ns
+        return paused_ns
+
+    def release_all(self):
+        """Release everything still held. Safe to call from any thread, more than once."""
+        with self._release_lock:
+            handlers = self.backend.handlers()
+            while self.held:
+                op, code = self.held.pop()
+                try:
+                    handlers[op](code)
+                except Exception:
+                    # Keep going, the other inputs still need releasing
+                    pass
+            if self.stop_requested_ns is not None and self.stop_latency_ns is None:
+                self.stop_latency_ns = now_ns() - self.stop_requested_ns
+                self.telemetry.stop_latency_ns = self.stop_latency_ns
+
+    def run(self):
+        _live_runners.add(self)
+        self.telemetry.running = True
+        try:
+            self._play()
+        finally:
+            self.release_all()
+            self.telemetry.running = False
+
+    def _play(self):
+        # Per track: its program's arrays, filled in by load()
+        track_ops = []
+        track_args = []
+        track_durs = []
+        track_rows = []
+        track_codes = []
+        track_counts = []
+        row_bases = []
+        handlers = self.backend.handlers()
+        send_batch = self.backend.send_batch if self.backend.supports_batch else None
+        # Inputs due at one instant, sent together; reused for every batch
+        batch_ops = []
+        batch_codes = []
+        # With a tracer, the batch's inputs and the waits after them, traced once it is sent
+        batch_trace = []
+        leads = self.leads
+        stop_event = self.stop_event
+        is_stopped = stop_event.is_set
+        telemetry = self.telemetry
+        record = telemetry.record
+        held = self.held
+        tracer = self.tracer
+        trace = tracer.record if tracer is not None else None
+        screen_matches = self.screen.matches if self.screen is not None else None
+
+        # Per track: next instruction, its deadline, the remaining count of
+        # every repeat block it is inside and where its open calls return to
+        pcs = []
+        deadlines = []
+        repeats = []
+        returns = []
+
+        def load(tracks):
+            """Fill the per-track lists in place, so seek() sees the new tracks."""
+            if tracer is not None:
+                tracer.begin_programs(tracks)
+            track_ops[:] = [track.ops for track in tracks]
+            track_args[:] = [track.args for track in tracks]
+            track_durs[:] = [track.durs for track in tracks]
+            track_rows[:] = [track.rows for track in tracks]
+            track_codes[:] = [track.codes for track in tracks]
+            track_counts[:] = [len(track) for track in tracks]
+            row_bases[:] = self.row_bases
+            pcs[:] = [0] * len(tracks)
+            deadlines[:] = [0] * len(tracks)
+            repeats[:] = [[] for _ in tracks]
+            returns[:] = [[] for _ in tracks]
+
+        load(self.tracks)
+
+        # Everything due at one deadline goes out in one batch, issued one
+        # lead ahead of it: the largest lead among its inputs. Usually every
+        # input has the same lead (0 when uncalibrated), and there is nothing to look up.
+        fixed_lead = leads[OP_KEY_DOWN] if len(set(leads[OP_KEY_DOWN:])) == 1 else None
+
+        def batch_lead(heap, due):
+            """Largest lead among the inputs due at deadline due, found without popping them."""
+            lead = 0
+            pending = [0]
+            while pending:
+                i = pending.pop()
+                if i < len(heap) and heap[i][0] == due:
+                    t = heap[i][1]
+                    op = track_ops[t][pcs[t]]
+                    if op > 0 and leads[op] > lead:
+                        lead = leads[op]
+                    # Only the children of an entry due at due can be due at due too
+                    pending.append(2 * i + 1)
+                    pending.append(2 * i + 2)
+            return lead
+
+        def seek(t, pc, deadline):
+            """Run track t's control instructions from pc up to its next dispatch."""
+            ops = track_ops[t]
+            count = track_counts[t]
+            while pc < count:
+                op = ops[pc]
+                if op > 0 or op == OP_UNTIL:
+                    break
+                if op == OP_WAIT:
+                    if trace is not None:
+                        batch_trace.append((t, track_rows[t][pc], OP_WAIT, 0, deadline, track_durs[t][pc]))
+                    deadline += track_durs[t][pc]
+                    pc += 1
+                elif op == OP_REPEAT:
+                    repeats[t].append(track_args[t][pc])
+                    pc += 1
+                elif op == OP_END_REPEAT:
+                    remaining = repeats[t]
+                    remaining[-1] -= 1
+                    if remaining[-1]:
+                        pc = track_args[t][pc]
+                    else:
+                        remaining.pop()
+                        pc += 1
+                elif op == OP_CALL:
+                    returns[t].append(pc + 1)
+                    pc = track_args[t][pc]
+                elif returns[t]:
+                    pc = returns[t].pop()
+                else:
+                    # OP_RETURN from the main program: this track is done
+                    pc = count
+            pcs[t] = pc
+            deadlines[t] = deadline
+            return pc, deadline
+
+        def flush_trace(actual_ns):
+            """Trace everything queued in batch_trace as having happened at actual_ns."""
+            for t, row, op, arg, deadline, dur in batch_trace:
+                trace(t, row, op, arg, deadline + shift, actual_ns, dur)
+            del batch_trace[:]
+
+        max_lead = max(leads)
+        start_ns = now_ns()
+        if self.start_at_ns is not None:
+            # Everything is compiled and resolved already; just wait for the
+            # countdown, spinning at the end like any other deadline
+            start_ns = max(start_ns, self.start_at_ns - max_lead)
+            while sleep_until(start_ns, stop_event) is None:
+                if not self.pausing or self._wait_paused() is None:
+                    return
+                # Paused during the countdown: start as soon as resumed
+                start_ns = max(now_ns(), start_ns)
+        self.start_ns = telemetry.start_ns = start_ns
+        loop_counter = 0
+        # Every press, release and wait is planned against this absolute timeline,
+        # so dispatch overhead and sleep overshoot never accumulate across loops.
+        # It starts one lead time out so the first call isn't already late.
+        loop_deadline = start_ns + max_lead
+        # Added to every planned deadline once we've had to rebase the timeline
+        shift = 0
+
+        # Handle infinite loops vs fixed count
+        while True:
+            if is_stopped():
+                if not self.pausing:
+                    break
+                paused_ns = self._wait_paused()
+                if paused_ns is None:
+                    break
+                shift += paused_ns
+
+            # Check if we've reached the fixed loop count (if not infinite)
+            if self.loop_count != float('inf') and loop_counter >= self.loop_count:
+                # A playlist goes on with its next entry, already compiled, from
+                # where this one's timeline ended
+                entry = self.playlist.next_entry(stop_event) if self.playlist is not None else None
+                if entry is None:
+                    if self.pausing and self.playlist is not None and self.playlist.error is None:
+                        # Paused while the next entry was still loading
+                        continue
+                    break
+                tracks, self.loop_count = entry
+                telemetry.begin_entry(self.playlist.current, self._set_tracks(tracks, prepare=False))
+                load(tracks)
+                if self.playlist.screen is not None:
+                    self.screen = self.playlist.screen
+                screen_matches = self.screen.matches if self.screen is not None else None
+                loop_counter = 0
+                continue
+
+            loop_start_ns = now_ns()
+            loop_end = loop_deadline
+            # (deadline, track) of each track's next dispatch
+            heap = []
+            for t in range(len(track_ops)):
+                repeats[t].clear()
+                returns[t].clear()
+                pc, deadline = seek(t, 0, loop_deadline)
+                if pc < track_counts[t]:
+                    heap.append((deadline, t))
+                elif deadline > loop_end:
+                    loop_end = deadline
+            heapify(heap)
+            if trace is not None:
+                flush_trace(now_ns())
+
+            while heap:
+                due, t = heap[0]
+                pc = pcs[t]
+                op = track_ops[t][pc]
+                if op < 0:
+                    lead = 0
+                elif fixed_lead is not None:
+                    lead = fixed_lead
+                else:
+                    lead = batch_lead(heap, due)
+                late = sleep_until(due - lead + shift, stop_event)
+                if late is None:
+                    if not self.pausing:
+                        return
+                    paused_ns = self._wait_paused()
+                    if paused_ns is None:
+                        return
+                    shift += paused_ns
+                    continue
+                if op < 0:
+                    # OP_UNTIL: look at the screen, and if it isn't there yet
+                    # come back later without holding up the other tracks
+                    arg = track_args[t][pc]
+                    matched = screen_matches(track_codes[t][arg])
+                    now = now_ns() - shift
+                    timeout_at = deadlines[t] + track_durs[t][pc]
+                    if not matched and now < timeout_at:
+                        heapreplace(heap, (min(now + POLL_INTERVAL_NS, timeout_at), t))
+                        continue
+                    if not matched:
+                        telemetry.until_timeouts += 1
+                    if trace is not None:
+                        trace(t, track_rows[t][pc], OP_UNTIL, arg, deadlines[t] + shift, now + shift,
+                              now - deadlines[t])
+                    # The rest of the track is timed from when the wait ended
+                    pc, deadline = seek(t, pc + 1, max(now, deadlines[t]))
+                    if trace is not None:
+                        flush_trace(now + shift)
+                    if pc < track_counts[t]:
+                        heapreplace(heap, (deadline, t))
+                    else:
+                        heappop(heap)
+                        if deadline > loop_end:
+                            loop_end = deadline
+                    continue
+                # Gather everything else due at this same instant, so chords and
+                # back-to-back release/press pairs go out together
+                del batch_ops[:]
+                del batch_codes[:]
+                while True:
+                    record(row_bases[t] + track_rows[t][pc], late)
+                    arg = track_args[t][pc]
+                    code = track_codes[t][arg]
+                    batch_ops.append(op)
+                    batch_codes.append(code)
+                    if trace is not None:
+                        batch_trace.append((t, track_rows[t][pc], op, arg, deadlines[t], 0))
+                    # Presses have odd opcodes, their release is the next one up
+                    if op & 1:
+                        held.add((op + 1, code))
+                    else:
+                        held.discard((op, code))
+
+                    # Move this track on to its next dispatch
+                    pc, deadline = seek(t, pc + 1, deadlines[t] + track_durs[t][pc])
+                    if pc < track_counts[t]:
+                        heapreplace(heap, (deadline, t))
+                    else:
+                        heappop(heap)
+                        if deadline > loop_end:
+                            loop_end = deadline
+                    if not heap or heap[0][0] != due:
+                        break
+                    t = heap[0][1]
+                    pc = pcs[t]
+                    op = track_ops[t][pc]
+                    if op < 0:
+                        # Screen polls are slow; they wait until the batch is out
+                        break
+
+                if late > MAX_LATENESS_NS:
+                    # Too far behind to catch up sensibly, restart the timeline from here
+                    telemetry.resyncs += 1
+                    shift += late
+                if len(batch_ops) == 1:
+                    handlers[batch_ops[0]](batch_codes[0])
+                elif send_batch is not None:
+                    send_batch(batch_ops, batch_codes)
+                else:
+                    for op, code in zip(batch_ops, batch_codes):
+                        handlers[op](code)
+                if trace is not None:
+                    # Waits seeked past while gathering began once this was out
+                    flush_trace(now_ns())
+
+            # A trailing wait is part of the loop: sit it out before counting the
+            # loop done, or a wait-only macro would spin through its loops. Up
+            # to one lead early, so the next loop's first input is still on time.
+            while sleep_until(loop_end - max_lead + shift, stop_event) is None:
+                if not self.pausing:
+                    return
+                paused_ns = self._wait_paused()
+                if paused_ns is None:
+                    return
+                shift += paused_ns
+
+            loop_deadline = loop_end
+            loop_counter += 1
+            telemetry.loop_done(loop_start_ns, now_ns())
+
+
+@atexit.register
+def _release_on_exit():
+    for runner in list(_live_runners):
+        runner.stop()
+        if runner.is_alive() and runner is not threading.current_thread():
+            runner.join(timeout=0.5)
+        runner.release_all()
@@ -0,0 +1,152 @@
+import io
+import os
+
+import numpy as np
+
+from engine.fileio import atomic_write
+from engine.paths import REFERENCES_DIR
+
+# Every DOWNSAMPLE-th pixel in each direction is compared. Menus and HUD
+# elements are large and flat, so this loses nothing that matters and makes
+# a comparison 16x cheaper.
+DOWNSAMPLE = 4
+# Mean absolute difference per channel (0-255) still counted as a match
+DEFAULT_TOLERANCE = 8.0
+REFERENCE_SUFFIX = '.npz'
+
+
+def downsample(image, factor=DOWNSAMPLE):
+    """A strided RGB view of image (a PIL image or array), without copying when possible."""
+    pixels = np.asarray(image)
+    if pixels.ndim == 2:
+        return pixels[::factor, ::factor]
+    return pixels[::factor, ::factor, :3]
+
+
+class Reference:
+    """A downsampled snapshot of a screen region to wait for."""
+    __slots__ = ('name', 'region', 'pixels', 'factor', 'tolerance', '_scratch')
+
+    def __init__(self, name, region, pixels, factor=DOWNSAMPLE, tolerance=DEFAULT_TOLERANCE):
+        self.name = name
+        # (left, top, width, height) in screen pixels
+        self.region = tuple(int(v) for v in region)
+        self.pixels = np.ascontiguousarray(pixels, dtype=np.int16)
+        self.factor = factor
+        self.tolerance = tolerance
+        # Reused by every comparison so polling doesn't allocate
+        self._scratch = np.empty_like(self.pixels)
+
+    def difference(self, image):
+        """Mean absolute difference per channel between image (the captured region) and the snapshot."""
+        small = downsample(image, self.factor)
+        if small.shape != self.pixels.shape:
+            # Different size or colour depth, e.g. the resolution changed
+            return float('inf')
+        scratch = self._scratch
+        np.subtract(small, self.pixels, out=scratch, dtype=np.int16)
+        np.abs(scratch, out=scratch)
+        return float(scratch.mean())
+
+    def matches(self, image):
+        return self.difference(image) <= self.tolerance
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        np.savez(buffer, pixels=self.pixels.astype(np.uint8), region=np.array(self.region),
+                 factor=np.array(self.factor), tolerance=np.array(self.tolerance))
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, name, data):
+        with np.load(io.BytesIO(data), allow_pickle=False) as saved:
+            return cls(name, saved['region'], saved['pixels'], int(saved['factor']), float(saved['tolerance']))
+
+
+def grab_screen(region):
+    """The screen region (left, top, width, height) as an RGB array, via pyautogui."""
+    import pyautogui
+    return np.asarray(pyautogui.screenshot(region=region))
+
+
+class ReferenceStore:
+    """Reference snapshots saved by name, one .npz file each.
+
+    Loaded references are cached and only re-read when their file changes,
+    so arming the same macro again touches no pixels.
+    """
+
+    def __init__(self, root=REFERENCES_DIR):
+        self.root = root
+        # name -> (mtime, Reference)
+        self._cache = {}
+
+    def path(self, name):
+        return os.path.join(self.root, name + REFERENCE_SUFFIX)
+
+    def names(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(f[:-len(REFERENCE_SUFFIX)] for f in os.listdir(self.root)
+                      if f.endswith(REFERENCE_SUFFIX) and not f.startswith('.'))
+
+    def __contains__(self, name):
+        return os.path.exists(self.path(name))
+
+    def load(self, name):
+        path = self.path(name)
+        mtime = os.stat(path).st_mtime_ns
+        cached = self._cache.get(name)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'rb') as f:
+            reference = Reference.from_bytes(name, f.read())
+        self._cache[name] = (mtime, reference)
+        return reference
+
+    def save(self, reference):
+        os.makedirs(self.root, exist_ok=True)
+        atomic_write(self.path(reference.name), reference.to_bytes())
+        self._cache.pop(reference.name, None)
+
+    def capture(self, name, region, grab=grab_screen, factor=DOWNSAMPLE, tolerance=DEFAULT_TOLERANCE):
+        """Snapshot region of the screen as reference name and save it."""
+        reference = Reference(name, region, downsample(grab(tuple(region)), factor), factor, tolerance)
+        self.save(reference)
+        return reference
+
+    def delete(self, name):
+        os.remove(self.path(name))
+        self._cache.pop(name, None)
+
+
+class ScreenMatcher:
+    """What the runner asks whether an until row's reference is on screen.
+
+    grab(region) returns the pixels of a screen region; pass a fake one to
+    run conditions against synthetic images without a display.
+    """
+
+    def __init__(self, store=None, grab=grab_screen):
+        self.store = store if store is not None else ReferenceStore()
+        self.grab = grab
+        self.references = {}
+
+    def prepare(self, names):
+        """Load the references up front so the first poll doesn't read files.
+
+        Unchanged references come from the store's cache; recaptured ones
+        are read again.
+        """
+        for name in names:
+            try:
+                self.references[name] = self.store.load(name)
+            except FileNotFoundError:
+                raise ValueError(f"No screen reference named {name!r}") from None
+
+    def matches(self, name):
+        reference = self.references.get(name)
+        if reference is None:
+            self.prepare((name,))
+            reference = self.references[name]
+        return reference.matches(self.grab(reference.region))
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from engine.paths import SOAK_PATH
+
+# How often a long run writes where it has got to
+CHECKPOINT_INTERVAL = 10.0
+# Checkpoints are flushed to the OS at once but only fsynced this often,
+# so a power cut loses at most this much progress
+FSYNC_INTERVAL = 60.0
+# How much of the end of the log is read to find the last checkpoint
+TAIL_BYTES = 64 * 1024
+
+
+def macro_digest(data):
+    """Short fingerprint of a macro as saved (the bytes of its file), to notice it was edited between runs.
+
+    Hashing the file as it is, rather than the rows in it, costs no more
+    than reading it, even for a long binary recording.
+    """
+    return hashlib.sha1(data).hexdigest()[:12]
+
+
+def file_digest(path):
+    """macro_digest of the file at path, read in chunks."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+class SoakLog:
+    """Append-only JSON-lines checkpoint log.
+
+    Lines are only ever appended, so a crash can at worst leave one torn
+    line at the end, which last_checkpoint() skips.
+    """
+
+    def __init__(self, path=SOAK_PATH, fsync_interval=FSYNC_INTERVAL):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self._file = open(path, 'a+', encoding='utf-8')
+        self._synced_at = time.monotonic()
+        # A crash mid-append leaves a torn line; start ours on a fresh one
+        if self._file.tell():
+            self._file.seek(self._file.tell() - 1)
+            if self._file.read(1) != '\n':
+                self._file.write('\n')
+
+    def append(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._file.flush()
+        if time.monotonic() - self._synced_at >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+        self._synced_at = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+
+def last_checkpoint(path=SOAK_PATH):
+    """The newest complete checkpoint in the log, or None."""
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - TAIL_BYTES))
+            tail = f.read()
+    except FileNotFoundError:
+        return None
+    for line in reversed(tail.splitlines()):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # Torn last line, or the partial first line of the tail
+            continue
+        if isinstance(record, dict) and 'loop' in record:
+            return record
+    return None
+
+
+class Checkpointer(threading.Thread):
+    """Samples a runner's telemetry every interval seconds and appends a checkpoint.
+
+    Like the GUI it only reads telemetry, so the runner never waits on disk.
+    Nothing accumulates in memory between checkpoints, however long the run.
+    """
+
+    def __init__(self, runner, log, macro, digest=None, interval=CHECKPOINT_INTERVAL):
+        super().__init__(daemon=True)
+        self.runner = runner
+        self.log = log
+        self.macro = macro
+        self.digest = digest
+        self.interval = interval
+        self._done = threading.Event()
+
+    def checkpoint(self, final=False):
+        runner = self.runner
+        telemetry = runner.telemetry
+        playlist = runner.playlist
+        # Read as one value: the entry and its loop count change together
+        entry, entry_loop = telemetry.entry_position
+        record = {
+            'time': time.time(),
+            'macro': playlist.entries[entry][0] if playlist is not None else self.macro,
+            'digest': self.digest,
+            'playlist': [list(pair) for pair in playlist.entries] if playlist is not None else None,
+            'entry': entry,
+            'loop': telemetry.loops,
+            'entry_loop': entry_loop,
+            # Source row of the last input sent
+            'row': telemetry.last_row,
+            'runtime_ns': telemetry.runtime_ns,
+            'dispatches': telemetry.lateness.count,
+            'late_total_ns': telemetry.lateness.total_ns,
+            'late_max_ns': telemetry.lateness.max_ns,
+            'resyncs': telemetry.resyncs,
+            'until_timeouts': telemetry.until_timeouts,
+            'final': final,
+        }
+        self.log.append(record)
+        return record
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            if not self.runner.is_alive():
+                break
+            self.checkpoint()
+
+    def finish(self):
+        """Write a final checkpoint once the runner has ended, and close the log."""
+        self._done.set()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join()
+        self.checkpoint(final=True)
+        self.log.close()
@@ -0,0 +1,195 @@
+from array import array
+
+TYPE_NAMES = ("key", "mouse", "wait", "repeat", "end", "call", "until")
+TYPE_KEY = 0
+TYPE_MOUSE = 1
+TYPE_WAIT = 2
+# Start of a repeated block; value is the count (a number or $variable)
+TYPE_REPEAT = 3
+# End of the innermost open repeat block
+TYPE_END = 4
+# Play another saved macro as a subroutine; value is its name
+TYPE_CALL = 5
+# Wait until a screen region matches a saved reference; value is the
+# reference name, wait is the timeout
+TYPE_UNTIL = 6
+TYPE_INDEX = {name: i for i, name in enumerate(TYPE_NAMES)}
+
+# Columns, in table order
+COL_TYPE = 0
+COL_VALUE = 1
+COL_HOLD = 2
+COL_WAIT = 3
+COLUMN_NAMES = ("Type", "Value", "Hold (s)", "Wait (s)")
+
+# Which columns mean something for each row type
+EDITABLE_COLUMNS = {
+    TYPE_KEY: (COL_TYPE, COL_VALUE, COL_HOLD),
+    TYPE_MOUSE: (COL_TYPE, COL_VALUE, COL_HOLD),
+    TYPE_WAIT: (COL_TYPE, COL_WAIT),
+    TYPE_REPEAT: (COL_TYPE, COL_VALUE),
+    TYPE_END: (COL_TYPE,),
+    TYPE_CALL: (COL_TYPE, COL_VALUE),
+    TYPE_UNTIL: (COL_TYPE, COL_VALUE, COL_WAIT),
+}
+
+DEFAULT_HOLD = 0.1
+DEFAULT_WAIT = 0.1
+
+# Holds, waits and repeat counts written as $name refer to a macro variable
+VARIABLE_PREFIX = "$"
+
+
+def is_variable(value):
+    return isinstance(value, str) and value.startswith(VARIABLE_PREFIX)
+
+
+class ActionStore:
+    """The rows of a macro table, one typed array per column.
+
+    Values are interned: `values` holds an index into `vocab`, so a 50k row
+    recording with a dozen distinct keys stores a dozen strings. A hold or
+    wait given as a $variable keeps its name in `hold_refs`/`wait_refs`
+    (again a vocab index, 0 for none).
+    """
+
+    def __init__(self):
+        self.types = array('b')
+        self.values = array('i')
+        self.holds = array('d')
+        self.waits = array('d')
+        self.hold_refs = array('i')
+        self.wait_refs = array('i')
+        self.vocab = [""]
+        self._vocab_index = {"": 0}
+
+    def __len__(self):
+        return len(self.types)
+
+    def intern(self, value):
+        index = self._vocab_index.get(value)
+        if index is None:
+            index = self._vocab_index[value] = len(self.vocab)
+            self.vocab.append(value)
+        return index
+
+    def _split(self, seconds):
+        """(number, ref) for a hold/wait given as a number or a $variable."""
+        if is_variable(seconds):
+            return 0.0, self.intern(seconds)
+        return float(seconds), 0
+
+    def value(self, row):
+        return self.vocab[self.values[row]]
+
+    def hold(self, row):
+        """The hold as saved: a float, or the $variable name."""
+        ref = self.hold_refs[row]
+        return self.vocab[ref] if ref else self.holds[row]
+
+    def wait(self, row):
+        ref = self.wait_refs[row]
+        return self.vocab[ref] if ref else self.waits[row]
+
+    def set_hold(self, row, seconds):
+        self.holds[row], self.hold_refs[row] = self._split(seconds)
+
+    def set_wait(self, row, seconds):
+        self.waits[row], self.wait_refs[row] = self._split(seconds)
+
+    def insert(self, row, type_, value, hold=DEFAULT_HOLD, wait=DEFAULT_WAIT):
+        hold, hold_ref = self._split(hold)
+        wait, wait_ref = self._split(wait)
+        self.types.insert(row, TYPE_INDEX[type_])
+        self.values.insert(row, self.intern(str(value)))
+        self.holds.insert(row, hold)
+        self.waits.insert(row, wait)
+        self.hold_refs.insert(row, hold_ref)
+        self.wait_refs.insert(row, wait_ref)
+
+    def remove(self, row, count=1):
+        for column in (self.types, self.values, self.holds, self.waits, self.hold_refs, self.wait_refs):
+            del column[row:row + count]
+
+    def set_row(self, row, type_, value, hold=DEFAULT_HOLD, wait=DEFAULT_WAIT):
+        self.types[row] = TYPE_INDEX[type_]
+        self.values[row] = self.intern(str(value))
+        self.set_hold(row, hold)
+        self.set_wait(row, wait)
+
+    def clear(self):
+        for column in (self.types, self.values, self.holds, self.waits, self.hold_refs, self.wait_refs):
+            del column[:]
+
+    def row(self, row):
+        """One row as a saved-format action dict."""
+        return {
+            "type": TYPE_NAMES[self.types[row]],
+            "value": self.value(row),
+            "hold": self.hold(row),
+            "wait": self.wait(row),
+        }
+
+    def row_tuple(self, row):
+        """One row as (type, value, hold, wait), the compact form edits are journalled in."""
+        return (TYPE_NAMES[self.types[row]], self.value(row), self.hold(row), self.wait(row))
+
+    def load(self, actions):
+        """Replace the contents with saved-format action dicts."""
+        self.clear()
+        types, values, holds, waits = self.types, self.values, self.holds, self.waits
+        hold_refs, wait_refs = self.hold_refs, self.wait_refs
+        intern = self.intern
+        split = self._split
+        for action in actions:
+            type_ = TYPE_INDEX.get(action.get('type'), TYPE_KEY)
+            types.append(type_)
+            # Older saves and disabled value cells can carry junk values for waits
+            values.append(0 if type_ == TYPE_WAIT else intern(str(action.get('value', ''))))
+            hold, hold_ref = split(action.get('hold', DEFAULT_HOLD))
+            wait, wait_ref = split(action.get('wait', DEFAULT_WAIT))
+            holds.append(hold)
+            waits.append(wait)
+            hold_refs.append(hold_ref)
+            wait_refs.append(wait_ref)
+
+    def load_columns(self, types, values, holds, waits, hold_refs, wait_refs, strings):
+        """Replace the contents with column sequences, e.g. the views of a binary macro.
+
+        values and the refs index strings; a ref of 0 means none. Each column is
+        copied in one pass, without building a dict per row.
+        """
+        self.clear()
+        mapping = [self.intern(value) for value in strings]
+        self.types.extend(types)
+        self.values.extend(map(mapping.__getitem__, values))
+        self.holds.extend(holds)
+        self.waits.extend(waits)
+        self.hold_refs.extend(map(mapping.__getitem__, hold_refs))
+        self.wait_refs.extend(map(mapping.__getitem__, wait_refs))
+
+    def to_actions(self):
+        """Saved format: one type/value/hold/wait dict per row."""
+        return [self.row(row) for row in range(len(self))]
+
+
+def parse_variables(text):
+    """'tap=0.05, laps=10' -> {'tap': 0.05, 'laps': 10.0}. Raises ValueError naming the bad entry."""
+    variables = {}
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, value = part.partition('=')
+        name = name.strip().lstrip(VARIABLE_PREFIX)
+        if not sep or not name.isidentifier():
+            raise ValueError(f"'{part}' should look like name=number")
+        try:
+            variables[name] = float(value)
+        except ValueError:
+            raise ValueError(f"'{part}': {value.strip()!r} is not a number") from None
+    return variables
+
+
+def format_variables(variables):
+    return ", ".join(f"{name}={value:g}" for name, value in variables.items())
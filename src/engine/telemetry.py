@@ -0,0 +1,110 @@
+from array import array
+
+from engine.timing import Lateness, now_ns
+
+# Per-dispatch lateness samples kept for the UI; must be a power of two
+RING_SIZE = 4096
+
+
+class Telemetry:
+    """Counters the runner thread writes and the UI samples on its own timer.
+
+    There is exactly one writer (the runner). Every field is a plain attribute
+    or array slot store, which the GIL makes atomic, so neither side locks and
+    the runner never waits on the UI. A reader may see a snapshot that is one
+    update stale, which is fine for display.
+    """
+
+    def __init__(self, source_len=0):
+        self.loops = 0
+        # (playlist entry playing, loops of it done), replaced as one tuple so
+        # a reader never pairs one entry with another entry's loop count
+        self.entry_position = (0, 0)
+        self.start_ns = 0
+        self.runtime_ns = 0
+        # Runtime of the run this one resumed, added to runtime_ns
+        self.runtime_base_ns = 0
+        # Time spent paused, left out of runtime_ns
+        self.paused_ns = 0
+        self.last_loop_ns = 0
+        self.lateness = Lateness()
+        self.action_lateness = [Lateness() for _ in range(source_len)]
+        self.resyncs = 0
+        # Playlist entries started after the first
+        self.entries = 0
+        # Until rows that gave up waiting for the screen
+        self.until_timeouts = 0
+        # Ring of the most recent dispatch lateness values and their source rows.
+        # ring_head counts every write ever made; slot is ring_head % RING_SIZE.
+        self.ring_late = array('q', bytes(8 * RING_SIZE))
+        self.ring_rows = array('i', bytes(4 * RING_SIZE))
+        self.ring_head = 0
+        self.stop_latency_ns = None
+        self.first_dispatch_ns = None
+        self.running = False
+
+    def record(self, row, late_ns):
+        """Called by the runner for every dispatch."""
+        if not self.ring_head:
+            self.first_dispatch_ns = now_ns()
+        self.lateness.add(late_ns)
+        self.action_lateness[row].add(late_ns)
+        slot = self.ring_head & (RING_SIZE - 1)
+        self.ring_late[slot] = late_ns
+        self.ring_rows[slot] = row
+        self.ring_head += 1
+
+    def begin_entry(self, entry, source_len):
+        """The runner moved on to playlist entry `entry`; per-action stats start over."""
+        self.entries += 1
+        self.entry_position = (entry, 0)
+        self.action_lateness = [Lateness() for _ in range(source_len)]
+
+    def loop_done(self, loop_start_ns, now):
+        self.last_loop_ns = now - loop_start_ns
+        self.runtime_ns = now - self.start_ns - self.paused_ns + self.runtime_base_ns
+        self.loops += 1
+        entry, entry_loops = self.entry_position
+        self.entry_position = (entry, entry_loops + 1)
+
+    def resume(self, checkpoint):
+        """Carry on the counters of a checkpointed run (see engine.soak)."""
+        self.loops = checkpoint['loop']
+        # The entry is the playlist's own; it moves on when the checkpointed one had finished
+        self.entry_position = (self.entry_position[0], checkpoint.get('entry_loop', 0))
+        self.runtime_ns = self.runtime_base_ns = checkpoint['runtime_ns']
+        self.lateness.count = checkpoint.get('dispatches', 0)
+        self.lateness.total_ns = checkpoint.get('late_total_ns', 0)
+        self.lateness.max_ns = checkpoint.get('late_max_ns', 0)
+        self.resyncs = checkpoint.get('resyncs', 0)
+        self.until_timeouts = checkpoint.get('until_timeouts', 0)
+
+    @property
+    def entry_loops(self):
+        """Loops of the current playlist entry."""
+        return self.entry_position[1]
+
+    @property
+    def last_row(self):
+        """Source row of the most recent dispatch, or None before the first."""
+        if not self.ring_head:
+            return None
+        return self.ring_rows[(self.ring_head - 1) & (RING_SIZE - 1)]
+
+    @property
+    def average_loop_ns(self):
+        return self.runtime_ns / self.loops if self.loops else 0.0
+
+    def recent_lateness(self, since):
+        """(head, [(row, late_ns), ...]) for writes after head position `since`.
+
+        Pass the returned head back in next time. Only the last RING_SIZE
+        writes are still available.
+        """
+        head = self.ring_head
+        start = max(since, head - RING_SIZE)
+        samples = []
+        for i in range(start, head):
+            slot = i & (RING_SIZE - 1)
+            samples.append((self.ring_rows[slot], self.ring_late[slot]))
+        return head, samples
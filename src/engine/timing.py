@@ -0,0 +1,85 @@
+import time
+
+# Monotonic, high-resolution clock every deadline in the engine is measured on
+now_ns = time.perf_counter_ns
+
+# Sleep coarsely until this close to a deadline, then spin for the remainder.
+# OS sleeps routinely overshoot by a millisecond or more; spinning does not.
+SPIN_NS = 2_000_000
+
+# Waits further out than this block on the stop event, which wakes instantly
+# on stop but may overshoot its timeout by a scheduler tick. Closer in, we
+# sleep in short slices so stop is still noticed within about SLICE_NS.
+COARSE_NS = 20_000_000
+SLICE_NS = 1_000_000
+
+# If playback falls further behind than this (machine suspended, debugger
+# attached...) the timeline is rebased instead of firing a burst of catch-up
+# inputs into the game.
+MAX_LATENESS_NS = 250_000_000
+# How often a track waiting on a screen condition looks again
+POLL_INTERVAL_NS = 10_000_000
+
+
+def seconds_to_ns(seconds):
+    return int(round(float(seconds) * 1_000_000_000))
+
+
+def sleep_until(deadline_ns, stop_event=None):
+    """Block until deadline_ns on the now_ns clock and return how late we woke (ns).
+
+    With a stop_event the wait is interruptible: it returns None as soon as
+    the event is set.
+    """
+    if stop_event is None:
+        remaining = deadline_ns - now_ns()
+        if remaining > SPIN_NS:
+            time.sleep((remaining - SPIN_NS) / 1e9)
+        while True:
+            now = now_ns()
+            if now >= deadline_ns:
+                return now - deadline_ns
+
+    is_stopped = stop_event.is_set
+    remaining = deadline_ns - now_ns()
+    if remaining > COARSE_NS + SPIN_NS:
+        if stop_event.wait((remaining - COARSE_NS) / 1e9):
+            return None
+        remaining = deadline_ns - now_ns()
+    while remaining > SPIN_NS:
+        time.sleep(min(remaining - SPIN_NS, SLICE_NS) / 1e9)
+        if is_stopped():
+            return None
+        remaining = deadline_ns - now_ns()
+    while True:
+        if is_stopped():
+            return None
+        now = now_ns()
+        if now >= deadline_ns:
+            return now - deadline_ns
+
+
+class Lateness:
+    """Running lateness statistics for one action (or a whole run)."""
+    __slots__ = ('count', 'total_ns', 'max_ns', 'last_ns')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.last_ns = 0
+
+    def add(self, late_ns):
+        self.count += 1
+        self.total_ns += late_ns
+        self.last_ns = late_ns
+        if late_ns > self.max_ns:
+            self.max_ns = late_ns
+
+    @property
+    def mean_ns(self):
+        return self.total_ns / self.count if self.count else 0.0
+
+    def __repr__(self):
+        return (f"Lateness(count={self.count}, mean={self.mean_ns / 1e6:.3f}ms, "
+                f"max={self.max_ns / 1e6:.3f}ms, last={self.last_ns / 1e6:.3f}ms)")
@@ -0,0 +1,176 @@
+import json
+from array import array
+
+from engine.fileio import atomic_write
+from engine.program import OP_NAMES, OP_UNTIL, OP_WAIT
+
+# Trace events kept; older ones are overwritten. Must be a power of two.
+TRACE_SIZE = 1 << 16
+
+
+class Tracer:
+    """Planned vs actual time of every press, release and wait the runner plays.
+
+    Opt-in: the runner only touches it when one is passed in. Like Telemetry
+    it has a single writer and fixed-size arrays, so tracing a long soak
+    costs no more memory than tracing one loop; only the last `size` events
+    are kept.
+
+    For dispatches, actual is when the backend call returned. For waits it is
+    when the runner reached the wait, once the inputs before it were sent,
+    and dur is the planned length. For until rows it is when the screen
+    matched (or the wait timed out), and dur is how long that took.
+
+    Events refer to inputs by their index into a program's codes. The runner
+    calls begin_programs() whenever it starts on new programs (a playlist
+    entry), so every event can still be named after the run moved on.
+    """
+
+    def __init__(self, size=TRACE_SIZE):
+        if size & (size - 1):
+            raise ValueError("Trace size must be a power of two")
+        self.size = size
+        self.tracks = array('H', bytes(2 * size))
+        self.rows = array('i', bytes(4 * size))
+        self.ops = array('b', bytes(size))
+        self.args = array('i', bytes(4 * size))
+        self.planned = array('q', bytes(8 * size))
+        self.actual = array('q', bytes(8 * size))
+        self.durs = array('q', bytes(8 * size))
+        # Counts every event ever recorded; slot is head % size
+        self.head = 0
+        # (head when they started playing, programs), oldest first
+        self.programs = []
+
+    def record(self, track, row, op, arg, planned_ns, actual_ns, dur_ns=0):
+        slot = self.head & (self.size - 1)
+        self.tracks[slot] = track
+        self.rows[slot] = row
+        self.ops[slot] = op
+        self.args[slot] = arg
+        self.planned[slot] = planned_ns
+        self.actual[slot] = actual_ns
+        self.durs[slot] = dur_ns
+        self.head += 1
+
+    def begin_programs(self, programs):
+        """The runner starts playing programs; the events from here on are theirs."""
+        programs_list = self.programs
+        if programs_list and programs_list[-1][0] == self.head:
+            # Nothing was traced for the ones before
+            programs_list.pop()
+        programs_list.append((self.head, list(programs)))
+        # Forget programs whose events have all been overwritten
+        while len(programs_list) > 1 and programs_list[1][0] <= self.head - self.size:
+            del programs_list[0]
+
+    def clear(self):
+        self.head = 0
+        del self.programs[:]
+
+    def __len__(self):
+        return min(self.head, self.size)
+
+    @property
+    def dropped(self):
+        """Events overwritten because the buffer was full."""
+        return max(0, self.head - self.size)
+
+    def events(self):
+        """(track, row, op, arg, planned_ns, actual_ns, dur_ns) for every kept event, oldest first."""
+        mask = self.size - 1
+        return [
+            (self.tracks[i & mask], self.rows[i & mask], self.ops[i & mask], self.args[i & mask],
+             self.planned[i & mask], self.actual[i & mask], self.durs[i & mask])
+            for i in range(self.head - len(self), self.head)
+        ]
+
+    def summary(self):
+        """Lateness per (track, row): {'track', 'row', 'count', 'p50_ns', 'p99_ns', 'max_ns'}, in row order."""
+        late = {}
+        for track, row, _, _, planned, actual, _ in self.events():
+            late.setdefault((track, row), []).append(actual - planned)
+        result = []
+        for (track, row), values in sorted(late.items()):
+            values.sort()
+            count = len(values)
+            result.append({
+                'track': track,
+                'row': row,
+                'count': count,
+                'p50_ns': values[count // 2],
+                'p99_ns': values[min(count - 1, int(count * 0.99))],
+                'max_ns': values[-1],
+            })
+        return result
+
+    def format_summary(self):
+        lines = [f"{'track':>5} {'row':>5} {'count':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        for entry in self.summary():
+            lines.append(f"{entry['track'] + 1:>5} {entry['row'] + 1:>5} {entry['count']:>7} "
+                         f"{entry['p50_ns'] / 1e6:>9.3f} {entry['p99_ns'] / 1e6:>9.3f} "
+                         f"{entry['max_ns'] / 1e6:>9.3f}")
+        if self.dropped:
+            lines.append(f"({self.dropped} older events were dropped)")
+        return "\n".join(lines)
+
+    def to_chrome(self, programs=None):
+        """The trace as a Chrome / Perfetto trace-event dict, one thread per track.
+
+        Presses and releases are instant events, held inputs and waits are
+        spans. Events name the input they sent, looked up in the programs
+        given or else in those recorded by begin_programs().
+        """
+        events = self.events()
+        if not events:
+            return {"traceEvents": [], "displayTimeUnit": "ms"}
+        origin = min(min(e[4], e[5]) for e in events)
+
+        def us(ns):
+            return (ns - origin) / 1e3
+
+        # Which programs each event belongs to: the last ones begun at or before it
+        spans = [(0, programs)] if programs is not None else self.programs
+        span = 0
+        first = self.head - len(events)
+
+        trace = []
+        # (track, release op, arg) -> the press event that is still held
+        pressed = {}
+        for index, (track, row, op, arg, planned, actual, dur) in enumerate(events, first):
+            while span + 1 < len(spans) and spans[span + 1][0] <= index:
+                span += 1
+            programs = spans[span][1] if spans else None
+            tid = track + 1
+            name = OP_NAMES[op]
+            args = {"row": row + 1, "planned_us": us(planned), "late_us": (actual - planned) / 1e3}
+            if op == OP_WAIT:
+                trace.append({"name": "wait", "ph": "X", "pid": 1, "tid": tid,
+                              "ts": us(actual), "dur": dur / 1e3, "args": args})
+                continue
+            if op == OP_UNTIL:
+                if programs is not None:
+                    args["reference"] = programs[track].codes[arg]
+                trace.append({"name": "until", "ph": "X", "pid": 1, "tid": tid,
+                              "ts": us(planned), "dur": dur / 1e3, "args": args})
+                continue
+            args["input"] = str(programs[track].codes[arg]) if programs is not None else arg
+            trace.append({"name": name, "ph": "i", "s": "t", "pid": 1, "tid": tid,
+                          "ts": us(actual), "args": args})
+            if op & 1:
+                pressed[(track, op + 1, arg)] = (row, actual)
+            else:
+                press = pressed.pop((track, op, arg), None)
+                if press is not None:
+                    press_row, press_actual = press
+                    trace.append({"name": "hold", "ph": "X", "pid": 1, "tid": tid,
+                                  "ts": us(press_actual), "dur": (actual - press_actual) / 1e3,
+                                  "args": {"row": press_row + 1, "input": args["input"]}})
+        for track in sorted({e[0] for e in events}):
+            trace.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": track + 1,
+                          "args": {"name": f"Track {track + 1}"}})
+        return {"traceEvents": trace, "displayTimeUnit": "ms"}
+
+    def save_chrome(self, path, programs=None):
+        """Write to_chrome() to path; open it in chrome://tracing or ui.perfetto.dev."""
+        atomic_write(path, json.dumps(self.to_chrome(programs)))
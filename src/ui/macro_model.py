@@ -0,0 +1,209 @@
+from PySide6.QtCore import QAbstractTableModel, QModelIndex, Qt, Signal
+from PySide6.QtWidgets import QComboBox, QStyledItemDelegate
+
+from engine.store import (
+    COL_HOLD, COL_TYPE, COL_VALUE, COL_WAIT, COLUMN_NAMES, EDITABLE_COLUMNS, TYPE_CALL, TYPE_INDEX, TYPE_KEY,
+    TYPE_MOUSE, TYPE_NAMES, TYPE_REPEAT, TYPE_UNTIL, is_variable,
+)
+
+# What the value of a row becomes when its type is switched to one without options
+DEFAULT_VALUES = {TYPE_REPEAT: "2"}
+
+
+class ActionTableModel(QAbstractTableModel):
+    """Table model over an ActionStore. Cells are plain data; editors come from delegates.
+
+    Every change made through the model is reported by `edited` as the rows
+    it touched: (row, old rows, new rows), rows being ActionStore.row_tuple()s.
+    That is all undo and autosave need, however long the table is.
+    """
+
+    edited = Signal(int, object, object)
+
+    def __init__(self, store, key_options, mouse_options, call_options=list, reference_options=list,
+                 parent=None):
+        super().__init__(parent)
+        self.store = store
+        self.key_options = key_options
+        self.mouse_options = mouse_options
+        # Returns the names of the macros a call row can pick from
+        self.call_options = call_options
+        # Returns the names of the screen references an until row can wait for
+        self.reference_options = reference_options
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.store)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMN_NAMES)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return COLUMN_NAMES[section]
+        return str(section + 1)
+
+    def value_options(self, row):
+        """What the value column of row can be set to."""
+        type_ = self.store.types[row]
+        if type_ == TYPE_KEY:
+            return self.key_options
+        if type_ == TYPE_MOUSE:
+            return self.mouse_options
+        if type_ == TYPE_CALL:
+            return self.call_options()
+        if type_ == TYPE_UNTIL:
+            return self.reference_options()
+        return []
+
+    def value_is_valid(self, row):
+        """Whether the value of row makes sense for its type, e.g. after the type was switched."""
+        value = self.store.value(row)
+        if self.store.types[row] == TYPE_REPEAT:
+            return value.isdigit() or is_variable(value)
+        return value in self.value_options(row)
+
+    def value_is_free_text(self, row):
+        """Repeat counts are typed in (a number or $variable) rather than picked."""
+        return self.store.types[row] == TYPE_REPEAT
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        # key/mouse rows edit value and hold, wait rows edit only the wait, and so on
+        if index.column() in EDITABLE_COLUMNS[self.store.types[index.row()]]:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        store = self.store
+        row = index.row()
+        column = index.column()
+        type_ = store.types[row]
+        if column == COL_TYPE:
+            return TYPE_NAMES[type_]
+        if column not in EDITABLE_COLUMNS[type_] and type_ not in (TYPE_KEY, TYPE_MOUSE):
+            # Nothing to show for e.g. the value of a wait or the hold of a repeat
+            return ""
+        if column == COL_VALUE:
+            return store.value(row)
+        if column == COL_HOLD:
+            return str(store.hold(row))
+        return str(store.wait(row))
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.EditRole:
+            return False
+        store = self.store
+        row = index.row()
+        column = index.column()
+        old = store.row_tuple(row)
+        if column == COL_TYPE:
+            if value not in TYPE_INDEX:
+                return False
+            type_ = TYPE_INDEX[value]
+            if type_ == store.types[row]:
+                # Opening and closing the combo commits the same type again
+                return True
+            store.types[row] = type_
+            if not self.value_is_valid(row):
+                # Switching type resets the value to the first option, like the old combo did
+                options = self.value_options(row)
+                store.values[row] = store.intern(options[0] if options else DEFAULT_VALUES.get(type_, ""))
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(COLUMN_NAMES) - 1))
+            self.edited.emit(row, [old], [store.row_tuple(row)])
+            return True
+        if column == COL_VALUE:
+            store.values[row] = store.intern(str(value).strip())
+        else:
+            value = str(value).strip()
+            if not is_variable(value):
+                try:
+                    value = float(value)
+                except ValueError:
+                    return False
+                if value < 0:
+                    return False
+            if column == COL_HOLD:
+                store.set_hold(row, value)
+            else:
+                store.set_wait(row, value)
+        new = store.row_tuple(row)
+        if new == old:
+            return True
+        self.dataChanged.emit(index, index)
+        self.edited.emit(row, [old], [new])
+        return True
+
+    def splice(self, row, count, rows):
+        """Replace the count rows at row with rows, (type, value, hold, wait) each."""
+        store = self.store
+        old = [store.row_tuple(r) for r in range(row, row + count)]
+        # Rows that are replaced one for one are changed in place
+        overlap = min(count, len(rows))
+        for offset in range(overlap):
+            store.set_row(row + offset, *rows[offset])
+        if overlap:
+            self.dataChanged.emit(self.index(row, 0), self.index(row + overlap - 1, len(COLUMN_NAMES) - 1))
+        if count > overlap:
+            self.beginRemoveRows(QModelIndex(), row + overlap, row + count - 1)
+            store.remove(row + overlap, count - overlap)
+            self.endRemoveRows()
+        elif len(rows) > overlap:
+            self.beginInsertRows(QModelIndex(), row + overlap, row + len(rows) - 1)
+            for offset in range(overlap, len(rows)):
+                store.insert(row + offset, *rows[offset])
+            self.endInsertRows()
+        self.edited.emit(row, old, [tuple(r) for r in rows])
+
+    def insert_row(self, row, type_, value, hold, wait):
+        self.splice(row, 0, [(type_, value, hold, wait)])
+
+    def duplicate_row(self, row):
+        self.splice(row + 1, 0, [self.store.row_tuple(row)])
+
+    def remove_row(self, row):
+        self.splice(row, 1, [])
+
+    def set_store(self, store):
+        """Show a different store, e.g. another track."""
+        self.beginResetModel()
+        self.store = store
+        self.endResetModel()
+
+
+class ComboDelegate(QStyledItemDelegate):
+    """Edits a cell with a combo box that only exists while the cell is being edited.
+
+    options(index) returns the choices for that cell; free_text(index), if
+    given, says whether the cell also accepts typed-in text.
+    """
+
+    def __init__(self, options, free_text=None, parent=None):
+        super().__init__(parent)
+        self.options = options
+        self.free_text = free_text
+
+    def createEditor(self, parent, option, index):
+        combo = QComboBox(parent)
+        combo.setEditable(bool(self.free_text and self.free_text(index)))
+        # Commit as soon as a choice is made rather than on focus loss
+        combo.activated.connect(lambda: self.commitData.emit(combo))
+        return combo
+
+    def setEditorData(self, editor, index):
+        current = index.data(Qt.EditRole)
+        options = list(self.options(index))
+        if current and current not in options:
+            # Loaded or recorded values outside the stock list stay selectable
+            options.append(current)
+        editor.clear()
+        editor.addItems(options)
+        editor.setCurrentText(current)
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentText(), Qt.EditRole)
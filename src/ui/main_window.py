@@ -1,75 +1,69 @@
 import sys
-import os
-import json
-import time
 import threading
+from collections import deque
 from PySide6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
-    QTableWidget, QTableWidgetItem, QLineEdit, QLabel, QMessageBox, QComboBox, QSpinBox,
-    QTabWidget
+    QTableView, QHeaderView, QAbstractItemView, QLineEdit, QLabel, QMessageBox, QComboBox,
+    QSpinBox, QTabWidget, QCheckBox, QFileDialog, QDoubleSpinBox, QListWidget, QListWidgetItem
 )
-from PySide6.QtCore import Qt
-import pyautogui
-import keyboard
+from PySide6.QtCore import Qt, QTimer
+from PySide6.QtGui import QKeySequence, QShortcut
 
-MACROS_DIR = os.path.join(os.path.dirname(__file__), '../../macros')
-os.makedirs(MACROS_DIR, exist_ok=True)
-MAX_MACROS = 5
+from engine.autosave import ROWS, TRACK, UNDO_LIMIT, VARS, Autosaver, recover, rows_to_actions
+from engine.backends import SystemBackend
+from engine.calibration import calibrate, load_profile, save_profile
+from engine.commands import (
+    ARMING, IDLE, PAUSE, PAUSED, PLAYING, PLAYLIST, RESUME, START, STOP, TOGGLE,
+    CommandQueue, load_bindings, save_bindings, transition
+)
+from engine.library import MacroLibrary, body_variables, join_tracks, split_tracks
+from engine.optimizer import SequenceError, optimize
+from engine.playlist import Playlist, compile_macro
+from engine.process import EngineProcess
+from engine.program import OP_UNTIL, compile_sequence, until_references
+from engine.recorder import Recorder
+from engine.runner import MacroRunner
+from engine.soak import Checkpointer, SoakLog, file_digest, macro_digest
+from engine.store import COL_TYPE, COL_VALUE, TYPE_NAMES, ActionStore, format_variables, parse_variables
+from engine.timing import now_ns
+from engine.trace import Tracer
+from ui.macro_model import ActionTableModel, ComboDelegate
 
-class MacroRunner(threading.Thread):
-    def __init__(self, sequence, loop_count, stop_event, update_runtime):
-        super().__init__()
-        self.sequence = sequence
-        self.loop_count = loop_count
-        self.stop_event = stop_event
-        self.update_runtime = update_runtime
-
-    def run(self):
-        start_time = time.time()
-        loop_counter = 0
-        
-        # Handle infinite loops vs fixed count
-        while True:
-            if self.stop_event.is_set():
-                break
-                
-            # Check if we've reached the fixed loop count (if not infinite)
-            if self.loop_count != float('inf') and loop_counter >= self.loop_count:
-                break
-                
-            for action in self.sequence:
-                if self.stop_event.is_set():
-                    break
-                    
-                if action['type'] == 'key':
-                    key = action.get('value', '')
-                    hold_duration = action.get('hold', 0.1)
-                    if key:
-                        keyboard.press(key)
-                        time.sleep(hold_duration)
-                        keyboard.release(key)
-                elif action['type'] == 'mouse':
-                    btn = action.get('value', '')
-                    hold_duration = action.get('hold', 0.1)
-                    if btn:
-                        pyautogui.mouseDown(button=btn)
-                        time.sleep(hold_duration)
-                        pyautogui.mouseUp(button=btn)
-                elif action['type'] == 'wait':
-                    time.sleep(action['value'])
-                    
-            loop_counter += 1
-            self.update_runtime(time.time() - start_time)
+# How often the UI samples runner telemetry
+TELEMETRY_INTERVAL_MS = 100
+# Time to switch to the target window after pressing Start
+COUNTDOWN_S = 3
+# How often the countdown label is refreshed; the start itself is timed by the runner
+COUNTDOWN_INTERVAL_MS = 100
+# How often queued start/stop/pause commands are carried out
+COMMAND_INTERVAL_MS = 20
 
 class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Forza KB/M Macro Automation")
-        self.sequence = []
+        self.sequences = []
         self.runner = None
+        self.backend = None
+        self.latency_profile = None
+        # Screen references for until rows; created on first use since it needs numpy
+        self.screen = None
+        # Writes soak checkpoints while a run with "Checkpoint progress" plays
+        self.checkpointer = None
+        self.library = MacroLibrary()
+        self.recorder = None
         self.stop_event = threading.Event()
-        self.global_hotkey_enabled = False
-        self.hotkey = 'ctrl+alt+m'
+        # Every start, stop and pause, from buttons or hotkeys, goes through here
+        self.commands = CommandQueue()
+        # (hotkey, command, target) for every global hotkey
+        self.bindings = load_bindings()
+        # What keyboard.add_hotkey() returned, while hotkeys are enabled
+        self.hotkey_handles = []
+        # Edits of the macro being edited, newest last, for undo
+        self.undo_stack = deque(maxlen=UNDO_LIMIT)
+        self.undoing = False
+        # Saves the macro being edited in the background as it changes
+        self.autosaver = Autosaver()
         
         # Define options once to avoid duplication
         self.key_options = [
@@ -81,6 +75,8 @@ class MainWindow(QMainWindow):
         self.mouse_options = ["left", "right", "middle"]
         
         self.init_ui()
+        self.restore_autosave()
+        self.autosaver.start()
 
     def init_ui(self):
         scale = 1.62  # Increased by 1.2x (was 1.35)
@@ -101,6 +97,9 @@ class MainWindow(QMainWindow):
         # Create macro tab
         self.create_macro_tab(font)
         
+        # Create playlist tab
+        self.create_playlist_tab(font)
+
         # Create config tab
         self.create_config_tab(font)
 
@@ -110,12 +109,59 @@ class MainWindow(QMainWindow):
         layout = QVBoxLayout()
         macro_widget.setLayout(layout)
 
-        # Macro table setup
-        self.table = QTableWidget()
-        self.table.setColumnCount(4)
-        self.table.setHorizontalHeaderLabels(["Type", "Value", "Hold (s)", "Wait (s)"])
+        # Track controls: every track is its own table, all tracks play in parallel
+        track_controls = QHBoxLayout()
+        track_controls.addWidget(QLabel("Track:", font=font))
+        self.track_combo = QComboBox()
+        self.track_combo.setFont(font)
+        self.track_combo.currentIndexChanged.connect(self.select_track)
+        track_controls.addWidget(self.track_combo)
+
+        add_track_btn = QPushButton("Add Track")
+        add_track_btn.setFont(font)
+        add_track_btn.clicked.connect(self.add_track)
+        track_controls.addWidget(add_track_btn)
+
+        remove_track_btn = QPushButton("Remove Track")
+        remove_track_btn.setFont(font)
+        remove_track_btn.clicked.connect(self.remove_track)
+        track_controls.addWidget(remove_track_btn)
+        track_controls.addStretch()
+        layout.addLayout(track_controls)
+
+        # Variables usable as $name in holds, waits and repeat counts
+        variable_controls = QHBoxLayout()
+        variable_controls.addWidget(QLabel("Variables:", font=font))
+        self.variables_edit = QLineEdit()
+        self.variables_edit.setFont(font)
+        self.variables_edit.setPlaceholderText("e.g. tap=0.05, laps=10  (use as $tap, $laps)")
+        self.variables_edit.editingFinished.connect(self.record_vars_edit)
+        variable_controls.addWidget(self.variables_edit)
+        layout.addLayout(variable_controls)
+        # The text as of the last recorded edit
+        self.variables_text = ""
+
+        # Macro table setup: rows live in a columnar store, combo editors are
+        # created by delegates only for the cell being edited
+        self.store = ActionStore()
+        self.track_stores = [self.store]
+        self.model = ActionTableModel(self.store, self.key_options, self.mouse_options,
+                                      self.library.names, self.reference_names, self)
+        self.model.edited.connect(self.record_rows_edit)
+        self.table = QTableView()
+        self.table.setModel(self.model)
         self.table.setFont(font)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setEditTriggers(QAbstractItemView.AllEditTriggers)
+        # Fixed row heights let the view skip measuring rows it never shows
+        self.table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.type_delegate = ComboDelegate(lambda index: TYPE_NAMES, parent=self)
+        self.value_delegate = ComboDelegate(lambda index: self.model.value_options(index.row()),
+                                            lambda index: self.model.value_is_free_text(index.row()), self)
+        self.table.setItemDelegateForColumn(COL_TYPE, self.type_delegate)
+        self.table.setItemDelegateForColumn(COL_VALUE, self.value_delegate)
         layout.addWidget(self.table)
+        self.refresh_track_combo()
 
         # Table controls
         table_controls = QHBoxLayout()
@@ -133,6 +179,19 @@ class MainWindow(QMainWindow):
         remove_btn.setFont(font)
         remove_btn.clicked.connect(self.remove_selected_row)
         table_controls.addWidget(remove_btn)
+
+        self.record_btn = QPushButton("Record")
+        self.record_btn.setFont(font)
+        self.record_btn.setCheckable(True)
+        self.record_btn.clicked.connect(self.toggle_recording)
+        table_controls.addWidget(self.record_btn)
+
+        self.undo_btn = QPushButton("Undo")
+        self.undo_btn.setFont(font)
+        self.undo_btn.setEnabled(False)
+        self.undo_btn.clicked.connect(self.undo_edit)
+        table_controls.addWidget(self.undo_btn)
+        QShortcut(QKeySequence.Undo, self, self.undo_edit)
         
         layout.addLayout(table_controls)
 
@@ -141,13 +200,19 @@ class MainWindow(QMainWindow):
         
         self.start_btn = QPushButton("Start Macro")
         self.start_btn.setFont(font)
-        self.start_btn.clicked.connect(self.start_macro)
+        self.start_btn.clicked.connect(lambda: self.commands.push(START))
         macro_controls.addWidget(self.start_btn)
 
+        self.pause_btn = QPushButton("Pause")
+        self.pause_btn.setFont(font)
+        self.pause_btn.setEnabled(False)
+        self.pause_btn.clicked.connect(lambda: self.commands.push(PAUSE))
+        macro_controls.addWidget(self.pause_btn)
+
         self.stop_btn = QPushButton("Stop Macro")
         self.stop_btn.setFont(font)
         self.stop_btn.setEnabled(False)
-        self.stop_btn.clicked.connect(self.stop_macro)
+        self.stop_btn.clicked.connect(lambda: self.commands.push(STOP))
         macro_controls.addWidget(self.stop_btn)
 
         # Loop controls with radio buttons
@@ -181,6 +246,26 @@ class MainWindow(QMainWindow):
         loop_controls.addLayout(fixed_loop_layout)
         macro_controls.addLayout(loop_controls)
 
+        # Opt-in per-action tracing of the next run
+        trace_controls = QVBoxLayout()
+        self.trace_check = QCheckBox("Trace actions")
+        self.trace_check.setFont(font)
+        trace_controls.addWidget(self.trace_check)
+        # Checkpoints to the soak log; `app.py play NAME --resume` carries on after a crash
+        self.soak_check = QCheckBox("Checkpoint progress")
+        self.soak_check.setFont(font)
+        trace_controls.addWidget(self.soak_check)
+        # Keeps repaints and garbage collection in this process from delaying inputs
+        self.process_check = QCheckBox("Play in separate process")
+        self.process_check.setFont(font)
+        trace_controls.addWidget(self.process_check)
+        self.export_trace_btn = QPushButton("Export Trace")
+        self.export_trace_btn.setFont(font)
+        self.export_trace_btn.setEnabled(False)
+        self.export_trace_btn.clicked.connect(self.export_trace)
+        trace_controls.addWidget(self.export_trace_btn)
+        macro_controls.addLayout(trace_controls)
+
         layout.addLayout(macro_controls)
 
         # Status labels
@@ -192,8 +277,92 @@ class MainWindow(QMainWindow):
         self.countdown_label.setFont(font)
         layout.addWidget(self.countdown_label)
 
+        # The runner never touches widgets; we sample its telemetry at a fixed rate instead
+        self.telemetry_timer = QTimer(self)
+        self.telemetry_timer.setInterval(TELEMETRY_INTERVAL_MS)
+        self.telemetry_timer.timeout.connect(self.poll_telemetry)
+        self.telemetry_head = 0
+
+        # Only drives the countdown label, on the GUI thread
+        self.countdown_timer = QTimer(self)
+        self.countdown_timer.setInterval(COUNTDOWN_INTERVAL_MS)
+        self.countdown_timer.timeout.connect(self.update_countdown)
+        self.start_at_ns = None
+
+        # The only consumer of the command queue; runs on the GUI thread, so
+        # commands are carried out one at a time and may touch widgets
+        self.command_timer = QTimer(self)
+        self.command_timer.setInterval(COMMAND_INTERVAL_MS)
+        self.command_timer.timeout.connect(self.process_commands)
+        self.command_timer.start()
+
         self.tab_widget.addTab(macro_widget, "Macro")
 
+    def create_playlist_tab(self, font):
+        """Create the tab that plays saved macros back to back."""
+        playlist_widget = QWidget()
+        layout = QVBoxLayout()
+        playlist_widget.setLayout(layout)
+
+        add_controls = QHBoxLayout()
+        add_controls.addWidget(QLabel("Macro:", font=font))
+        self.playlist_macro_combo = QComboBox()
+        self.playlist_macro_combo.setFont(font)
+        add_controls.addWidget(self.playlist_macro_combo)
+        add_controls.addWidget(QLabel("Loops:", font=font))
+        self.playlist_loops_spin = QSpinBox()
+        self.playlist_loops_spin.setFont(font)
+        self.playlist_loops_spin.setRange(1, 1000)
+        add_controls.addWidget(self.playlist_loops_spin)
+        add_entry_btn = QPushButton("Add to Playlist")
+        add_entry_btn.setFont(font)
+        add_entry_btn.clicked.connect(self.add_playlist_entry)
+        add_controls.addWidget(add_entry_btn)
+        layout.addLayout(add_controls)
+
+        self.playlist_list = QListWidget()
+        self.playlist_list.setFont(font)
+        layout.addWidget(self.playlist_list)
+
+        list_controls = QHBoxLayout()
+        remove_entry_btn = QPushButton("Remove")
+        remove_entry_btn.setFont(font)
+        remove_entry_btn.clicked.connect(self.remove_playlist_entry)
+        list_controls.addWidget(remove_entry_btn)
+        clear_btn = QPushButton("Clear")
+        clear_btn.setFont(font)
+        clear_btn.clicked.connect(self.playlist_list.clear)
+        list_controls.addWidget(clear_btn)
+        self.playlist_repeat_check = QCheckBox("Repeat playlist")
+        self.playlist_repeat_check.setFont(font)
+        list_controls.addWidget(self.playlist_repeat_check)
+        layout.addLayout(list_controls)
+
+        play_controls = QHBoxLayout()
+        self.start_playlist_btn = QPushButton("Start Playlist")
+        self.start_playlist_btn.setFont(font)
+        self.start_playlist_btn.clicked.connect(lambda: self.commands.push(START, PLAYLIST))
+        play_controls.addWidget(self.start_playlist_btn)
+        self.playlist_stop_btn = QPushButton("Stop")
+        self.playlist_stop_btn.setFont(font)
+        self.playlist_stop_btn.setEnabled(False)
+        self.playlist_stop_btn.clicked.connect(lambda: self.commands.push(STOP))
+        play_controls.addWidget(self.playlist_stop_btn)
+        layout.addLayout(play_controls)
+
+        self.playlist_status_label = QLabel("")
+        self.playlist_status_label.setFont(font)
+        layout.addWidget(self.playlist_status_label)
+
+        playlist_help = QLabel("Entries play back to back on one timeline; each one is compiled while "
+                               "the one before it plays, so there is no gap or countdown between them.")
+        playlist_help.setFont(font)
+        playlist_help.setStyleSheet("color: gray;")
+        playlist_help.setWordWrap(True)
+        layout.addWidget(playlist_help)
+
+        self.tab_widget.addTab(playlist_widget, "Playlist")
+
     def create_config_tab(self, font):
         """Create the configuration tab with save/load and hotkey settings."""
         config_widget = QWidget()
@@ -210,6 +379,12 @@ class MainWindow(QMainWindow):
         self.macro_name_edit.setFont(font)
         save_load_controls.addWidget(self.macro_name_edit)
 
+        save_load_controls.addWidget(QLabel("Tags:", font=font))
+        self.macro_tags_edit = QLineEdit()
+        self.macro_tags_edit.setFont(font)
+        self.macro_tags_edit.setPlaceholderText("comma separated")
+        save_load_controls.addWidget(self.macro_tags_edit)
+
         save_btn = QPushButton("Save Macro")
         save_btn.setFont(font)
         save_btn.clicked.connect(self.save_macro)
@@ -217,6 +392,16 @@ class MainWindow(QMainWindow):
 
         save_load_group.addLayout(save_load_controls)
 
+        # Search controls
+        search_controls = QHBoxLayout()
+        search_controls.addWidget(QLabel("Search:", font=font))
+        self.macro_search_edit = QLineEdit()
+        self.macro_search_edit.setFont(font)
+        self.macro_search_edit.setPlaceholderText("name or tag")
+        self.macro_search_edit.textChanged.connect(self.refresh_macro_list)
+        search_controls.addWidget(self.macro_search_edit)
+        save_load_group.addLayout(search_controls)
+
         # Load controls
         load_controls = QHBoxLayout()
         load_controls.addWidget(QLabel("Load:", font=font))
@@ -238,30 +423,124 @@ class MainWindow(QMainWindow):
         # Hotkey controls
         hotkey_group = QVBoxLayout()
         hotkey_group.addWidget(QLabel("Global Hotkey Settings", font=font))
-        
+
         hotkey_controls = QHBoxLayout()
         hotkey_controls.addWidget(QLabel("Hotkey:", font=font))
-        
+
         self.hotkey_edit = QLineEdit("ctrl+alt+m")
         self.hotkey_edit.setFont(font)
         hotkey_controls.addWidget(self.hotkey_edit)
-        
-        self.hotkey_toggle_btn = QPushButton("Enable Hotkey")
+
+        self.hotkey_action_combo = QComboBox()
+        self.hotkey_action_combo.setFont(font)
+        hotkey_controls.addWidget(self.hotkey_action_combo)
+
+        add_binding_btn = QPushButton("Bind")
+        add_binding_btn.setFont(font)
+        add_binding_btn.clicked.connect(self.add_binding)
+        hotkey_controls.addWidget(add_binding_btn)
+
+        hotkey_group.addLayout(hotkey_controls)
+
+        self.binding_list = QListWidget()
+        self.binding_list.setFont(font)
+        self.binding_list.setMaximumHeight(100)
+        hotkey_group.addWidget(self.binding_list)
+
+        binding_controls = QHBoxLayout()
+        remove_binding_btn = QPushButton("Remove Binding")
+        remove_binding_btn.setFont(font)
+        remove_binding_btn.clicked.connect(self.remove_binding)
+        binding_controls.addWidget(remove_binding_btn)
+
+        self.hotkey_toggle_btn = QPushButton("Enable Hotkeys")
         self.hotkey_toggle_btn.setFont(font)
         self.hotkey_toggle_btn.setCheckable(True)
         self.hotkey_toggle_btn.clicked.connect(self.toggle_hotkey)
-        hotkey_controls.addWidget(self.hotkey_toggle_btn)
+        binding_controls.addWidget(self.hotkey_toggle_btn)
+
+        hotkey_group.addLayout(binding_controls)
 
-        hotkey_group.addLayout(hotkey_controls)
-        
         # Add hotkey help text
-        help_label = QLabel("Use this hotkey to start/stop macros from anywhere.")
+        help_label = QLabel("Use these hotkeys to start, stop or pause macros from anywhere. "
+                            "A saved macro's hotkey plays it with the loop settings of the Macro tab.")
         help_label.setFont(font)
         help_label.setStyleSheet("color: gray;")
+        help_label.setWordWrap(True)
         hotkey_group.addWidget(help_label)
         
         layout.addLayout(hotkey_group)
 
+        # Add separator
+        layout.addWidget(QLabel(""))
+
+        # Input latency calibration
+        latency_group = QVBoxLayout()
+        latency_group.addWidget(QLabel("Input Latency", font=font))
+
+        latency_controls = QHBoxLayout()
+        self.latency_label = QLabel("Not calibrated")
+        self.latency_label.setFont(font)
+        latency_controls.addWidget(self.latency_label)
+
+        calibrate_btn = QPushButton("Calibrate")
+        calibrate_btn.setFont(font)
+        calibrate_btn.clicked.connect(self.calibrate_latency)
+        latency_controls.addWidget(calibrate_btn)
+
+        latency_group.addLayout(latency_controls)
+
+        latency_help = QLabel("Measures how long each key/mouse call takes so holds and waits can be compensated.")
+        latency_help.setFont(font)
+        latency_help.setStyleSheet("color: gray;")
+        latency_help.setWordWrap(True)
+        latency_group.addWidget(latency_help)
+
+        layout.addLayout(latency_group)
+
+        # Pick up the stored profile from the last calibration
+        self.latency_profile = load_profile(SystemBackend.name)
+        if self.latency_profile:
+            self.latency_label.setText(str(self.latency_profile))
+
+        # Add separator
+        layout.addWidget(QLabel(""))
+
+        # Screen references that until rows wait for
+        reference_group = QVBoxLayout()
+        reference_group.addWidget(QLabel("Screen References", font=font))
+
+        reference_controls = QHBoxLayout()
+        reference_controls.addWidget(QLabel("Name:", font=font))
+        self.reference_name_edit = QLineEdit()
+        self.reference_name_edit.setFont(font)
+        reference_controls.addWidget(self.reference_name_edit)
+        reference_controls.addWidget(QLabel("Region:", font=font))
+        self.reference_region_edit = QLineEdit()
+        self.reference_region_edit.setFont(font)
+        self.reference_region_edit.setPlaceholderText("left, top, width, height")
+        reference_controls.addWidget(self.reference_region_edit)
+        reference_controls.addWidget(QLabel("Tolerance:", font=font))
+        self.reference_tolerance_spin = QDoubleSpinBox()
+        self.reference_tolerance_spin.setFont(font)
+        self.reference_tolerance_spin.setRange(0.0, 255.0)
+        self.reference_tolerance_spin.setValue(8.0)
+        reference_controls.addWidget(self.reference_tolerance_spin)
+        self.capture_btn = QPushButton("Capture")
+        self.capture_btn.setFont(font)
+        self.capture_btn.clicked.connect(self.capture_reference)
+        reference_controls.addWidget(self.capture_btn)
+        reference_group.addLayout(reference_controls)
+
+        reference_help = QLabel(f"Captures the region {COUNTDOWN_S} seconds after pressing Capture. An until row "
+                                "waits for it to match, up to its wait column in seconds.")
+        reference_help.setFont(font)
+        reference_help.setStyleSheet("color: gray;")
+        reference_help.setWordWrap(True)
+        reference_group.addWidget(reference_help)
+
+        layout.addLayout(reference_group)
+
         # Add stretch to push everything to the top
         layout.addStretch()
 
@@ -269,292 +548,727 @@ class MainWindow(QMainWindow):
         
         # Initialize macro list
         self.refresh_macro_list()
+        self.refresh_binding_list()
 
 
 
     def add_action_row(self):
-        row = self.table.rowCount()
-        self.table.insertRow(row)
-        
-        # Type combo box
-        type_combo = QComboBox()
-        type_combo.addItems(["key", "mouse", "wait"])
-        type_combo.currentTextChanged.connect(lambda: self.update_value_combo(row))
-        self.table.setCellWidget(row, 0, type_combo)
-
-        # Value combo box
-        value_combo = QComboBox()
-        value_combo.setEditable(False)
-        self.table.setCellWidget(row, 1, value_combo)
-
-        # Hold time (for key/mouse actions)
-        hold_item = QTableWidgetItem("0.1")
-        self.table.setItem(row, 2, hold_item)
-        
-        # Wait time
-        wait_item = QTableWidgetItem("0.1")
-        self.table.setItem(row, 3, wait_item)
-        
-        # Update value combo options based on initial type
-        self.update_value_combo(row)
+        self.model.insert_row(len(self.store), "key", self.key_options[0], 0.1, 0.1)
 
     def duplicate_action_row(self):
         """Duplicate the currently selected action row."""
-        current_row = self.table.currentRow()
+        current_row = self.table.currentIndex().row()
         if current_row < 0:
             QMessageBox.warning(self, "No Selection", "Please select an action to duplicate.")
             return
-            
-        # Get data from selected row
-        type_widget = self.table.cellWidget(current_row, 0)
-        value_widget = self.table.cellWidget(current_row, 1)
-        hold_item = self.table.item(current_row, 2)
-        wait_item = self.table.item(current_row, 3)
-        
-        if not type_widget:
-            return
-            
-        # Create new row
-        new_row = current_row + 1
-        self.table.insertRow(new_row)
-        
-        # Duplicate type combo
-        new_type_combo = QComboBox()
-        new_type_combo.addItems(["key", "mouse", "wait"])
-        new_type_combo.setCurrentText(type_widget.currentText())
-        new_type_combo.currentTextChanged.connect(lambda: self.update_value_combo(new_row))
-        self.table.setCellWidget(new_row, 0, new_type_combo)
-        
-        # Duplicate value combo
-        new_value_combo = QComboBox()
-        new_value_combo.setEditable(False)
-        self.table.setCellWidget(new_row, 1, new_value_combo)
-        
-        # Update value combo options and set current value
-        self.update_value_combo(new_row)
-        if value_widget and value_widget.isEnabled():
-            new_value_combo.setCurrentText(value_widget.currentText())
-        
-        # Duplicate hold and wait times
-        new_hold_item = QTableWidgetItem(hold_item.text() if hold_item else "0.1")
-        self.table.setItem(new_row, 2, new_hold_item)
-        
-        new_wait_item = QTableWidgetItem(wait_item.text() if wait_item else "0.1")
-        self.table.setItem(new_row, 3, new_wait_item)
-        
+
+        self.model.duplicate_row(current_row)
+
         # Select the new row
-        self.table.selectRow(new_row)
+        self.table.selectRow(current_row + 1)
 
     def remove_selected_row(self):
-        current_row = self.table.currentRow()
+        current_row = self.table.currentIndex().row()
         if current_row >= 0:
-            self.table.removeRow(current_row)
+            self.model.remove_row(current_row)
+
+    def toggle_recording(self):
+        """Record live input and append it to the table as key/mouse rows."""
+        if self.record_btn.isChecked():
+            self.recorder = Recorder()
+            try:
+                self.recorder.start()
+            except Exception as e:
+                QMessageBox.warning(self, "Record Error", str(e))
+                self.record_btn.setChecked(False)
+                self.recorder = None
+                return
+            self.record_btn.setText("Stop Recording")
+            self.start_btn.setEnabled(False)
+            self.start_playlist_btn.setEnabled(False)
+            return
+
+        end_ns = self.recorder.stop()
+        actions = self.recorder.to_actions(end_ns, drop_trailing_click=True)
+        if self.recorder.dropped:
+            QMessageBox.warning(self, "Recording", f"{self.recorder.dropped} events were lost.")
+        self.recorder = None
+        self.record_btn.setText("Record")
+        self.start_btn.setEnabled(True)
+        self.start_playlist_btn.setEnabled(True)
+        if actions:
+            rows = [(a["type"], a["value"], a["hold"], a["wait"]) for a in actions]
+            self.model.splice(len(self.store), 0, rows)
 
-    def update_value_combo(self, row):
-        """Update the value combo box options based on the selected type."""
-        type_widget = self.table.cellWidget(row, 0)
-        value_widget = self.table.cellWidget(row, 1)
-        hold_item = self.table.item(row, 2)
-        wait_item = self.table.item(row, 3)
+    def refresh_track_combo(self, current=0):
+        self.track_combo.blockSignals(True)
+        self.track_combo.clear()
+        self.track_combo.addItems([f"Track {i + 1}" for i in range(len(self.track_stores))])
+        self.track_combo.setCurrentIndex(current)
+        self.track_combo.blockSignals(False)
+        self.select_track(current)
 
-        if not type_widget or not value_widget or not hold_item or not wait_item:
+    def select_track(self, index):
+        if 0 <= index < len(self.track_stores):
+            self.store = self.track_stores[index]
+            self.model.set_store(self.store)
+
+    def add_track(self):
+        self.track_stores.append(ActionStore())
+        self.refresh_track_combo(len(self.track_stores) - 1)
+        self.record_edit((TRACK, len(self.track_stores) - 1, None, None, []))
+
+    def remove_track(self):
+        if len(self.track_stores) == 1:
+            QMessageBox.warning(self, "Last Track", "A macro needs at least one track.")
             return
+        track = self.track_combo.currentIndex()
+        store = self.track_stores.pop(track)
+        self.refresh_track_combo()
+        self.record_edit((TRACK, track, None, self.track_rows(store), None))
 
-        action_type = type_widget.currentText()
-        value_widget.clear()
+    def set_tracks(self, tracks):
+        """Replace every track with saved-format action lists."""
+        self.track_stores = []
+        for actions in tracks:
+            store = ActionStore()
+            store.load(actions)
+            self.track_stores.append(store)
+        self.refresh_track_combo()
 
-        # Default: enable everything
-        value_widget.setEnabled(True)
-        hold_item.setFlags(hold_item.flags() | Qt.ItemIsEditable)
-        wait_item.setFlags(wait_item.flags() | Qt.ItemIsEditable)
+    def set_track_columns(self, macro_file):
+        """Replace every track with the tracks of a binary macro file."""
+        self.track_stores = []
+        for track in range(len(macro_file)):
+            store = ActionStore()
+            store.load_columns(*macro_file.columns(track), macro_file.strings)
+            self.track_stores.append(store)
+        self.refresh_track_combo()
 
-        if action_type == "key" or action_type == "mouse":
-            # Enable value and hold, disable wait
-            if action_type == "key":
-                value_widget.addItems(self.key_options)
-            else:
-                value_widget.addItems(self.mouse_options)
-            value_widget.setEnabled(True)
-            hold_item.setFlags(hold_item.flags() | Qt.ItemIsEditable)
-            wait_item.setFlags(wait_item.flags() & ~Qt.ItemIsEditable)
-        elif action_type == "wait":
-            # Enable wait, disable value and hold
-            value_widget.setEnabled(False)
-            hold_item.setFlags(hold_item.flags() & ~Qt.ItemIsEditable)
-            wait_item.setFlags(wait_item.flags() | Qt.ItemIsEditable)
-
-        # Update the table to reflect changes
-        self.table.setItem(row, 2, hold_item)
-        self.table.setItem(row, 3, wait_item)
-
-    def get_sequence(self):
-        sequence = []
-        for row in range(self.table.rowCount()):
-            type_widget = self.table.cellWidget(row, 0)
-            type_ = type_widget.currentText() if type_widget else "key"
-            
-            value_widget = self.table.cellWidget(row, 1)
-            value = value_widget.currentText() if value_widget and value_widget.isEnabled() else ""
-            
-            hold_item = self.table.item(row, 2)
-            hold = float(hold_item.text()) if hold_item and hold_item.text() else 0.1
-            
-            wait_item = self.table.item(row, 3)
-            wait = float(wait_item.text()) if wait_item and wait_item.text() else 0.1
-            
-            if type_ == "wait":
-                # For wait actions, use the wait value as the delay time
-                sequence.append({"type": "wait", "value": wait})
+    def track_rows(self, store):
+        return [store.row_tuple(row) for row in range(len(store))]
+
+    def record_edit(self, edit):
+        """Hand an edit to autosave and, unless it is an undo, to the undo stack."""
+        self.autosaver.record(edit)
+        if not self.undoing:
+            self.undo_stack.append(edit)
+            self.undo_btn.setEnabled(True)
+
+    def record_rows_edit(self, row, old, new):
+        self.record_edit((ROWS, self.track_stores.index(self.store), row, old, new))
+
+    def record_vars_edit(self):
+        text = self.variables_edit.text()
+        if text != self.variables_text:
+            self.record_edit((VARS, None, None, self.variables_text, text))
+            self.variables_text = text
+
+    def reset_edits(self, name="", saved=True):
+        """The whole macro was replaced: autosave starts over from it and undo history is dropped."""
+        self.undo_stack.clear()
+        self.undo_btn.setEnabled(False)
+        self.variables_text = self.variables_edit.text()
+        self.autosaver.reset(name, [self.track_rows(store) for store in self.track_stores],
+                             self.variables_text, saved)
+
+    def undo_edit(self):
+        if not self.undo_stack:
+            return
+        kind, track, row, old, new = self.undo_stack.pop()
+        self.undoing = True
+        try:
+            if kind == ROWS:
+                if self.track_stores[track] is not self.store:
+                    self.refresh_track_combo(track)
+                # Reported through model.edited like any other change
+                self.model.splice(row, len(new), old)
+                self.table.selectRow(row)
+            elif kind == TRACK:
+                if new is None:
+                    store = ActionStore()
+                    store.load(rows_to_actions(old))
+                    self.track_stores.insert(track, store)
+                    self.refresh_track_combo(track)
+                else:
+                    del self.track_stores[track]
+                    self.refresh_track_combo()
+                self.record_edit((kind, track, row, new, old))
             else:
-                # For key/mouse actions, include hold duration
-                sequence.append({"type": type_, "value": value, "hold": hold})
-                if wait > 0:
-                    sequence.append({"type": "wait", "value": wait})
-        
-        return sequence
+                self.variables_edit.setText(old)
+                self.record_vars_edit()
+        finally:
+            self.undoing = False
+        self.undo_btn.setEnabled(bool(self.undo_stack))
+
+    def restore_autosave(self):
+        """Offer back edits that were never saved, e.g. because the app crashed."""
+        state = recover()
+        if state is not None and not state["saved"] and any(state["tracks"]):
+            name = state["name"]
+            reply = QMessageBox.question(
+                self, "Restore Edits",
+                f"Restore unsaved edits{f' to {name!r}' if name else ''} from the last session?"
+            )
+            if reply == QMessageBox.Yes:
+                self.set_tracks([rows_to_actions(rows) for rows in state["tracks"]])
+                self.variables_edit.setText(state["vars"])
+                self.macro_name_edit.setText(name)
+                self.reset_edits(name, saved=False)
+                return
+        self.reset_edits()
+
+    def get_sequence(self, store=None, variables=None):
+        """Optimized runner sequence and its OptimizeReport for one track's table."""
+        return optimize((store or self.store).to_actions(), variables, self.library.subroutine)
 
     def start_macro(self):
+        self.begin_countdown(self.arm_macro)
+
+    def start_playlist(self):
+        self.begin_countdown(self.arm_playlist)
+
+    def start_saved(self, name):
+        self.begin_countdown(lambda: self.arm_saved(name))
+
+    def playback_state(self):
+        runner = self.runner
+        if runner is not None and runner.is_alive():
+            if runner.start_ns is None:
+                return ARMING
+            return PAUSED if runner.pausing else PLAYING
+        if self.countdown_timer.isActive():
+            return ARMING
+        return IDLE
+
+    def process_commands(self):
+        """Carry out queued commands, in order, on the GUI thread.
+
+        Each is looked up against the state it finds, so a repeated or stale
+        command (start while playing, stop while idle) does nothing.
+        """
+        for command, target in self.commands.drain():
+            action = transition(self.playback_state(), command)
+            if action == START:
+                if target is None:
+                    self.start_macro()
+                elif target == PLAYLIST:
+                    self.start_playlist()
+                else:
+                    self.start_saved(target)
+            elif action == STOP:
+                self.stop_macro()
+            elif action == PAUSE:
+                self.runner.pause()
+                self.pause_btn.setText("Resume")
+            elif action == RESUME:
+                self.runner.resume()
+                self.pause_btn.setText("Pause")
+
+    def set_playing(self, playing):
+        """Enable Start or Stop on both tabs. Stop also cancels a countdown."""
+        self.start_btn.setEnabled(not playing)
+        self.start_playlist_btn.setEnabled(not playing)
+        self.stop_btn.setEnabled(playing)
+        self.playlist_stop_btn.setEnabled(playing)
+        self.pause_btn.setEnabled(playing)
+        self.pause_btn.setText("Pause")
+
+    def begin_countdown(self, arm):
+        """Start the countdown straight away and let arm() get everything ready while it runs."""
+        if self.countdown_timer.isActive() or (self.runner and self.runner.is_alive()):
+            return
+        self.stop_event.clear()
+        self.runner = None
+        self.start_at_ns = now_ns() + COUNTDOWN_S * 1_000_000_000
+        self.export_trace_btn.setEnabled(False)
+        self.set_playing(True)
+        self.update_countdown()
+        self.countdown_timer.start()
+        # Let the label paint before compiling
+        QTimer.singleShot(0, arm)
+
+    def start_runner(self, program, loop_count, backend, playlist=None, macro=None):
+        """Create the runner for the armed start time and start its thread."""
+        # The runner thread waits out the rest of the countdown itself, so the
+        # first input lands on start_at_ns however busy the GUI thread is
+        trace = self.trace_check.isChecked()
+        try:
+            if self.process_check.isChecked():
+                references = until_references(program)
+                if references:
+                    # Checked here so a missing reference is reported before the countdown ends
+                    self.ensure_screen().prepare(references)
+                self.runner = EngineProcess(program, loop_count, backend.name, self.latency_profile,
+                                            start_at_ns=self.start_at_ns, trace=trace,
+                                            playlist=playlist)
+            else:
+                screen = self.ensure_screen() if any(OP_UNTIL in p.ops for p in program) else self.screen
+                self.runner = MacroRunner(program, loop_count, self.stop_event, backend,
+                                          self.latency_profile, start_at_ns=self.start_at_ns,
+                                          tracer=Tracer() if trace else None, screen=screen,
+                                          playlist=playlist)
+        except (ImportError, ValueError) as e:
+            # numpy missing, or an until row names a reference that doesn't exist
+            self.cancel_countdown()
+            QMessageBox.warning(self, "Invalid Macro", str(e))
+            return
+        self.runner.start()
+        if self.soak_check.isChecked():
+            digest = None
+            if playlist is None:
+                # Fingerprint what is playing, so a resume can tell the macro was edited since.
+                # The table counts as what saving it would write.
+                if macro is not None:
+                    digest = file_digest(self.library.body_path(macro))
+                else:
+                    name = self.macro_name_edit.text().strip()
+                    digest = macro_digest(self.library.encode(self.table_body(), self.library.is_binary(name)))
+            macro = macro or self.macro_name_edit.text().strip() or None
+            self.checkpointer = Checkpointer(self.runner, SoakLog(), macro, digest)
+            self.checkpointer.start()
+        self.telemetry_head = 0
+        self.telemetry_timer.start()
+
+    def arm_playlist(self):
+        """Compile the first entry now; the runner's playlist loads the rest in the background."""
+        if self.stop_event.is_set():
+            return
+        entries = [self.playlist_list.item(i).data(Qt.UserRole) for i in range(self.playlist_list.count())]
+        backend = self.ensure_backend()
+        try:
+            backend.warm_up()
+        except ImportError as e:
+            self.cancel_countdown()
+            QMessageBox.warning(self, "Input Unavailable", str(e))
+            return
+        try:
+            playlist = Playlist(entries, self.library, backend, self.playlist_repeat_check.isChecked(),
+                                self.screen)
+            # A separate process compiles the following entries itself
+            program, loop_count = playlist.first(preload=not self.process_check.isChecked())
+        except ValueError as e:
+            self.cancel_countdown()
+            QMessageBox.warning(self, "Invalid Playlist", str(e))
+            return
+        self.start_runner(program, loop_count, backend, playlist)
+
+    def arm_macro(self):
+        """Validate, compile and warm up the backend, then hand the runner the start time."""
+        if self.stop_event.is_set():
+            return
         # Always use current table actions, not saved/loaded macros
-        self.sequence = self.get_sequence()
-        if not self.sequence:
+        try:
+            variables = parse_variables(self.variables_edit.text())
+        except ValueError as e:
+            self.cancel_countdown()
+            QMessageBox.warning(self, "Invalid Variables", str(e))
+            return
+        optimized = []
+        for track, store in enumerate(self.track_stores):
+            try:
+                optimized.append(self.get_sequence(store, variables))
+            except SequenceError as e:
+                self.cancel_countdown()
+                QMessageBox.warning(self, "Invalid Macro", f"Track {track + 1}, {e}")
+                return
+        self.sequences = [sequence for sequence, _ in optimized]
+        if not any(self.sequences):
+            self.cancel_countdown()
             QMessageBox.warning(self, "No Actions", "Add actions to the macro before starting.")
             return
-        
-        self.stop_event.clear()
-        
-        # Determine loop count based on radio button selection
-        if self.loop_until_stop.isChecked():
-            loop_count = float('inf')  # Infinite loops until stopped
-        else:
-            loop_count = self.loop_spin.value()
+        backend = self.ensure_backend()
+        try:
+            backend.warm_up()
+        except ImportError as e:
+            self.cancel_countdown()
+            QMessageBox.warning(self, "Input Unavailable", str(e))
+            return
+        try:
+            program = [compile_sequence(sequence, backend) for sequence in self.sequences]
+        except ValueError as e:
+            self.cancel_countdown()
+            QMessageBox.warning(self, "Invalid Macro", str(e))
+            return
+        self.runtime_label.setText("Optimized: " + "; ".join(str(report) for _, report in optimized))
 
-        self.start_btn.setEnabled(False)
-        self.stop_btn.setEnabled(False)
+        self.start_runner(program, self.loop_count(), backend)
+
+    def arm_saved(self, name):
+        """Like arm_macro, for a saved macro started by its hotkey."""
+        if self.stop_event.is_set():
+            return
+        backend = self.ensure_backend()
+        try:
+            backend.warm_up()
+        except ImportError as e:
+            self.cancel_countdown()
+            QMessageBox.warning(self, "Input Unavailable", str(e))
+            return
+        try:
+            program = compile_macro(self.library, name, backend)
+        except (KeyError, FileNotFoundError):
+            self.cancel_countdown()
+            QMessageBox.warning(self, "Not Found", f"Macro '{name}' not found.")
+            return
+        except ValueError as e:
+            self.cancel_countdown()
+            QMessageBox.warning(self, "Invalid Macro", str(e))
+            return
+        self.runtime_label.setText(f"Playing saved macro '{name}'")
+        self.start_runner(program, self.loop_count(), backend, macro=name)
+
+    def table_body(self, variables=None):
+        """The tracks in the table as a saved macro body, like Save writes it."""
+        if variables is None:
+            variables = parse_variables(self.variables_edit.text())
+        return join_tracks([store.to_actions() for store in self.track_stores], variables)
 
-        self.countdown_label.setText("Switch to your target window! Macro will start in 3 seconds...")
-        QApplication.processEvents()
+    def loop_count(self):
+        """Loops to play, from the radio buttons of the Macro tab."""
+        if self.loop_until_stop.isChecked():
+            return float('inf')  # Infinite loops until stopped
+        return self.loop_spin.value()
 
-        def do_countdown():
-            for i in range(3, 0, -1):
-                self.countdown_label.setText(f"Switch to your target window! Macro will start in {i} seconds...")
-                QApplication.processEvents()
-                time.sleep(1)
+    def update_countdown(self):
+        remaining = self.start_at_ns - now_ns()
+        if remaining <= 0:
+            self.countdown_timer.stop()
             self.countdown_label.setText("")
-            QApplication.processEvents()
-            self.runner = MacroRunner(self.sequence, loop_count, self.stop_event, self.update_runtime)
-            self.runner.start()
-            self.start_btn.setEnabled(False)
-            self.stop_btn.setEnabled(True)
+            return
+        seconds = -(-remaining // 1_000_000_000)
+        self.countdown_label.setText(f"Switch to your target window! Macro will start in {seconds} seconds...")
+
+    def cancel_countdown(self):
+        self.countdown_timer.stop()
+        self.countdown_label.setText("")
+        self.set_playing(False)
+
+    def ensure_backend(self):
+        """Create the input backend on first use."""
+        if self.backend is None:
+            self.backend = SystemBackend()
+        return self.backend
+
+    def ensure_screen(self):
+        """Create the screen matcher on first use; raises ImportError without numpy."""
+        if self.screen is None:
+            from engine.screen import ScreenMatcher
+            self.screen = ScreenMatcher()
+        return self.screen
 
-        threading.Thread(target=do_countdown, daemon=True).start()
+    def reference_names(self):
+        try:
+            return self.ensure_screen().store.names()
+        except ImportError:
+            return []
+
+    def capture_reference(self):
+        name = self.reference_name_edit.text().strip()
+        if not name or name.startswith('.') or any(c in name for c in '\\/:*?"<>|'):
+            QMessageBox.warning(self, "Invalid Name", "Reference names can't be empty, start with '.' or contain \\ / : * ? \" < > |")
+            return
+        try:
+            region = [int(v) for v in self.reference_region_edit.text().split(',')]
+        except ValueError:
+            region = []
+        if len(region) != 4 or region[2] <= 0 or region[3] <= 0:
+            QMessageBox.warning(self, "Invalid Region", "Enter the region as left, top, width, height in pixels.")
+            return
+        try:
+            screen = self.ensure_screen()
+        except ImportError as e:
+            QMessageBox.warning(self, "Screen Capture Unavailable", str(e))
+            return
+        tolerance = self.reference_tolerance_spin.value()
+        self.capture_btn.setEnabled(False)
+
+        def capture():
+            self.capture_btn.setEnabled(True)
+            try:
+                screen.store.capture(name, region, tolerance=tolerance)
+            except Exception as e:
+                QMessageBox.warning(self, "Capture Failed", str(e))
+                return
+            QMessageBox.information(self, "Captured", f"Saved screen reference {name!r}.")
+
+        # Time to bring the game window to the front
+        QTimer.singleShot(COUNTDOWN_S * 1000, capture)
+
+    def calibrate_latency(self):
+        reply = QMessageBox.question(
+            self, "Calibrate",
+            "Calibration taps Shift and middle-clicks at the current mouse position a few dozen times. Continue?"
+        )
+        if reply != QMessageBox.Yes:
+            return
+        backend = self.ensure_backend()
+        try:
+            self.latency_profile = calibrate(backend)
+        except ImportError as e:
+            QMessageBox.warning(self, "Input Unavailable", str(e))
+            return
+        save_profile(self.latency_profile)
+        self.latency_label.setText(str(self.latency_profile))
 
     def stop_macro(self):
         self.stop_event.set()
-        self.start_btn.setEnabled(True)
-        self.stop_btn.setEnabled(False)
+        if self.runner:
+            # Interrupts the countdown, any hold or wait, and releases whatever is held
+            self.runner.stop()
+        self.cancel_countdown()
+
+    def closeEvent(self, event):
+        # Never leave a key or button pressed behind us
+        if self.runner and self.runner.is_alive():
+            self.runner.stop()
+            self.runner.join(timeout=1.0)
+        self.finish_checkpoints()
+        self.record_vars_edit()
+        self.autosaver.close()
+        super().closeEvent(event)
+
+    def finish_checkpoints(self):
+        if self.checkpointer is not None:
+            self.checkpointer.finish()
+            self.checkpointer = None
+
+    def poll_telemetry(self):
+        """Runs on the GUI thread every TELEMETRY_INTERVAL_MS while a macro is active."""
+        runner = self.runner
+        if runner is None:
+            return
+        if runner.start_ns is None and runner.is_alive():
+            # Still counting down
+            return
+        telemetry = runner.telemetry
+        self.telemetry_head, samples = telemetry.recent_lateness(self.telemetry_head)
+
+        text = f"Loop Runtime: {telemetry.runtime_ns / 1e9:.2f}s | Loops: {telemetry.loops}"
+        if telemetry.loops:
+            text += (f" | Last: {telemetry.last_loop_ns / 1e9:.3f}s"
+                     f" | Avg: {telemetry.average_loop_ns / 1e9:.3f}s")
+        if samples:
+            worst = max(late for _, late in samples)
+            text += f" | Late: {worst / 1e6:.2f}ms"
+        if runner.pausing:
+            text += " | Paused"
+        playlist = runner.playlist
+        if playlist is not None:
+            status = f"Entry {playlist.current + 1}/{len(playlist.entries)}: {playlist.current_name}"
+            if playlist.error is not None:
+                status += f" | Stopped early: {playlist.error}"
+            self.playlist_status_label.setText(status)
 
-    def update_runtime(self, runtime):
-        self.runtime_label.setText(f"Loop Runtime: {runtime:.2f}s")
+        if not runner.is_alive():
+            # Finished its loops or was stopped
+            self.telemetry_timer.stop()
+            self.finish_checkpoints()
+            if telemetry.stop_latency_ns is not None:
+                text += f" | Stopped in {telemetry.stop_latency_ns / 1e6:.1f}ms"
+            if isinstance(runner, EngineProcess) and runner.error is not None:
+                text += f" | Engine failed: {runner.error}"
+            self.set_playing(False)
+            self.export_trace_btn.setEnabled(runner.tracer is not None and len(runner.tracer) > 0)
+        self.runtime_label.setText(text)
+
+    def export_trace(self):
+        runner = self.runner
+        if runner is None or runner.tracer is None:
+            return
+        path, _ = QFileDialog.getSaveFileName(self, "Export Trace", "trace.json", "Trace (*.json)")
+        if not path:
+            return
+        try:
+            # Named from the programs the tracer recorded, entry by entry for a playlist
+            runner.tracer.save_chrome(path)
+        except OSError as e:
+            QMessageBox.warning(self, "Export Failed", str(e))
+            return
+        box = QMessageBox(self)
+        box.setWindowTitle("Trace Exported")
+        box.setText(f"Saved to {path}. Open it in chrome://tracing or ui.perfetto.dev.\n"
+                    "Details show p50/p99/max lateness per row.")
+        box.setDetailedText(runner.tracer.format_summary())
+        box.exec()
 
     def save_macro(self):
         name = self.macro_name_edit.text().strip()
         if not name:
             QMessageBox.warning(self, "Name Required", "Enter a name for the macro.")
             return
-        macro_files = [f for f in os.listdir(MACROS_DIR) if f.endswith('.json')]
-        if len(macro_files) >= MAX_MACROS and name + '.json' not in macro_files:
-            QMessageBox.warning(self, "Limit Reached", f"Maximum {MAX_MACROS} macros allowed.")
-            return
-        # Save table format: type, value, hold, wait
-        actions = []
-        for row in range(self.table.rowCount()):
-            type_widget = self.table.cellWidget(row, 0)
-            type_ = type_widget.currentText() if type_widget else "key"
-            value_widget = self.table.cellWidget(row, 1)
-            value = value_widget.currentText() if value_widget and value_widget.isEnabled() else ""
-            hold_item = self.table.item(row, 2)
-            hold = float(hold_item.text()) if hold_item and hold_item.text() else 0.1
-            wait_item = self.table.item(row, 3)
-            wait = float(wait_item.text()) if wait_item and wait_item.text() else 0.1
-            actions.append({"type": type_, "value": value, "hold": hold, "wait": wait})
-        path = os.path.join(MACROS_DIR, name + '.json')
-        with open(path, 'w') as f:
-            json.dump(actions, f, indent=2)
+        if name.startswith('.') or any(c in name for c in '\\/:*?"<>|'):
+            QMessageBox.warning(self, "Invalid Name", "Macro names can't start with '.' or contain \\ / : * ? \" < > |")
+            return
+        tags = [t.strip() for t in self.macro_tags_edit.text().split(',') if t.strip()]
+        # Save table format: type, value, hold, wait (per track)
+        try:
+            variables = parse_variables(self.variables_edit.text())
+        except ValueError as e:
+            QMessageBox.warning(self, "Invalid Variables", str(e))
+            return
+        self.library.save(name, self.table_body(variables), tags)
+        self.record_vars_edit()
+        self.autosaver.mark_saved(name)
         self.refresh_macro_list()
+        self.refresh_binding_list()
         QMessageBox.information(self, "Saved", f"Macro '{name}' saved.")
 
+    def add_playlist_entry(self):
+        name = self.playlist_macro_combo.currentText()
+        if not name:
+            return
+        loops = self.playlist_loops_spin.value()
+        item = QListWidgetItem(f"{name}  x{loops}")
+        item.setData(Qt.UserRole, (name, loops))
+        self.playlist_list.addItem(item)
+
+    def remove_playlist_entry(self):
+        row = self.playlist_list.currentRow()
+        if row >= 0:
+            self.playlist_list.takeItem(row)
+
     def refresh_macro_list(self):
+        """List macros matching the search box. Reads only the library index."""
+        self.playlist_macro_combo.clear()
+        self.playlist_macro_combo.addItems(self.library.names())
         self.load_combo.clear()
-        macro_files = [f for f in os.listdir(MACROS_DIR) if f.endswith('.json')]
-        for f in macro_files:
-            self.load_combo.addItem(f[:-5])
+        for entry in self.library.search(self.macro_search_edit.text()):
+            label = f"{entry['name']}  ({entry['actions']} actions, {entry['duration']:.1f}s)"
+            if entry['tracks'] > 1:
+                label = label[:-1] + f", {entry['tracks']} tracks)"
+            self.load_combo.addItem(label, entry['name'])
 
     def load_macro(self):
-        name = self.load_combo.currentText()
+        name = self.load_combo.currentData()
         if not name:
             QMessageBox.warning(self, "Select Macro", "Choose a macro to load.")
             return
-        path = os.path.join(MACROS_DIR, name + '.json')
-        if not os.path.exists(path):
+        try:
+            macro_file = self.library.mapped(name)
+            if macro_file is None:
+                body = self.library.load(name)
+        except (KeyError, FileNotFoundError):
             QMessageBox.warning(self, "Not Found", f"Macro '{name}' not found.")
             return
-        with open(path, 'r') as f:
-            actions = json.load(f)
-        self.table.setRowCount(0)
-        for action in actions:
-            row = self.table.rowCount()
-            self.table.insertRow(row)
-            type_combo = QComboBox()
-            type_combo.addItems(["key", "mouse", "wait"])
-            type_combo.setCurrentText(action['type'])
-            type_combo.currentTextChanged.connect(lambda: self.update_value_combo(row))
-            self.table.setCellWidget(row, 0, type_combo)
-            value_combo = QComboBox()
-            value_combo.setEditable(False)
-            if action['type'] == 'key':
-                value_combo.addItems(self.key_options)
-                value_combo.setCurrentText(action['value'])
-                value_combo.setEnabled(True)
-            elif action['type'] == 'mouse':
-                value_combo.addItems(self.mouse_options)
-                value_combo.setCurrentText(action['value'])
-                value_combo.setEnabled(True)
-            else:
-                value_combo.setEnabled(False)
-            self.table.setCellWidget(row, 1, value_combo)
-            
-            # Handle hold column (backward compatibility for old saves)
-            hold_item = QTableWidgetItem(str(action.get('hold', 0.1)))
-            self.table.setItem(row, 2, hold_item)
-            
-            # Handle wait column (backward compatibility for old saves)
-            wait_item = QTableWidgetItem(str(action.get('wait', 0.1)))
-            self.table.setItem(row, 3, wait_item)
+        if macro_file is not None:
+            # Long binary recordings are copied column by column, with no dict per row
+            with macro_file:
+                self.set_track_columns(macro_file)
+            self.variables_edit.setText(format_variables(macro_file.variables))
+        else:
+            self.set_tracks(split_tracks(body))
+            self.variables_edit.setText(format_variables(body_variables(body)))
+        self.macro_name_edit.setText(name)
+        self.macro_tags_edit.setText(", ".join(self.library.get(name)['tags']))
+        self.reset_edits(name)
 
     def toggle_hotkey(self):
         if self.hotkey_toggle_btn.isChecked():
-            self.hotkey = self.hotkey_edit.text().strip()
-            if not self.hotkey:
-                QMessageBox.warning(self, "Hotkey Required", "Enter a hotkey.")
-                self.hotkey_toggle_btn.setChecked(False)
-                return
             try:
-                keyboard.add_hotkey(self.hotkey, self.hotkey_action)
-                self.global_hotkey_enabled = True
-                self.hotkey_toggle_btn.setText("Disable Hotkey")
+                self.register_hotkeys()
             except Exception as e:
+                self.unregister_hotkeys()
                 QMessageBox.warning(self, "Hotkey Error", str(e))
                 self.hotkey_toggle_btn.setChecked(False)
+                return
+            self.hotkey_toggle_btn.setText("Disable Hotkeys")
         else:
-            keyboard.remove_hotkey(self.hotkey)
-            self.global_hotkey_enabled = False
-            self.hotkey_toggle_btn.setText("Enable Hotkey")
+            self.unregister_hotkeys()
+            self.hotkey_toggle_btn.setText("Enable Hotkeys")
 
-    def hotkey_action(self):
-        if self.runner and self.runner.is_alive():
-            self.stop_macro()
+    def register_hotkeys(self):
+        # Imported here so opening the window doesn't pay for the keyboard hook
+        import keyboard
+        self.unregister_hotkeys()
+        for hotkey, command, target in self.bindings:
+            # The hook thread only queues the command (a stop, or a toggle while
+            # playing, also stops at once); process_commands does the rest
+            callback = self.hotkey_stop if command in (STOP, TOGGLE) else self.commands.push
+            self.hotkey_handles.append(keyboard.add_hotkey(hotkey, callback, args=(command, target)))
+
+    def hotkey_stop(self, command, target):
+        """Runs on the keyboard hook thread. Stops playback straight away, even if the GUI is busy.
+
+        A toggle only stops a run that is active. It is then queued as the
+        stop it was, so process_commands doesn't take it for a start once
+        the run has ended.
+
+        This is the one place a hotkey does more than push to the
+        CommandQueue. runner.stop() only sets events under a lock, so the
+        hook callback still returns at once.
+        """
+        runner = self.runner
+        if command == TOGGLE and (runner is None or not runner.is_alive()):
+            self.commands.push(command, target)
+            return
+        if runner is not None:
+            runner.stop()
+        self.commands.push(command, target, STOP)
+
+    def unregister_hotkeys(self):
+        if not self.hotkey_handles:
+            return
+        import keyboard
+        for handle in self.hotkey_handles:
+            keyboard.remove_hotkey(handle)
+        self.hotkey_handles = []
+
+    def binding_label(self, command, target):
+        if target == PLAYLIST:
+            what = "the playlist"
+        elif target is not None:
+            what = f"'{target}'"
         else:
-            self.start_macro()
+            what = "this macro"
+        if command == TOGGLE:
+            return f"Start/stop {what}"
+        if command == START:
+            return f"Start {what}"
+        if command == PAUSE:
+            return "Pause/resume"
+        return "Stop"
+
+    def refresh_binding_list(self):
+        """List the bindings and offer every command for the next one."""
+        self.binding_list.clear()
+        for hotkey, command, target in self.bindings:
+            self.binding_list.addItem(f"{hotkey}: {self.binding_label(command, target)}")
+        self.hotkey_action_combo.clear()
+        for command, target in [(TOGGLE, None), (PAUSE, None), (STOP, None), (TOGGLE, PLAYLIST)]:
+            self.hotkey_action_combo.addItem(self.binding_label(command, target), (command, target))
+        for name in self.library.names():
+            self.hotkey_action_combo.addItem(self.binding_label(TOGGLE, name), (TOGGLE, name))
+
+    def set_bindings(self, bindings):
+        previous = self.bindings
+        self.bindings = bindings
+        if self.hotkey_handles:
+            try:
+                self.register_hotkeys()
+            except Exception as e:
+                QMessageBox.warning(self, "Hotkey Error", str(e))
+                self.bindings = previous
+                self.register_hotkeys()
+                return
+        save_bindings(self.bindings)
+        self.refresh_binding_list()
+
+    def add_binding(self):
+        hotkey = self.hotkey_edit.text().strip()
+        if not hotkey:
+            QMessageBox.warning(self, "Hotkey Required", "Enter a hotkey.")
+            return
+        command, target = self.hotkey_action_combo.currentData()
+        # One command per hotkey; binding it again replaces the old one
+        bindings = [b for b in self.bindings if b[0] != hotkey]
+        bindings.append((hotkey, command, target))
+        self.set_bindings(bindings)
+
+    def remove_binding(self):
+        row = self.binding_list.currentRow()
+        if row >= 0:
+            self.set_bindings(self.bindings[:row] + self.bindings[row + 1:])
 
 
 def main():
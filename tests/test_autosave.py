@@ -0,0 +1,119 @@
+import json
+import os
+
+from engine import autosave
+from engine.autosave import ROWS, TRACK, VARS, Autosaver, apply_edit, recover
+
+A = ("key", "a", 0.1, 0.1)
+B = ("key", "b", 0.1, 0.1)
+CLICK = ("mouse", "left", 0.05, 0.1)
+
+
+def as_lists(rows):
+    """Rows the way they come back from JSON."""
+    return [list(r) for r in rows]
+
+
+def make_saver(tmp_path):
+    """An Autosaver driven by hand: _write() is what its thread runs after each quiet spell."""
+    saver = Autosaver(str(tmp_path / "autosave.json"))
+    saver.reset("lap", [[A]], "tap=0.05")
+    saver._write()
+    return saver
+
+
+def test_edits_are_journalled_and_recovered(tmp_path):
+    saver = make_saver(tmp_path)
+    saver.record((ROWS, 0, 1, [], [B]))
+    saver._write()
+    saver.record((ROWS, 0, 0, [A], [CLICK]))
+    saver.record((VARS, None, None, "tap=0.05", "tap=0.08"))
+    saver._write()
+    saver.close()
+    with open(saver.journal_path) as f:
+        assert len(f.read().splitlines()) == 3
+
+    state = recover(saver.path)
+    assert state["name"] == "lap"
+    assert state["saved"] is False
+    assert state["tracks"] == [as_lists([CLICK, B])]
+    assert state["vars"] == "tap=0.08"
+
+
+def test_a_torn_last_line_is_skipped(tmp_path):
+    saver = make_saver(tmp_path)
+    saver.record((ROWS, 0, 1, [], [B]))
+    saver._write()
+    saver.record((ROWS, 0, 0, [A], [CLICK]))
+    saver._write()
+    saver.close()
+    # A crash part way through writing the second edit
+    size = os.path.getsize(saver.journal_path)
+    with open(saver.journal_path, "r+b") as f:
+        f.truncate(size - 10)
+
+    state = recover(saver.path)
+    assert state["tracks"] == [as_lists([A, B])]
+    assert state["saved"] is False
+
+
+def test_marking_saved_is_recovered(tmp_path):
+    saver = make_saver(tmp_path)
+    saver.record((ROWS, 0, 1, [], [B]))
+    saver.mark_saved("lap 2")
+    saver._write()
+    saver.close()
+    state = recover(saver.path)
+    assert (state["name"], state["saved"]) == ("lap 2", True)
+    assert state["tracks"] == [as_lists([A, B])]
+
+
+def test_a_long_journal_is_compacted_into_the_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(autosave, "COMPACT_MIN", 4)
+    saver = make_saver(tmp_path)
+    # Retyping the one row back and forth: more edits than rows, never more rows
+    flips = [(ROWS, 0, 0, [A], [B]), (ROWS, 0, 0, [B], [A])]
+    for edit in flips + flips[:1]:
+        saver.record(edit)
+    saver._write()
+    assert os.path.getsize(saver.journal_path) > 0
+    for edit in flips[1:] + flips:
+        saver.record(edit)
+    saver._write()
+    saver.close()
+    # Folded into a new snapshot, with the journal started over
+    assert os.path.getsize(saver.journal_path) == 0
+    with open(saver.path) as f:
+        assert json.load(f)["tracks"] == [as_lists([A])]
+    assert recover(saver.path)["tracks"] == [as_lists([A])]
+
+
+def test_journal_lines_from_before_the_snapshot_are_not_replayed(tmp_path):
+    saver = make_saver(tmp_path)
+    saver.record((ROWS, 0, 1, [], [B]))
+    saver._write()
+    with open(saver.journal_path) as f:
+        stale = f.read()
+    saver.reset("other", [[CLICK]], "")
+    saver._write()
+    saver.close()
+    # As if a crash came between writing the new snapshot and truncating the journal
+    with open(saver.journal_path, "w") as f:
+        f.write(stale)
+    assert recover(saver.path)["tracks"] == [as_lists([CLICK])]
+
+
+def test_undoing_edits_restores_the_state():
+    state = {"tracks": [[A, B]], "vars": "tap=0.05"}
+    edits = [
+        (ROWS, 0, 1, [B], [CLICK, CLICK]),
+        (ROWS, 0, 0, [A], []),
+        (TRACK, 1, None, None, [A]),
+        (VARS, None, None, "tap=0.05", ""),
+    ]
+    for edit in edits:
+        apply_edit(state, edit)
+    assert state == {"tracks": [[CLICK, CLICK], [A]], "vars": ""}
+    for edit in reversed(edits):
+        apply_edit(state, edit, undo=True)
+    assert state == {"tracks": [[A, B]], "vars": "tap=0.05"}
@@ -0,0 +1,58 @@
+import threading
+
+from engine.bench import SinkBackend, chord_tracks, run_program
+from engine.calibration import LatencyProfile
+from engine.program import compile_sequence
+from engine.runner import MacroRunner
+
+
+class CountingBackend(SinkBackend):
+    """A sink that remembers how many inputs each call carried."""
+
+    def __init__(self, call_ns=0, bulk=True):
+        super().__init__(call_ns, bulk)
+        self.calls = []
+
+    def _record(self, op, code):
+        self.calls.append(1)
+        super()._record(op, code)
+
+    def send_batch(self, ops, codes):
+        self.calls.append(len(ops))
+        super().send_batch(ops, codes)
+
+
+def skews(backend, chord):
+    """Spread on arrival of each chunk of chord events, which all fall due together."""
+    times = backend.times
+    return [max(times[i:i + chord]) - min(times[i:i + chord]) for i in range(0, len(backend), chord)]
+
+
+def test_a_chord_goes_out_in_one_call():
+    backend = CountingBackend()
+    run_program(chord_tracks(3, 0.002, backend, actions=20), 1, backend)
+    # Each release goes out with the next press, as one call for all three tracks
+    assert backend.calls == [3] + [6] * 19 + [3]
+
+
+def test_inputs_with_different_leads_still_batch():
+    backend = CountingBackend()
+    tap = lambda type_, value: [{"type": type_, "value": value, "hold": 0.002, "wait": 0.002}] * 20
+    programs = [compile_sequence(tap("key", "a"), backend), compile_sequence(tap("mouse", "left"), backend)]
+    profile = LatencyProfile("sink", {"key_down": 300_000, "key_up": 300_000,
+                                      "mouse_down": 50_000, "mouse_up": 50_000})
+    MacroRunner(programs, 1, threading.Event(), backend, profile=profile).run()
+    assert backend.calls == [2] + [4] * 19 + [2]
+
+
+def test_batched_chords_land_closer_together_than_one_call_per_input():
+    chord = 4
+    call_ns = 50_000
+    batched = CountingBackend(call_ns, bulk=True)
+    run_program(chord_tracks(chord, 0.002, batched, actions=20), 1, batched)
+    per_call = CountingBackend(call_ns, bulk=False)
+    run_program(chord_tracks(chord, 0.002, per_call, actions=20), 1, per_call)
+    assert len(batched) == len(per_call) == chord * 40
+    assert max(skews(batched, chord)) <= min(skews(per_call, chord))
+    # Each input after the first waited behind at least one whole call
+    assert min(skews(per_call, chord)) >= (chord - 1) * call_ns
@@ -0,0 +1,85 @@
+import os
+
+from engine.backends import RecordingBackend
+from engine.binmacro import MacroFile, encode
+from engine.library import MacroLibrary
+from engine.optimizer import optimize
+from engine.program import compile_sequence
+
+
+def row(type_, value="", hold=0.1, wait=0.1):
+    return {"type": type_, "value": value, "hold": hold, "wait": wait}
+
+
+LAP = [
+    row("key", "w", hold=1.5, wait=0.0),
+    row("repeat", "3"),
+    row("key", "space", hold="$tap", wait=0.05),
+    row("repeat", "$turns"),
+    row("mouse", "left", hold=0.02, wait="$gap"),
+    row("end"),
+    row("wait", "", wait=0.25),
+    row("end"),
+    row("key", "é", hold=0.0, wait=0.0),
+]
+CALLS = [row("call", "pit stop"), row("key", "a")]
+VARIABLES = {"tap": 0.05, "turns": 2.0, "gap": 0.125}
+
+
+def test_a_multi_track_body_survives_json_to_binary_and_back(tmp_path):
+    body = {"tracks": [LAP, CALLS], "vars": VARIABLES}
+    library = MacroLibrary(str(tmp_path))
+    library.save("lap", body)
+    library.save("lap", library.load("lap"), binary=True)
+    assert library.is_binary("lap")
+    assert not os.path.exists(library.path("lap"))
+    assert library.load("lap") == body
+    library.save("lap", library.load("lap"), binary=False)
+    assert not os.path.exists(library.binary_path("lap"))
+    assert library.load("lap") == body
+
+
+def test_a_plain_list_stays_a_plain_list(tmp_path):
+    library = MacroLibrary(str(tmp_path))
+    library.save("lap", LAP, binary=True)
+    assert library.load("lap") == LAP
+    with library.mapped("lap") as macro_file:
+        assert macro_file.plain
+        assert macro_file.variables == {}
+
+
+def test_rows_and_columns_read_single_records(tmp_path):
+    path = tmp_path / "lap.fzm"
+    path.write_bytes(encode([LAP, CALLS], VARIABLES))
+    with MacroFile(str(path)) as macro_file:
+        assert len(macro_file) == 2
+        assert macro_file.variables == VARIABLES
+        assert [macro_file.row(0, n) for n in range(macro_file.rows(0))] == LAP
+        types, values, holds, waits, hold_refs, wait_refs = macro_file.columns(0)
+        strings = macro_file.strings
+        assert [strings[value] for value in values] == [action["value"] for action in LAP]
+        assert [strings[ref] if ref else hold for hold, ref in zip(holds, hold_refs)] == \
+            [action["hold"] for action in LAP]
+        assert [strings[ref] if ref else wait for wait, ref in zip(waits, wait_refs)] == \
+            [action["wait"] for action in LAP]
+        del types, values, holds, waits, hold_refs, wait_refs
+
+
+def test_the_stored_program_is_what_compile_sequence_builds(tmp_path):
+    path = tmp_path / "lap.fzm"
+    path.write_bytes(encode([LAP, CALLS], VARIABLES))
+    backend = RecordingBackend()
+    sequence, _ = optimize(LAP, VARIABLES)
+    compiled = compile_sequence(sequence, backend)
+    with MacroFile(str(path)) as macro_file:
+        mapped = macro_file.program(0, backend)
+        assert list(mapped.ops) == list(compiled.ops)
+        assert list(mapped.args) == list(compiled.args)
+        assert list(mapped.durs) == list(compiled.durs)
+        assert list(mapped.rows) == list(compiled.rows)
+        assert mapped.codes == compiled.codes
+        assert mapped.source_len == compiled.source_len
+        # Calls are compiled when played, since the called macro may change
+        assert macro_file.program(1, backend) is None
+        assert macro_file.programs(backend) is None
+        del mapped
@@ -0,0 +1,49 @@
+from engine import commands as commands_module
+from engine.commands import IDLE, PLAYING, START, STOP, TOGGLE, CommandQueue, transition
+
+MS = 1_000_000
+
+
+def test_a_toggle_that_already_stopped_is_not_read_as_a_start():
+    commands = CommandQueue()
+    # The hook thread stopped the run, which has ended by the time the GUI looks
+    commands.push(TOGGLE, None, STOP)
+    assert commands.drain() == [(STOP, None)]
+    assert transition(IDLE, STOP) is None
+
+
+def test_a_held_toggle_is_debounced_as_the_key_pressed():
+    commands = CommandQueue()
+    commands.push(TOGGLE, None, STOP)
+    # Auto-repeats of the same hotkey find nothing playing any more
+    commands.push(TOGGLE)
+    commands.push(TOGGLE)
+    assert commands.drain() == [(STOP, None)]
+
+
+def test_a_toggle_queued_as_a_stop_keeps_the_toggles_debounce_window(monkeypatch):
+    clock = [0]
+    monkeypatch.setattr(commands_module, "now_ns", lambda: clock[0])
+    commands = CommandQueue(debounce_ns=100 * MS)
+    # The hook thread stopped the run and queued the toggle as what it did
+    commands.push(TOGGLE, None, STOP)
+    clock[0] = 50 * MS
+    commands.push(TOGGLE)
+    # The stop key is a different key, so the stopped toggle doesn't swallow it
+    commands.push(STOP)
+    assert commands.drain() == [(STOP, None), (STOP, None)]
+    # Each bounce restarts the window, measured from the toggle
+    clock[0] = 140 * MS
+    commands.push(TOGGLE)
+    assert commands.drain() == []
+    clock[0] = 250 * MS
+    commands.push(TOGGLE)
+    assert commands.drain() == [(TOGGLE, None)]
+
+
+def test_a_toggle_queued_while_idle_still_starts():
+    commands = CommandQueue()
+    commands.push(TOGGLE, "lap")
+    assert commands.drain() == [(TOGGLE, "lap")]
+    assert transition(IDLE, TOGGLE) == START
+    assert transition(PLAYING, TOGGLE) == STOP
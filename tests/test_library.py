@@ -0,0 +1,60 @@
+import json
+import os
+
+from engine.library import MacroLibrary
+from engine.soak import file_digest, macro_digest
+
+TAP = {"type": "key", "value": "a", "hold": 0.1, "wait": 0.1}
+
+
+def write_behind_its_back(library, name, body):
+    with open(os.path.join(library.root, name + ".json"), "w") as f:
+        json.dump(body, f)
+
+
+def test_reopening_notices_macros_added_edited_and_deleted_outside(tmp_path):
+    library = MacroLibrary(str(tmp_path))
+    library.save("kept", [TAP], tags=["race"])
+    library.save("edited", [TAP], tags=["drift"])
+    library.save("deleted", [TAP])
+
+    write_behind_its_back(library, "copied", [TAP, TAP, TAP])
+    write_behind_its_back(library, "edited", [TAP, TAP])
+    os.remove(library.path("deleted"))
+
+    reopened = MacroLibrary(str(tmp_path))
+    assert reopened.names() == ["copied", "edited", "kept"]
+    assert reopened.get("copied")["actions"] == 3
+    assert reopened.get("edited")["actions"] == 2
+    # Tags live only in the index and survive the re-index
+    assert reopened.get("edited")["tags"] == ["drift"]
+    assert reopened.get("kept")["tags"] == ["race"]
+    # ... and the refreshed index was written back
+    assert MacroLibrary(str(tmp_path)).get("copied")["actions"] == 3
+
+
+def test_unchanged_macros_are_not_read_again(tmp_path, monkeypatch):
+    library = MacroLibrary(str(tmp_path))
+    library.save("one", [TAP])
+    library.save("two", [TAP])
+    write_behind_its_back(library, "three", [TAP])
+
+    read = []
+    original = MacroLibrary._read_json
+    monkeypatch.setattr(MacroLibrary, "_read_json", lambda self, path: read.append(path) or original(self, path))
+    reopened = MacroLibrary(str(tmp_path))
+    assert read == [reopened.path("three")]
+    assert reopened.refresh() is False
+    assert len(read) == 1
+
+
+def test_the_digest_of_a_saved_macro_matches_its_unsaved_body(tmp_path):
+    library = MacroLibrary(str(tmp_path))
+    body = {"tracks": [[TAP], [TAP, TAP]], "vars": {"tap": 0.05}}
+    for binary in (False, True):
+        library.save("lap", body, binary=binary)
+        saved = file_digest(library.body_path("lap"))
+        # What the GUI records for a table that was never saved, and what the CLI checks
+        assert saved == macro_digest(library.encode(body, binary))
+        library.save("lap", [TAP], binary=binary)
+        assert file_digest(library.body_path("lap")) != saved
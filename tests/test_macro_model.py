@@ -0,0 +1,56 @@
+import pytest
+
+pytest.importorskip("PySide6")
+
+from engine.store import COL_TYPE, COL_VALUE, ActionStore
+from ui.macro_model import ActionTableModel
+
+
+def make_model(*rows):
+    store = ActionStore()
+    for row, (type_, value) in enumerate(rows):
+        store.insert(row, type_, value)
+    return ActionTableModel(store, ["up", "a", "left"], ["left", "right"])
+
+
+def test_recommitting_the_same_type_keeps_the_value():
+    model = make_model(("key", "a"), ("mouse", "right"))
+    edits = []
+    model.edited.connect(lambda *edit: edits.append(edit))
+    assert model.setData(model.index(0, COL_TYPE), "key")
+    assert model.setData(model.index(1, COL_TYPE), "mouse")
+    assert model.store.value(0) == "a"
+    assert model.store.value(1) == "right"
+    assert edits == []
+
+
+def test_switching_type_keeps_a_value_valid_for_the_new_type():
+    model = make_model(("mouse", "left"))
+    model.setData(model.index(0, COL_TYPE), "key")
+    assert model.store.value(0) == "left"
+
+
+def test_switching_type_resets_an_invalid_value():
+    model = make_model(("key", "a"), ("key", "up"))
+    model.setData(model.index(0, COL_TYPE), "mouse")
+    model.setData(model.index(1, COL_TYPE), "repeat")
+    assert model.store.value(0) == "left"
+    assert model.store.value(1) == "2"
+    model.setData(model.index(1, COL_VALUE), "$laps")
+    model.setData(model.index(1, COL_TYPE), "repeat")
+    assert model.store.value(1) == "$laps"
+
+
+def test_undoing_splices_restores_the_rows():
+    model = make_model(("key", "a"), ("key", "up"), ("mouse", "left"))
+    original = [model.store.row_tuple(row) for row in range(len(model.store))]
+    edits = []
+    model.edited.connect(lambda row, old, new: edits.append((row, old, new)))
+    model.splice(1, 1, [("key", "left", 0.2, 0.0), ("wait", "", 0.1, 0.5)])
+    model.splice(0, 2, [])
+    model.insert_row(1, "mouse", "right", 0.1, 0.1)
+    assert len(edits) == 3
+    # What undo_edit does with each recorded edit, newest first
+    for row, old, new in reversed(edits):
+        model.splice(row, len(new), old)
+    assert [model.store.row_tuple(row) for row in range(len(model.store))] == original
@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+from engine.backends import RecordingBackend
+from engine.optimizer import SequenceError, optimize
+from engine.program import compile_sequence
+from engine.runner import MacroRunner
+from engine.trace import Tracer
+
+
+def row(type_, value="", hold=0.001, wait=0.001):
+    return {"type": type_, "value": value, "hold": hold, "wait": wait}
+
+
+def unoptimized(actions):
+    """What the rows play as one by one: a press and its wait per row, repeats unrolled."""
+    sequence = []
+    stack = [(None, sequence)]
+    for action in actions:
+        type_ = action["type"]
+        if type_ == "repeat":
+            stack.append((int(action["value"]), []))
+        elif type_ == "end":
+            count, body = stack.pop()
+            stack[-1][1].extend(body * count)
+        elif type_ == "wait":
+            stack[-1][1].append({"type": "wait", "value": action["wait"]})
+        else:
+            stack[-1][1].append({"type": type_, "value": action["value"], "hold": action["hold"]})
+            stack[-1][1].append({"type": "wait", "value": action["wait"]})
+    return sequence
+
+
+def timeline(sequence):
+    """(planned ns from the start, opcode, code) of every input the sequence plays."""
+    backend = RecordingBackend()
+    tracer = Tracer()
+    runner = MacroRunner(compile_sequence(sequence, backend), 1, threading.Event(), backend, tracer=tracer)
+    runner.run()
+    planned = [event[4] - runner.start_ns for event in tracer.events() if event[2] > 0]
+    return list(zip(planned, backend.ops, backend.codes))
+
+
+def assert_same_timeline(actions):
+    sequence, report = optimize(actions)
+    assert timeline(sequence) == timeline(unoptimized(actions))
+    return sequence, report
+
+
+def test_adjacent_waits_merge_and_empty_rows_drop():
+    actions = [
+        row("key", "a", wait=0.002),
+        row("wait", wait=0.003),
+        row("wait", wait=0.0),
+        row("key", "", hold=0.004, wait=0.001),
+        row("wait", wait=0.001),
+        row("mouse", "left"),
+    ]
+    sequence, report = assert_same_timeline(actions)
+    assert [action["type"] for action in sequence] == ["key", "wait", "mouse", "wait"]
+    # A key row with no key holds nothing, so only its wait is kept
+    assert sequence[1]["value"] == pytest.approx(0.002 + 0.003 + 0.001 + 0.001)
+    assert report.dropped == 2
+    assert report.waits_merged == 3
+
+
+def test_identical_rows_fold_into_a_repeat():
+    actions = [row("key", "a")] + [row("key", "b")] * 5 + [row("key", "c")]
+    sequence, report = assert_same_timeline(actions)
+    assert [action["type"] for action in sequence] == ["key", "wait", "repeat", "key", "wait"]
+    assert sequence[2]["count"] == 5
+    assert (report.repeats_folded, report.rows_folded) == (1, 5)
+
+
+def test_blocks_of_up_to_eight_rows_fold():
+    block = [row("key", key) for key in "abcdefgh"]
+    sequence, report = assert_same_timeline(block * 3)
+    assert len(sequence) == 1
+    assert sequence[0]["count"] == 3
+    assert [action["value"] for action in sequence[0]["body"] if action["type"] == "key"] == list("abcdefgh")
+    assert report.rows_folded == 24
+
+
+def test_a_block_longer_than_eight_rows_is_not_folded():
+    block = [row("key", key) for key in "abcdefghi"]
+    sequence, report = assert_same_timeline(block * 2)
+    assert report.repeats_folded == 0
+    assert all(action["type"] != "repeat" for action in sequence)
+
+
+def test_folding_inside_repeat_blocks_keeps_the_timeline():
+    actions = [row("repeat", "2"), row("key", "a"), row("key", "a"), row("wait", wait=0.002), row("end"),
+               row("mouse", "right")]
+    assert_same_timeline(actions)
+
+
+@pytest.mark.parametrize("actions, row_number, message", [
+    ([row("key", "a"), row("key", "b", hold=-1.0)], 1, "non-negative"),
+    ([row("key", "a"), row("wait", wait="soon")], 1, "not a number"),
+    ([row("key", "a"), row("end")], 1, "end without a repeat"),
+    ([row("repeat", "2"), row("key", "a"), row("key", "b")], 2, "never ended"),
+    ([row("repeat", "1.5"), row("end")], 0, "whole number"),
+    ([row("key", "a"), row("shout", "a")], 1, "unknown action type"),
+    ([row("key", "a"), row("call", "")], 1, "call needs"),
+])
+def test_errors_name_the_row(actions, row_number, message):
+    with pytest.raises(SequenceError, match=message) as raised:
+        optimize(actions)
+    assert raised.value.row == row_number
+    assert str(raised.value).startswith(f"Row {row_number + 1}:")
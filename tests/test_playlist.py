@@ -0,0 +1,127 @@
+import threading
+
+from engine.backends import RecordingBackend
+from engine.library import MacroLibrary
+from engine.playlist import Playlist
+from engine.runner import MacroRunner
+from engine.soak import Checkpointer
+
+TAP = {"type": "key", "value": "a", "hold": 0.001, "wait": 0.001}
+UNTIL = {"type": "until", "value": "finish line", "hold": 0.0, "wait": 0.05}
+
+
+class FakeScreen:
+    """Answers until rows without a display, and remembers where it was prepared."""
+
+    def __init__(self, known=("finish line",)):
+        self.known = set(known)
+        self.prepared_on = []
+
+    def prepare(self, names):
+        self.prepared_on.append(threading.current_thread())
+        for name in names:
+            if name not in self.known:
+                raise ValueError(f"No screen reference named {name!r}")
+
+    def matches(self, name):
+        return True
+
+
+class ListLog:
+    """Keeps checkpoints in memory instead of appending them to a file."""
+
+    def __init__(self):
+        self.records = []
+
+    def append(self, record):
+        self.records.append(record)
+
+    def close(self):
+        pass
+
+
+class PositionBackend(RecordingBackend):
+    """Notes the telemetry's playlist position at every press."""
+
+    def __init__(self):
+        super().__init__()
+        self.telemetry = None
+        self.positions = []
+
+    def key_down(self, code):
+        self.positions.append(self.telemetry.entry_position)
+        super().key_down(code)
+
+
+def play(library, entries, screen=None):
+    backend = RecordingBackend()
+    playlist = Playlist(entries, library, backend, screen=screen)
+    programs, loops = playlist.first()
+    runner = MacroRunner(programs, loops, threading.Event(), backend, playlist=playlist)
+    errors = []
+    runner.run = _catching(runner.run, errors)
+    runner.start()
+    runner.join(5)
+    assert not runner.is_alive()
+    assert errors == []
+    return runner, playlist, backend
+
+
+def _catching(run, errors):
+    def wrapped():
+        try:
+            run()
+        except BaseException as e:
+            errors.append(e)
+    return wrapped
+
+
+def test_until_references_are_loaded_by_the_loader_thread(tmp_path):
+    library = MacroLibrary(str(tmp_path))
+    library.save("warmup", [TAP])
+    library.save("race", [UNTIL, TAP])
+    screen = FakeScreen()
+    runner, playlist, backend = play(library, [("warmup", 2), ("race", 1)], screen)
+    assert playlist.error is None
+    assert runner.telemetry.loops == 3
+    assert len(backend) == 6
+    assert screen.prepared_on and threading.main_thread() not in screen.prepared_on
+
+
+def test_a_failed_hand_off_ends_the_run_and_reports_why(tmp_path):
+    library = MacroLibrary(str(tmp_path))
+    library.save("warmup", [TAP])
+    library.save("race", [dict(UNTIL, value="no such reference"), TAP])
+    # Without a screen the playlist creates a real matcher: the reference is
+    # missing, or numpy is, and either way the loader records the error
+    runner, playlist, backend = play(library, [("warmup", 2), ("race", 1)])
+    assert playlist.error is not None
+    assert runner.telemetry.loops == 2
+    assert len(backend) == 4
+    assert runner.held == set()
+
+
+def test_a_missing_reference_in_a_later_entry_is_reported(tmp_path):
+    library = MacroLibrary(str(tmp_path))
+    library.save("warmup", [TAP])
+    library.save("race", [UNTIL, TAP])
+    runner, playlist, _ = play(library, [("warmup", 1), ("race", 1)], FakeScreen(known=()))
+    assert "finish line" in str(playlist.error)
+    assert runner.telemetry.loops == 1
+
+
+
+def test_the_playlist_position_moves_on_with_the_entry(tmp_path):
+    library = MacroLibrary(str(tmp_path))
+    library.save("warmup", [TAP])
+    library.save("race", [TAP])
+    backend = PositionBackend()
+    playlist = Playlist([("warmup", 2), ("race", 3)], library, backend)
+    programs, loops = playlist.first()
+    runner = MacroRunner(programs, loops, threading.Event(), backend, playlist=playlist)
+    backend.telemetry = runner.telemetry
+    runner.run()
+    # Each press sees its own entry, with the loops of that entry done so far
+    assert backend.positions == [(0, 0), (0, 1), (1, 0), (1, 1), (1, 2)]
+    record = Checkpointer(runner, ListLog(), None).checkpoint(final=True)
+    assert (record["macro"], record["entry"], record["entry_loop"], record["loop"]) == ("race", 1, 3, 5)
@@ -0,0 +1,102 @@
+import threading
+
+import pytest
+
+from engine.backends import RecordingBackend
+from engine.optimizer import SequenceError, optimize
+from engine.program import OP_CALL, OP_KEY_DOWN, OP_REPEAT, OP_RETURN, compile_sequence
+from engine.runner import MacroRunner
+
+
+def row(type_, value="", hold=0.001, wait=0.001):
+    return {"type": type_, "value": value, "hold": hold, "wait": wait}
+
+
+def compile_rows(actions, variables=None, macros=None):
+    """(program, backend) for table rows; macros maps a called name to its (actions, variables)."""
+    backend = RecordingBackend()
+    resolve_call = macros.__getitem__ if macros is not None else None
+    sequence, _ = optimize(actions, variables, resolve_call)
+    return compile_sequence(sequence, backend), backend
+
+
+def presses(program, backend):
+    """Codes of the keys and buttons one loop of program presses, in order."""
+    MacroRunner(program, 1, threading.Event(), backend).run()
+    return [code for op, code in zip(backend.ops, backend.codes) if op == OP_KEY_DOWN]
+
+
+def test_nested_repeats_play_the_product_of_their_counts():
+    actions = [
+        row("repeat", "$laps"),
+        row("key", "a"),
+        row("repeat", "3"),
+        row("key", "b"),
+        row("end"),
+        row("end"),
+    ]
+    program, backend = compile_rows(actions, {"laps": 2.0})
+    # Loops stay loops: one body of each, not six copies of b
+    assert list(program.ops).count(OP_REPEAT) == 2
+    assert list(program.ops).count(OP_KEY_DOWN) == 2
+    a, b = backend.resolve_key("a"), backend.resolve_key("b")
+    assert presses(program, backend) == [a, b, b, b] * 2
+
+
+def test_call_sites_share_one_subroutine():
+    macros = {"pit stop": ([row("key", "p"), row("key", "q")], {})}
+    actions = [row("call", "pit stop"), row("key", "a"), row("call", "pit stop")]
+    program, backend = compile_rows(actions, macros=macros)
+    ops = list(program.ops)
+    assert ops.count(OP_CALL) == 2
+    # The main code's return, then the subroutine's, laid out once
+    assert ops.count(OP_RETURN) == 2
+    p, q = backend.resolve_key("p"), backend.resolve_key("q")
+    assert sum(program.codes[program.args[pc]] == p for pc in range(len(ops)) if ops[pc] == OP_KEY_DOWN) == 1
+    assert presses(program, backend) == [p, q, backend.resolve_key("a"), p, q]
+    # Lateness inside the shared body is reported against the first call's row
+    assert [program.rows[pc] for pc in range(len(ops)) if ops[pc] == OP_KEY_DOWN] == [1, 0, 0]
+
+
+def test_nested_calls_resolve_each_macros_own_variables():
+    macros = {
+        "outer": ([row("call", "inner"), row("key", "o", hold="$hold")], {"hold": 0.002}),
+        "inner": ([row("repeat", "$n"), row("key", "i"), row("end")], {"n": 2.0}),
+    }
+    program, backend = compile_rows([row("call", "outer")], macros=macros)
+    i, o = backend.resolve_key("i"), backend.resolve_key("o")
+    assert presses(program, backend) == [i, i, o]
+
+
+@pytest.mark.parametrize("actions, variables, row_number", [
+    ([row("key", "a"), row("key", "b", hold="$tap")], {}, 1),
+    ([row("repeat", "$laps"), row("key", "a"), row("end")], {"tap": 0.1}, 0),
+    ([row("key", "a", wait="$gap")], None, 0),
+])
+def test_an_undefined_variable_names_its_row(actions, variables, row_number):
+    with pytest.raises(SequenceError, match=r"undefined variable \$") as raised:
+        optimize(actions, variables)
+    assert raised.value.row == row_number
+
+
+def test_an_undefined_variable_inside_a_called_macro_names_the_call():
+    macros = {"pit stop": ([row("key", "p", hold="$tap")], {})}
+    with pytest.raises(SequenceError, match=r"in 'pit stop', Row 1: undefined variable \$tap") as raised:
+        compile_rows([row("key", "a"), row("call", "pit stop")], macros=macros)
+    assert raised.value.row == 1
+
+
+def test_a_call_cycle_is_rejected():
+    macros = {
+        "A": ([row("key", "a"), row("call", "B")], {}),
+        "B": ([row("call", "A")], {}),
+    }
+    with pytest.raises(SequenceError, match="call cycle: A -> B -> A") as raised:
+        compile_rows([row("key", "x"), row("call", "A")], macros=macros)
+    assert raised.value.row == 1
+
+
+def test_a_macro_calling_itself_is_rejected():
+    macros = {"A": ([row("call", "A")], {})}
+    with pytest.raises(SequenceError, match="call cycle: A -> A"):
+        compile_rows([row("call", "A")], macros=macros)
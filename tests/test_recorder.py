@@ -0,0 +1,64 @@
+import threading
+from types import SimpleNamespace
+
+from engine.program import OP_KEY_DOWN, OP_KEY_UP, OP_MOUSE_DOWN, OP_MOUSE_UP
+from engine.recorder import Recorder
+
+EVENTS_PER_SOURCE = 20_000
+
+
+def hammer(callback, events):
+    def run():
+        for event in events:
+            callback(event)
+    return threading.Thread(target=run)
+
+
+def test_mixed_bursts_from_both_listener_threads_are_all_kept():
+    recorder = Recorder()
+    keys = [SimpleNamespace(event_type='down' if i % 2 == 0 else 'up', name=f"k{i // 2}")
+            for i in range(EVENTS_PER_SOURCE)]
+    buttons = [SimpleNamespace(event_type='down' if i % 2 == 0 else 'up', button=f"b{i // 2}")
+               for i in range(EVENTS_PER_SOURCE)]
+    threads = [hammer(recorder._on_key, keys), hammer(recorder._on_mouse, buttons)]
+    for thread in threads:
+        thread.start()
+    # Drain while the bursts are still coming in, like the drain thread does
+    while any(thread.is_alive() for thread in threads):
+        recorder._drain()
+    for thread in threads:
+        thread.join()
+    recorder._drain()
+    recorder._merge()
+
+    assert recorder.dropped == 0
+    assert len(recorder.ops) == 2 * EVENTS_PER_SOURCE
+    assert list(recorder.times) == sorted(recorder.times)
+    key_names = [n for n, op in zip(recorder.names, recorder.ops) if op in (OP_KEY_DOWN, OP_KEY_UP)]
+    button_names = [n for n, op in zip(recorder.names, recorder.ops) if op in (OP_MOUSE_DOWN, OP_MOUSE_UP)]
+    assert key_names == [event.name for event in keys]
+    assert button_names == [event.button for event in buttons]
+
+
+def test_a_ring_that_overflows_between_drains_counts_what_it_lost():
+    recorder = Recorder(capacity=8)
+    for i in range(10):
+        recorder._on_key(SimpleNamespace(event_type='down', name=str(i)))
+    recorder._drain()
+    recorder._merge()
+    assert recorder.dropped == 2
+    assert recorder.names == [str(i) for i in range(2, 10)]
+
+
+def test_a_double_click_records_as_two_clicks_and_nameless_keys_are_skipped():
+    recorder = Recorder()
+    # What the mouse package sends for a double click on Windows
+    for event_type in ('down', 'up', 'double', 'up'):
+        recorder._on_mouse(SimpleNamespace(event_type=event_type, button='left'))
+    recorder._on_key(SimpleNamespace(event_type='down', name=None))
+    recorder._on_key(SimpleNamespace(event_type='up', name=None))
+    recorder._drain()
+    recorder._merge()
+    assert list(recorder.ops) == [OP_MOUSE_DOWN, OP_MOUSE_UP, OP_MOUSE_DOWN, OP_MOUSE_UP, OP_MOUSE_UP]
+    actions = recorder.to_actions()
+    assert [(action["type"], action["value"]) for action in actions] == [("mouse", "left")] * 2
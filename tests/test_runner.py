@@ -0,0 +1,45 @@
+import threading
+import time
+
+from engine.backends import RecordingBackend
+from engine.program import compile_sequence
+from engine.runner import MacroRunner
+from engine.timing import now_ns
+
+MS = 1_000_000
+
+
+def play(sequence, loops, stop_event=None):
+    """(runner, backend, ns the run took) for sequence played loops times."""
+    backend = RecordingBackend()
+    runner = MacroRunner(compile_sequence(sequence, backend), loops, stop_event or threading.Event(), backend)
+    started = now_ns()
+    runner.run()
+    return runner, backend, now_ns() - started
+
+
+def test_a_wait_only_macro_takes_its_planned_time():
+    runner, backend, elapsed = play([{"type": "wait", "value": 0.2}], 3)
+    assert len(backend) == 0
+    assert runner.telemetry.loops == 3
+    assert 600 * MS <= elapsed < 700 * MS
+    assert runner.telemetry.last_loop_ns >= 195 * MS
+
+
+def test_the_last_loop_sits_out_its_trailing_wait():
+    tap = {"type": "key", "value": "a", "hold": 0.01}
+    runner, backend, elapsed = play([tap, {"type": "wait", "value": 0.1}], 2)
+    assert len(backend) == 4
+    # The second press comes a whole loop after the first, and the run ends a loop after that
+    assert backend.times[2] - backend.times[0] >= 110 * MS
+    assert elapsed >= 220 * MS
+    assert runner.telemetry.last_loop_ns >= 105 * MS
+
+
+def test_a_trailing_wait_still_stops_at_once():
+    stop_event = threading.Event()
+    threading.Timer(0.05, stop_event.set).start()
+    started = time.perf_counter()
+    runner, _, _ = play([{"type": "wait", "value": 10.0}], float('inf'), stop_event)
+    assert time.perf_counter() - started < 1.0
+    assert runner.telemetry.loops == 0
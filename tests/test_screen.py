@@ -0,0 +1,118 @@
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from engine.backends import RecordingBackend
+from engine.program import compile_sequence
+from engine.runner import MacroRunner
+from engine.screen import Reference, ReferenceStore, ScreenMatcher, downsample
+from engine.timing import POLL_INTERVAL_NS, now_ns
+
+REGION = (100, 50, 64, 48)
+MS = 1_000_000
+
+
+def finish_line():
+    """A synthetic 'finish line' banner: a white bar across a dark frame."""
+    frame = np.full((REGION[3], REGION[2], 3), 30, dtype=np.uint8)
+    frame[16:32, :, :] = 240
+    return frame
+
+
+class FakeGrab:
+    """Serves a blank frame until appear_after_ns past the first grab, then the target.
+
+    Remembers when it was asked, and for which region.
+    """
+
+    def __init__(self, target, appear_after_ns=None):
+        self.target = target
+        self.blank = np.zeros_like(target)
+        self.appear_after_ns = appear_after_ns
+        self.times = []
+        self.regions = []
+
+    def __call__(self, region):
+        now = now_ns()
+        self.times.append(now)
+        self.regions.append(region)
+        if self.appear_after_ns is None or now - self.times[0] < self.appear_after_ns:
+            return self.blank
+        return self.target
+
+
+def make_matcher(tmp_path, grab):
+    store = ReferenceStore(str(tmp_path))
+    store.save(Reference("finish line", REGION, downsample(finish_line())))
+    return ScreenMatcher(store, grab=grab)
+
+
+def run_until(matcher, timeout):
+    """Play an until row followed by one tap; (runner, ns from start to the press)."""
+    backend = RecordingBackend()
+    sequence = [
+        {"type": "until", "value": "finish line", "timeout": timeout},
+        {"type": "key", "value": "a", "hold": 0.001},
+    ]
+    runner = MacroRunner(compile_sequence(sequence, backend), 1, threading.Event(), backend, screen=matcher)
+    runner.run()
+    assert len(backend) == 2
+    return runner, backend.times[0] - runner.start_ns
+
+
+def test_reference_matches_within_tolerance():
+    reference = Reference("finish line", REGION, downsample(finish_line()))
+    noisy = finish_line()
+    noisy[::2, ::2] += 3
+    assert reference.matches(finish_line())
+    assert reference.matches(noisy)
+    assert not reference.matches(np.zeros_like(noisy))
+    # A capture of another size, e.g. after a resolution change, never matches
+    assert reference.difference(finish_line()[:24]) == float('inf')
+
+
+def test_reference_survives_a_save_and_load(tmp_path):
+    matcher = make_matcher(tmp_path, FakeGrab(finish_line(), appear_after_ns=0))
+    matcher.prepare(["finish line"])
+    assert matcher.references["finish line"].region == REGION
+    assert matcher.matches("finish line")
+    assert matcher.grab.regions == [REGION]
+
+
+def test_unknown_reference_is_reported(tmp_path):
+    matcher = make_matcher(tmp_path, FakeGrab(finish_line()))
+    with pytest.raises(ValueError, match="no such banner"):
+        matcher.prepare(["no such banner"])
+
+
+def test_until_goes_on_as_soon_as_the_reference_shows(tmp_path):
+    grab = FakeGrab(finish_line(), appear_after_ns=50 * MS)
+    runner, pressed_after = run_until(make_matcher(tmp_path, grab), timeout=2.0)
+    assert runner.telemetry.until_timeouts == 0
+    assert 50 * MS <= pressed_after < 50 * MS + 5 * POLL_INTERVAL_NS
+
+
+def test_until_hits_on_the_first_poll_without_waiting(tmp_path):
+    grab = FakeGrab(finish_line(), appear_after_ns=0)
+    runner, pressed_after = run_until(make_matcher(tmp_path, grab), timeout=2.0)
+    assert runner.telemetry.until_timeouts == 0
+    assert len(grab.times) == 1
+    assert pressed_after < POLL_INTERVAL_NS
+
+
+def test_until_times_out_when_the_reference_never_shows(tmp_path):
+    grab = FakeGrab(finish_line())
+    runner, pressed_after = run_until(make_matcher(tmp_path, grab), timeout=0.1)
+    assert runner.telemetry.until_timeouts == 1
+    assert 100 * MS <= pressed_after < 100 * MS + 5 * POLL_INTERVAL_NS
+
+
+def test_until_polls_once_per_interval(tmp_path):
+    grab = FakeGrab(finish_line())
+    run_until(make_matcher(tmp_path, grab), timeout=0.1)
+    gaps = [b - a for a, b in zip(grab.times, grab.times[1:])]
+    # Rescheduled every POLL_INTERVAL_NS, with one last look at the timeout
+    assert 100 * MS // POLL_INTERVAL_NS <= len(grab.times) <= 100 * MS // POLL_INTERVAL_NS + 2
+    assert min(gaps[:-1]) >= POLL_INTERVAL_NS * 0.9
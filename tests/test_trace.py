@@ -0,0 +1,49 @@
+import threading
+
+from engine.backends import RecordingBackend
+from engine.bench import SinkBackend
+from engine.library import MacroLibrary
+from engine.playlist import Playlist
+from engine.program import OP_KEY_UP, OP_WAIT, compile_sequence
+from engine.runner import MacroRunner
+from engine.trace import Tracer
+
+# Long enough that a wait stamped before the release went out shows up clearly
+CALL_NS = 2_000_000
+
+
+def test_a_wait_starts_once_the_input_before_it_is_sent():
+    backend = SinkBackend(CALL_NS, bulk=False)
+    # A wait opening a block can't fold into the release before it, so it is traced on its own
+    tap = {"type": "key", "value": "a", "hold": 0.001}
+    sequence = [tap, {"type": "repeat", "count": 3, "body": [{"type": "wait", "value": 0.005}, tap]}]
+    tracer = Tracer()
+    MacroRunner(compile_sequence(sequence, backend), 2, threading.Event(), backend, tracer=tracer).run()
+    events = tracer.events()
+    releases = [event for event in events if event[2] == OP_KEY_UP]
+    waits = [event for event in events if event[2] == OP_WAIT]
+    assert len(waits) == 6
+    for wait in waits:
+        # (track, row, op, arg, planned, actual, dur): the wait began no earlier
+        # than the release planned for the same instant actually went out
+        sent = max(release[5] for release in releases if release[4] <= wait[4])
+        assert wait[5] >= sent
+
+
+def test_a_playlist_trace_names_each_entry_from_its_own_programs(tmp_path):
+    library = MacroLibrary(str(tmp_path))
+    tap = lambda key: {"type": "key", "value": key, "hold": 0.001, "wait": 0.001}
+    library.save("two", {"tracks": [[tap("a")], [tap("b")]]})
+    library.save("one", [tap("c")])
+    backend = RecordingBackend()
+    playlist = Playlist([("two", 1), ("one", 2)], library, backend)
+    programs, loops = playlist.first()
+    tracer = Tracer()
+    MacroRunner(programs, loops, threading.Event(), backend, tracer=tracer, playlist=playlist).run()
+    assert playlist.error is None
+
+    presses = [(event["tid"], event["args"]["input"])
+               for event in tracer.to_chrome()["traceEvents"] if event["name"] == "key_down"]
+    assert sorted(presses[:2]) == [(1, str(backend.codes[0])), (2, str(backend.codes[1]))]
+    assert presses[2:] == [(1, str(backend.codes[4]))] * 2
+    assert len({str(code) for code in backend.codes}) == 3